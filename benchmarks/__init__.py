@@ -0,0 +1 @@
+"""Prestandamätningar för Bengtssons Trävaror MCP-server (körs offline)."""
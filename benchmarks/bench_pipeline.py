@@ -0,0 +1,216 @@
+"""Mäter hela kedjan klient -> MCP-server -> Gmail/LLM mot fejkade tjänster, helt offline.
+
+Kör: python -m benchmarks.bench_pipeline                          (1 000 mail)
+     python -m benchmarks.bench_pipeline --size 100000 --page-size 200 --bulk
+     python -m benchmarks.bench_pipeline --inbox inbox.json --llm-latency 0.5 --concurrency 16
+     python -m benchmarks.bench_pipeline --batch-size 20 --no-rules --metrics
+
+Klienten (MailAgent i mcp_client.py) och servern (server.py) körs i samma
+process och pratar MCP över en minnesström i stället för stdio. Servern
+använder en riktig GmailClient mot en fejkad Gmail-tjänst
+(benchmarks/fake_gmail.py) med en syntetisk inkorg
+(benchmarks/inbox_gen.py), och all LLM-trafik går till en deterministisk
+fejk-LLM över HTTP (benchmarks/fake_llm.py). Svaren köas i utkorgen och
+skickas till den fejkade Gmail-tjänsten; tiden räknas tills utkorgen är tom.
+
+Rapporten visar genomströmning, p50/p95/p99 per verktyg (mätt i klienten,
+inklusive MCP) och processens högsta minnesanvändning (peak RSS).
+Historik, utkorg och Gmail-status sparas i en temporär katalog.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+
+# Sätts före importen av core, server och mcp_client som läser dem vid import
+os.environ.update({
+    "USE_GMAIL": "true",
+    "SEND_REAL_EMAILS": "true",
+    "MAIL_TRANSPORT": "gmail",
+    "GMAIL_MAX_RESULTS": "0",
+    "GMAIL_INCREMENTAL_SYNC": "false",
+    "GMAIL_PUSH_TOPIC": "",
+    "PUSH_WEBHOOK_PORT": "0",
+    "GEMINI_API_KEY": "bench",
+})
+os.environ.setdefault("LLM_CACHE", "false")  # Fejk-LLM:en svarar deterministiskt, cachen skulle dölja den
+os.environ.setdefault("MANAGER_EMAIL", "chef@bengtssons.example")
+
+from mcp.shared.memory import create_connected_server_and_client_session
+
+import server
+import mcp_client
+import core.llm
+import core.llm_cache
+import core.autoresponder
+import core.conversations
+from core.metrics import get_metrics, format_summary
+from core.outbox import Outbox
+from benchmarks.inbox_gen import generate_inbox
+from benchmarks.fake_gmail import FakeGmailService, FakeGmailClient
+from benchmarks.fake_llm import FakeLLMServer
+
+_SERIES = re.compile(r'^(\w+)\{tool="([^"]+)"\}$')
+
+
+def peak_rss_mb() -> float | None:
+    """Processens högsta minnesanvändning (MB), eller None där det inte går att mäta (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss är i byte på macOS och i kilobyte på Linux
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def per_tool(snapshot: dict, name: str) -> dict:
+    """Latenssammanfattningen per verktyg för en mätpunkt (t.ex. mcp_call_seconds)."""
+    tools = {}
+    for series, summary in snapshot["latency"].items():
+        match = _SERIES.match(series)
+        if match and match.group(1) == name:
+            tools[match.group(2)] = summary
+    return tools
+
+
+def _use_state_dir(state_dir: Path):
+    """Lägger historik, LLM-cache och Gmail-status i state_dir i stället för i repot."""
+    core.conversations.CONVERSATIONS_DB = state_dir / "conversations.db"
+    core.conversations.CONVERSATIONS_FILE = state_dir / "conversations.json"
+    core.llm_cache.LLM_CACHE_DB = state_dir / "llm_cache.db"
+    core.autoresponder.GMAIL_STATE_FILE = state_dir / "gmail_state.json"
+
+
+async def _drain(outbox: Outbox) -> dict:
+    """Väntar tills utkorgen har skickat allt. Returnerar utkorgens statistik."""
+    while True:
+        stats = await asyncio.to_thread(outbox.stats)
+        if not stats["pending"] and not stats["queued"]:
+            return stats
+        await asyncio.sleep(0.05)
+
+
+async def run_pipeline(args, inbox: list, gmail: FakeGmailService) -> dict:
+    """Kör klienten mot servern tills inkorgen är hanterad och utkorgen tom."""
+    state = tempfile.TemporaryDirectory(prefix="bench_pipeline_", ignore_cleanup_errors=True)
+    _use_state_dir(Path(state.name))
+    server._gmail_client = FakeGmailClient(gmail)
+    server._outbox = server.create_outbox(path=Path(state.name) / "outbox.db")
+    server._outbox.start()
+
+    get_metrics().reset()
+    output = contextlib.ExitStack()
+    if not args.verbose:
+        devnull = output.enter_context(open(os.devnull, "w", encoding="utf-8"))
+        output.enter_context(contextlib.redirect_stdout(devnull))
+        output.enter_context(contextlib.redirect_stderr(devnull))
+
+    with output:
+        async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+            agent = mcp_client.MailAgent(
+                session,
+                concurrency=args.concurrency,
+                batch_size=args.batch_size,
+                use_rules=not args.no_rules,
+                bulk=args.bulk,
+                page_size=args.page_size,
+                dedup=not args.no_dedup,
+            )
+            start = time.perf_counter()
+            handled = await agent.run()
+            handled_at = time.perf_counter() - start
+            outbox = await _drain(server._outbox)
+            elapsed = time.perf_counter() - start
+
+    state.cleanup()
+    dedup = agent.dedup.stats() if agent.dedup is not None else None
+    return {"handled": handled, "handled_at": handled_at, "elapsed": elapsed, "outbox": outbox, "dedup": dedup}
+
+
+def report(result: dict, inbox: list, gmail: FakeGmailService, llm: FakeLLMServer, show_stages: bool):
+    """Skriver ut genomströmning, latens per verktyg och minnesanvändning."""
+    snapshot = get_metrics().snapshot()
+    elapsed = result["elapsed"]
+
+    print(f"\n  Hanterade {result['handled']}/{len(inbox)} mail på {elapsed:.2f} s "
+          f"({result['handled'] / elapsed:.1f} mail/s, {result['handled'] / elapsed * 60:.0f} mail/min)")
+    print(f"  Klienten klar efter {result['handled_at']:.2f} s, utkorgen tom efter {elapsed:.2f} s "
+          f"({result['outbox']['sent']} skickade, {result['outbox']['failed']} misslyckade)")
+    print(f"  Gmail: {gmail.calls['http']} HTTP-anrop ({gmail.calls['batch']} batch), "
+          f"LLM: {llm.requests} anrop")
+    resends = sum("duplicate_of" in email for email in inbox)
+    if result["dedup"] is not None:
+        dedup = result["dedup"]
+        print(f"  Dubbletter: {dedup['folded']} vikta ({dedup['exact']} exakta, {dedup['near']} nästan) "
+              f"av {resends} omskick i inkorgen")
+
+    client = per_tool(snapshot, "mcp_call_seconds")
+    tools = per_tool(snapshot, "tool_seconds")
+    print(f"\n  {'Verktyg':<22} {'anrop':>6} {'p50':>9} {'p95':>9} {'p99':>9}  {'i servern p50':>13}")
+    for tool, s in sorted(client.items(), key=lambda item: -item[1]["sum"]):
+        server_p50 = f"{tools[tool]['p50'] * 1000:>11.1f}ms" if tool in tools else f"{'-':>13}"
+        print(f"  {tool:<22} {s['count']:>6} " + " ".join(
+            f"{s[k] * 1000:>7.1f}ms" for k in ("p50", "p95", "p99")) + f"  {server_p50}")
+
+    rss = peak_rss_mb()
+    print(f"\n  Peak RSS: {f'{rss:.0f} MB' if rss is not None else 'okänt (resource saknas)'}")
+
+    if show_stages:
+        print()
+        print("\n".join(format_summary(snapshot, "Alla mätpunkter (klient och server):")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark av hela mailkedjan mot fejkad Gmail och LLM")
+    parser.add_argument("--size", type=int, default=1000, help="Antal mail i den syntetiska inkorgen")
+    parser.add_argument("--seed", type=int, default=42, help="Slumpfrö för inkorgen")
+    parser.add_argument("--inbox", type=Path, help="Läs inkorgen från JSON (från benchmarks.inbox_gen)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Sekunder före första token (standard: 0.05)")
+    parser.add_argument("--token-latency", type=float, default=0.002,
+                        help="Sekunder mellan strömmade delar (standard: 0.002)")
+    parser.add_argument("--gmail-latency", type=float, default=0.02, help="Sekunder per Gmail-anrop (standard: 0.02)")
+    parser.add_argument("--gmail-item-latency", type=float, default=0.001,
+                        help="Extra sekunder per mail i ett batch-anrop (standard: 0.001)")
+    parser.add_argument("--concurrency", type=int, default=8, metavar="N", help="Som i mcp_client.py (standard: 8)")
+    parser.add_argument("--batch-size", type=int, default=1, metavar="K", help="Som i mcp_client.py")
+    parser.add_argument("--page-size", type=int, default=0, metavar="N", help="Som i mcp_client.py")
+    parser.add_argument("--bulk", action="store_true", help="Som i mcp_client.py")
+    parser.add_argument("--no-rules", action="store_true", help="Som i mcp_client.py")
+    parser.add_argument("--no-dedup", action="store_true", help="Som i mcp_client.py")
+    parser.add_argument("--metrics", action="store_true", help="Visa alla mätpunkter (Gmail, LLM, historik, ...)")
+    parser.add_argument("--verbose", action="store_true", help="Visa klientens och serverns utskrifter")
+    args = parser.parse_args()
+
+    if args.inbox:
+        with open(args.inbox, "r", encoding="utf-8") as f:
+            inbox = json.load(f)
+    else:
+        inbox = generate_inbox(args.size, args.seed)
+
+    gmail = FakeGmailService(inbox, latency=args.gmail_latency, per_message_latency=args.gmail_item_latency)
+    llm = FakeLLMServer(args.llm_latency, args.token_latency).start()
+    core.llm.GEMINI_BASE_URL = llm.base_url
+
+    print(f"Pipeline-benchmark: {len(inbox)} mail, concurrency {args.concurrency}, batch {args.batch_size}, "
+          f"sida {args.page_size or 'av'}, bulk {'på' if args.bulk else 'av'}, "
+          f"regler {'av' if args.no_rules else 'på'}, dubbletter {'hanteras' if args.no_dedup else 'viks ihop'}")
+    print(f"Latens: LLM {args.llm_latency * 1000:.0f} ms + {args.token_latency * 1000:.0f} ms/del, "
+          f"Gmail {args.gmail_latency * 1000:.0f} ms/anrop")
+
+    try:
+        result = asyncio.run(run_pipeline(args, inbox, gmail))
+    finally:
+        llm.stop()
+    report(result, inbox, gmail, llm, args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Mäter svarstid för produktsökningen mot en syntetisk katalog.
+
+Kör: python -m benchmarks.bench_search                 (20 000 produkter)
+     python -m benchmarks.bench_search --skus 50000
+
+Katalogen byggs av riktiga kategorier, mått och längder kombinerat med
+påhittade varianter, så att ordförrådet växer ungefär som en riktig katalog.
+"""
+
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from core.search import ProductIndex
+
+CATEGORIES = [
+    "regel", "bräda", "regel_tryckimp", "bräda_tryckimp", "plywood", "osb", "spånskiva",
+    "gipsskiva", "isolering_mineralull", "isolering_träfiber", "råspont", "råspontlucka",
+    "ytterpanel", "innerpanel", "golvspånskiva", "laminatgolv", "parkettgolv", "sockel",
+    "foder", "taklist", "spik_blank", "skruv_trä", "skruv_gips", "skruv_trall", "vinkel", "balksko",
+]
+DIMENSIONS = ["22x95", "22x120", "22x145", "45x45", "45x70", "45x95", "45x120", "45x145",
+              "45x170", "45x195", "12mm", "15mm", "18mm", "22mm", "95mm", "145mm", "195mm"]
+LENGTHS = ["2.4m", "3m", "3.6m", "4.2m", "4.8m", "5.4m"]
+VARIANTS = ["c24", "c14", "hyvlad", "grund", "vit", "svart", "furu", "gran", "ek", "ask",
+            "premium", "eko", "våtrum", "brand", "ljud", "fas", "spont", "ntr", "fsc", "pefc"]
+
+# (typ, fråga) – mixen en kund typiskt skickar in
+QUERIES = [
+    ("exakt", "plywood 12mm"),
+    ("exakt", "regel 45x145"),
+    ("prefix", "ply 18"),
+    ("plural", "reglar 45*95"),
+    ("plural", "brädor 22x120"),
+    ("plural", "gipsskivor våtrum"),
+    ("stavfel", "plywod 15"),
+    ("stavfel", "mineralul 145"),
+    ("stavfel", "laminatgovl ek"),
+    ("mått", "regel 45 x 70 4,2 meter"),
+    ("mått", "1,2 cm plywood"),
+    ("kategori", "osb skiva"),
+    ("ingen träff", "betongblandare"),
+]
+
+
+def synthetic_catalog(size: int, seed: int = 42) -> dict:
+    """Skapar en katalog med size produkter: {namn: (pris, dimension)}."""
+    rng = random.Random(seed)
+    catalog = {}
+    for category, dimension, length in itertools.product(CATEGORIES, DIMENSIONS, LENGTHS):
+        catalog[f"{category}_{dimension}_{length}"] = (rng.randint(20, 1500), float(length[:-1]))
+    while len(catalog) < size:
+        parts = [rng.choice(CATEGORIES), rng.choice(DIMENSIONS), rng.choice(LENGTHS),
+                 rng.choice(VARIANTS), f"v{rng.randint(1, 999)}"]
+        catalog["_".join(parts)] = (rng.randint(20, 1500), None)
+    return dict(itertools.islice(catalog.items(), size))
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark för produktsökning")
+    parser.add_argument("--skus", type=int, default=20000, help="Antal produkter (standard: 20000)")
+    parser.add_argument("--repeat", type=int, default=200, help="Antal körningar per fråga")
+    args = parser.parse_args()
+
+    catalog = synthetic_catalog(args.skus)
+
+    start = time.perf_counter()
+    index = ProductIndex(catalog)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"Katalog: {len(catalog)} produkter, index byggt på {build_ms:.0f} ms\n")
+
+    print(f"{'Typ':<12} {'Fråga':<26} {'Träffar':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    all_times = []
+    for kind, query in QUERIES:
+        hits = len(index.search(query))
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            index.search(query)
+            times.append((time.perf_counter() - start) * 1000)
+        all_times.extend(times)
+        print(f"{kind:<12} {query:<26} {hits:>8} {percentile(times, 50):>8.3f} "
+              f"{percentile(times, 95):>8.3f} {percentile(times, 99):>8.3f}")
+
+    print(f"\nAlla frågor: medel {statistics.mean(all_times):.3f} ms, "
+          f"p50 {percentile(all_times, 50):.3f} ms, p99 {percentile(all_times, 99):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Fejkad Gmail API-tjänst i processen, för benchmarks (helt offline).
+
+FakeGmailService efterliknar de delar av googleapiclient-tjänsten som
+GmailClient använder: users().messages() (list, get, modify, batchModify,
+send), users().history().list, users().getProfile, users().watch och
+new_batch_http_request. Varje HTTP-anrop kostar latency sekunder, och ett
+batch-anrop dessutom per_message_latency per delanrop, så att batchning
+och sidindelning syns i mätningarna. Med fail() kan enskilda hämtningar
+fås att misslyckas (t.ex. HTTP 503), som FakeGmailError (en HttpError).
+
+    service = FakeGmailService(generate_inbox(10_000), latency=0.02)
+    client = FakeGmailClient(service)   # En riktig GmailClient mot fejken
+"""
+
+import time
+import base64
+import threading
+from collections import Counter
+from datetime import datetime
+from email import message_from_bytes
+from email.mime.text import MIMEText
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from core.autoresponder import GmailClient, GMAIL_BATCH_SIZE
+
+SNIPPET_CHARS = 200  # Gmails utdrag är ungefär så långt
+
+
+class FakeGmailError(HttpError):
+    """Fel från den fejkade tjänsten (t.ex. okänt meddelande-id), som googleapiclient:s HttpError."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(httplib2.Response({"status": status, "reason": message}), message.encode())
+        self.status = status
+
+
+class _Request:
+    """Ett (ej exekverat) API-anrop, som googleapiclient.http.HttpRequest."""
+
+    def __init__(self, service: "FakeGmailService", name: str, fn):
+        self.service = service
+        self.name = name
+        self.fn = fn
+
+    def execute(self, http=None, num_retries: int = 0):
+        self.service._call(self.name)
+        return self.fn()
+
+
+class _BatchRequest:
+    """Batch-anrop med upp till GMAIL_BATCH_SIZE delanrop i ett HTTP-anrop."""
+
+    def __init__(self, service: "FakeGmailService", callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: _Request, request_id: str = None, callback=None):
+        if len(self.requests) >= GMAIL_BATCH_SIZE:
+            raise ValueError(f"Max {GMAIL_BATCH_SIZE} anrop per batch")
+        self.requests.append((request_id or str(len(self.requests)), request, callback or self.callback))
+
+    def execute(self, http=None):
+        self.service._call("batch", extra=self.service.per_message_latency * len(self.requests))
+        for request_id, request, callback in self.requests:
+            self.service._count(request.name)
+            try:
+                response, exception = request.fn(), None
+            except FakeGmailError as e:
+                response, exception = None, e
+            callback(request_id, response, exception)
+
+
+class _Resource:
+    """Samling av API-metoder, t.ex. users() eller users().messages()."""
+
+    def __init__(self, **methods):
+        self._methods = methods
+
+    def __getattr__(self, name):
+        try:
+            return self._methods[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class FakeGmailService:
+    """Inkorg i minnet med samma anropsformat som Gmail API (v1)."""
+
+    def __init__(self, emails: list = (), latency: float = 0.0, per_message_latency: float = 0.0,
+                 address: str = "info@bengtssons.example"):
+        """
+        Args:
+            emails: Mail som läggs i inkorgen som olästa, i ankomstordning
+                ({"id", "from", "subject", "body"} och valfritt "date")
+            latency: Sekunder per HTTP-anrop
+            per_message_latency: Extra sekunder per delanrop i ett batch-anrop
+            address: Kontots adress (getProfile)
+        """
+        self.latency = latency
+        self.per_message_latency = per_message_latency
+        self.address = address
+        self.calls = Counter()  # Antal anrop per metod ("http" = antal HTTP-anrop)
+        self.sent = []          # Skickade mail: {"to", "subject", "raw"}
+        self._lock = threading.Lock()
+        self._messages = {}     # id -> {"email", "labels", "internalDate"}
+        self._order = []        # id:n i ankomstordning (messages.list listar nyast först)
+        self._history = []      # (historyId, id) per tillagt mail
+        self._history_id = 1
+        self._failures = Counter()  # id -> antal kommande hämtningar som ska misslyckas
+        self._failure_status = {}
+        for email in emails:
+            self.insert(email)
+
+        users = _Resource(
+            messages=lambda: _Resource(
+                list=self._list, get=self._get, modify=self._modify,
+                batchModify=self._batch_modify, send=self._send,
+            ),
+            history=lambda: _Resource(list=self._history_list),
+            getProfile=lambda userId: _Request(self, "getProfile", lambda: {
+                "emailAddress": self.address, "historyId": str(self._history_id)}),
+            watch=lambda userId, body: _Request(self, "watch", lambda: {
+                "historyId": str(self._history_id), "expiration": str(int(time.time() * 1000) + 7 * 86400000)}),
+        )
+        self.users = lambda: users
+
+    def insert(self, email: dict):
+        """Lägger ett nytt oläst mail i inkorgen."""
+        date = datetime.fromisoformat(email["date"]) if email.get("date") else datetime.now()
+        with self._lock:
+            self._history_id += 1
+            self._messages[email["id"]] = {
+                "email": email,
+                "labels": {"INBOX", "UNREAD"},
+                "internalDate": str(int(date.timestamp() * 1000)),
+            }
+            self._order.append(email["id"])
+            self._history.append((self._history_id, email["id"]))
+
+    def fail(self, msg_id: str, status: int = 503, times: int = 1):
+        """Låter de nästa times hämtningarna av msg_id misslyckas med HTTP-status status."""
+        with self._lock:
+            self._failures[msg_id] = times
+            self._failure_status[msg_id] = status
+
+    def new_batch_http_request(self, callback=None) -> _BatchRequest:
+        return _BatchRequest(self, callback)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.calls[name] += 1
+
+    def _call(self, name: str, extra: float = 0.0):
+        """Ett HTTP-anrop: räknas och tar latency (+ extra) sekunder."""
+        self._count(name)
+        self._count("http")
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+    # ---------- users().messages() ----------
+
+    def _list(self, userId: str, q: str = "", maxResults: int = 100, pageToken: str = None, **kwargs) -> _Request:
+        def run():
+            unread_only = "is:unread" in (q or "")
+            start = int(pageToken or 0)
+            with self._lock:
+                ids, position = [], start
+                while position < len(self._order) and len(ids) < maxResults:
+                    msg_id = self._order[-1 - position]
+                    if not unread_only or "UNREAD" in self._messages[msg_id]["labels"]:
+                        ids.append(msg_id)
+                    position += 1
+                more = position < len(self._order)
+            result = {"messages": [{"id": i, "threadId": i} for i in ids], "resultSizeEstimate": len(ids)}
+            if more:
+                result["nextPageToken"] = str(position)
+            return result
+        return _Request(self, "messages.list", run)
+
+    def _get(self, userId: str, id: str, format: str = "full", metadataHeaders: list = None) -> _Request:
+        return _Request(self, "messages.get", lambda: self._message(id, format))
+
+    def _message(self, msg_id: str, format: str) -> dict:
+        """Meddelandet i Gmails format ('full', 'metadata' eller 'raw')."""
+        with self._lock:
+            stored = self._messages.get(msg_id)
+            if stored is None:
+                raise FakeGmailError(404, f"Requested entity was not found: {msg_id}")
+            if self._failures[msg_id] > 0:
+                self._failures[msg_id] -= 1
+                raise FakeGmailError(self._failure_status[msg_id], "Backend Error")
+            labels = sorted(stored["labels"])
+        email = stored["email"]
+        message = {
+            "id": msg_id,
+            "threadId": msg_id,
+            "labelIds": labels,
+            "snippet": email["body"][:SNIPPET_CHARS],
+            "internalDate": stored["internalDate"],
+        }
+        if format == "raw":
+            mime = MIMEText(email["body"])
+            mime["From"] = email["from"]
+            mime["Subject"] = email["subject"]
+            message["raw"] = base64.urlsafe_b64encode(mime.as_bytes()).decode()
+            return message
+
+        headers = [{"name": "From", "value": email["from"]}, {"name": "Subject", "value": email["subject"]}]
+        message["payload"] = {"mimeType": "text/plain", "headers": headers, "body": {"size": len(email["body"])}}
+        if format == "full":
+            message["payload"]["body"]["data"] = base64.urlsafe_b64encode(email["body"].encode()).decode()
+        return message
+
+    def _modify(self, userId: str, id: str, body: dict) -> _Request:
+        return _Request(self, "messages.modify", lambda: self._relabel([id], body))
+
+    def _batch_modify(self, userId: str, body: dict) -> _Request:
+        return _Request(self, "messages.batchModify", lambda: self._relabel(body["ids"], body))
+
+    def _relabel(self, msg_ids: list, body: dict) -> dict:
+        with self._lock:
+            for msg_id in msg_ids:
+                stored = self._messages.get(msg_id)
+                if stored is not None:
+                    stored["labels"] -= set(body.get("removeLabelIds", []))
+                    stored["labels"] |= set(body.get("addLabelIds", []))
+        return {}
+
+    def _send(self, userId: str, body: dict) -> _Request:
+        def run():
+            parsed = message_from_bytes(base64.urlsafe_b64decode(body["raw"]))
+            with self._lock:
+                self.sent.append({"to": parsed["to"], "subject": parsed["subject"], "raw": body["raw"]})
+                return {"id": f"sent{len(self.sent)}", "labelIds": ["SENT"]}
+        return _Request(self, "messages.send", run)
+
+    # ---------- users().history() ----------
+
+    def _history_list(self, userId: str, startHistoryId: str, pageToken: str = None, **kwargs) -> _Request:
+        def run():
+            start = int(startHistoryId)
+            with self._lock:
+                records = [
+                    {"id": str(history_id), "messagesAdded": [{"message": {
+                        "id": msg_id, "labelIds": sorted(self._messages[msg_id]["labels"])}}]}
+                    for history_id, msg_id in self._history if history_id > start
+                ]
+                return {"history": records, "historyId": str(self._history_id)}
+        return _Request(self, "history.list", run)
+
+
+class FakeGmailClient(GmailClient):
+    """GmailClient (hela parsningen, batchningen osv.) mot en FakeGmailService."""
+
+    def __init__(self, service: FakeGmailService):
+        self._fake_service = service
+        super().__init__()
+
+    def _authenticate_gmail(self):
+        return self._fake_service
+
+    def _thread_http(self):
+        return None
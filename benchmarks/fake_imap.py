@@ -0,0 +1,241 @@
+"""Fejkad IMAP- och SMTP-server i processen, för tester och benchmarks (helt offline).
+
+FakeMailServer efterliknar de delar av imaplib.IMAP4 och smtplib.SMTP som
+ImapTransport använder: LOGIN, SELECT (med UIDVALIDITY), NOOP, UID SEARCH
+(UNSEEN, med eller utan UID-mängd), UID FETCH (BODY.PEEK[] eller
+header + utdrag), UID STORE +FLAGS (\\Seen) och send_message. IDLE stöds
+inte.
+
+Med reset_uidvalidity() numreras brevlådan om (som när en mapp byggs om
+på servern), och med disconnect() dör alla öppna anslutningar så att
+nästa kommando ger IMAP4.abort respektive SMTPServerDisconnected. Med
+items_last = True skickas FETCH-posterna i omvänd ordning (texten före
+headern, UID och INTERNALDATE sist), vilket servern har rätt att göra,
+och med store_status = "NO" avvisas UID STORE.
+
+    server = FakeMailServer()
+    server.deliver("kund@example.se", "Fråga", "Hej!")
+    monkeypatch.setattr(imaplib, "IMAP4", server.imap4)
+    monkeypatch.setattr(smtplib, "SMTP", server.smtp)
+"""
+
+import re
+import imaplib
+import smtplib
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from email.mime.text import MIMEText
+
+_SEARCH = re.compile(r"^(?:UID (?P<uids>\S+) )?UNSEEN$")
+_SNIPPET = re.compile(r"BODY\.PEEK\[TEXT\]<0\.(\d+)>")
+
+
+def _parse_uid_set(uid_set: str, max_uid: int) -> set:
+    """IMAP-mängd ("1:3,7", "5:*") -> UID:n. "*" är högsta UID:t i brevlådan."""
+    uids = set()
+    for part in uid_set.split(","):
+        first, _, last = part.partition(":")
+        first = max_uid if first == "*" else int(first)
+        last = first if not last else max_uid if last == "*" else int(last)
+        uids.update(range(min(first, last), max(first, last) + 1))
+    return uids
+
+
+class _Message:
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self.flags = set()
+        self.date = datetime.now(timezone.utc)
+
+
+class FakeMailServer:
+    """En brevlåda (INBOX) och en SMTP-server, delade av alla anslutningar."""
+
+    def __init__(self, uidvalidity: int = 1):
+        self.uidvalidity = uidvalidity
+        self.messages = {}        # UID -> _Message
+        self.next_uid = 1
+        self.sent = []            # Meddelanden skickade via SMTP
+        self.commands = Counter()
+        self.connections = 0      # Antal öppnade IMAP-anslutningar
+        self._generation = 0      # Räknas upp av disconnect()
+        self._lock = threading.Lock()
+        self.items_last = False   # FETCH-posterna i omvänd ordning
+        self.store_status = "OK"  # Svaret på UID STORE
+        # Ersättare för imaplib.IMAP4 och smtplib.SMTP. IMAP4 måste vara en klass,
+        # eftersom transporten fångar imaplib.IMAP4.abort.
+        self.imap4 = type("FakeIMAP4", (FakeIMAP4,), {"server": self})
+
+    # ==================== Styrning från testet ====================
+
+    def deliver(self, sender: str, subject: str, body: str) -> int:
+        """Lägger ett oläst mail i brevlådan och returnerar dess UID."""
+        message = MIMEText(body)
+        message["from"] = sender
+        message["subject"] = subject
+        with self._lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.messages[uid] = _Message(message.as_bytes())
+        return uid
+
+    def mark_seen(self, uid: int):
+        """Markerar ett mail som läst (t.ex. i en annan mailklient)."""
+        with self._lock:
+            self.messages[uid].flags.add("\\Seen")
+
+    def delete(self, uid: int):
+        """Tar bort ett mail ur brevlådan (STORE \\Deleted + EXPUNGE)."""
+        with self._lock:
+            del self.messages[uid]
+
+    def unseen(self) -> list:
+        with self._lock:
+            return sorted(uid for uid, message in self.messages.items() if "\\Seen" not in message.flags)
+
+    def reset_uidvalidity(self):
+        """Numrerar om brevlådan från UID 1 med ett nytt UIDVALIDITY.
+
+        Öppna anslutningar stängs, som när en riktig server bygger om mappen.
+        """
+        with self._lock:
+            self.uidvalidity += 1
+            self.messages = {uid: message for uid, message in
+                             enumerate((self.messages[uid] for uid in sorted(self.messages)), start=1)}
+            self.next_uid = len(self.messages) + 1
+            self._generation += 1
+
+    def disconnect(self):
+        """Stänger alla öppna IMAP- och SMTP-anslutningar."""
+        with self._lock:
+            self._generation += 1
+
+    def smtp(self, host: str = "", port: int = 0, *args, **kwargs) -> "FakeSMTP":
+        """Ersättare för smtplib.SMTP."""
+        return FakeSMTP(self)
+
+    # ==================== Kommandon ====================
+
+    def _search(self, criteria: str) -> list:
+        match = _SEARCH.match(criteria)
+        if not match:
+            raise imaplib.IMAP4.error(f"Sökningen stöds inte av fejken: {criteria}")
+        with self._lock:
+            uids = set(self.messages)
+            if match.group("uids"):
+                uids &= _parse_uid_set(match.group("uids"), max(self.messages, default=0))
+            return sorted(uid for uid in uids if "\\Seen" not in self.messages[uid].flags)
+
+    def _fetch(self, uid_set: str, items: str) -> list:
+        snippet = _SNIPPET.search(items)
+        data = []
+        with self._lock:
+            for uid in sorted(_parse_uid_set(uid_set, max(self.messages, default=0)) & set(self.messages)):
+                message = self.messages[uid]
+                date = message.date.strftime("%d-%b-%Y %H:%M:%S %z")
+                meta = f'UID {uid} INTERNALDATE "{date}"'.encode()
+                if snippet:
+                    headers, _, text = message.raw.partition(b"\n\n")
+                    text = text[:int(snippet.group(1))]
+                    literals = [(b"BODY[HEADER.FIELDS (FROM SUBJECT)] {%d}" % len(headers), headers),
+                                (b"BODY[TEXT]<0> {%d}" % len(text), text)]
+                else:
+                    literals = [(b"BODY[] {%d}" % len(message.raw), message.raw)]
+                if self.items_last:
+                    literals.reverse()
+                    first, end = b"%d (" % uid, b" " + meta + b")"
+                else:
+                    first, end = b"%d (" % uid + meta + b" ", b")"
+                for n, (item, literal) in enumerate(literals):
+                    data.append(((first if n == 0 else b" ") + item, literal))
+                data.append(end)
+        return data
+
+    def _store(self, uid_set: str, flags: str) -> bool:
+        if self.store_status != "OK":
+            return False
+        with self._lock:
+            for uid in _parse_uid_set(uid_set, max(self.messages, default=0)) & set(self.messages):
+                self.messages[uid].flags.update(flags.strip("()").split())
+        return True
+
+
+class FakeIMAP4:
+    """En IMAP-anslutning mot FakeMailServer, med samma anrop som imaplib.IMAP4."""
+
+    error = imaplib.IMAP4.error
+    abort = imaplib.IMAP4.abort
+    server: FakeMailServer  # Sätts av FakeMailServer.imap4
+
+    def __init__(self, host: str = "", port: int = 143, *args, **kwargs):
+        with self.server._lock:
+            self.server.connections += 1
+        self._generation = self.server._generation
+        self._untagged = {}
+
+    def _check(self, command: str):
+        self.server.commands[command] += 1
+        if self._generation != self.server._generation:
+            raise self.abort("Anslutningen stängdes av servern")
+
+    def login(self, user: str, password: str):
+        self._check("LOGIN")
+        return "OK", [b"LOGIN completed"]
+
+    def select(self, mailbox: str = "INBOX"):
+        self._check("SELECT")
+        self._untagged["UIDVALIDITY"] = str(self.server.uidvalidity).encode()
+        return "OK", [str(len(self.server.messages)).encode()]
+
+    def response(self, code: str):
+        """Som imaplib: hämtar (och tar bort) serverns senaste otaggade svar med koden."""
+        return code, [self._untagged.pop(code, None)]
+
+    def noop(self):
+        self._check("NOOP")
+        return "OK", [b"NOOP completed"]
+
+    def uid(self, command: str, *args):
+        command = command.upper()
+        self._check(f"UID {command}")
+        if command == "SEARCH":
+            return "OK", [" ".join(map(str, self.server._search(args[1]))).encode()]
+        if command == "FETCH":
+            return "OK", self.server._fetch(args[0], args[1])
+        if command == "STORE":
+            if not self.server._store(args[0], args[2]):
+                return self.server.store_status, [b"STORE failed"]
+            return "OK", [None]
+        raise self.error(f"UID {command} stöds inte av fejken")
+
+    def logout(self):
+        self._generation = -1
+        return "BYE", [b"LOGOUT"]
+
+
+class FakeSMTP:
+    """En SMTP-anslutning mot FakeMailServer, med samma anrop som smtplib.SMTP."""
+
+    def __init__(self, server: FakeMailServer):
+        self.server = server
+        self._generation = server._generation
+
+    def _check(self):
+        if self._generation != self.server._generation:
+            raise smtplib.SMTPServerDisconnected("Anslutningen stängdes av servern")
+
+    def starttls(self, *args, **kwargs):
+        self._check()
+
+    def login(self, user: str, password: str):
+        self._check()
+
+    def send_message(self, message):
+        self._check()
+        with self.server._lock:
+            self.server.sent.append(message)
+        return {}
+
+    def quit(self):
+        self._generation = -1
@@ -0,0 +1,264 @@
+"""Deterministisk, OpenAI-kompatibel fejk-LLM för benchmarks (helt offline).
+
+Kör: python -m benchmarks.fake_llm --port 8090 --latency 0.2
+     LLM_BASE_URL=http://127.0.0.1:8090/v1/ GEMINI_API_KEY=x python mcp_client.py
+
+Svarar på POST .../chat/completions, med eller utan stream=True (SSE),
+med usage även i strömmade svar om stream_options.include_usage är satt.
+Svaret väljs efter vilken prompt det är (samma prompter som klienten och
+agenterna skickar):
+
+- Klassificering (ett mail eller en batch): reglerna i core/rules.py,
+  med high_priority om mailet matchar ESCALATION
+- Tolkning av byggprojekt: byggnad och yta ur texten
+- Materialuppskattning: en fast materiallista
+- Klagomålssvar: ett kort svar som slutar med signaturen
+
+Samma prompt ger alltid samma svar. Latensen är latency sekunder före
+första token plus token_latency per del av ett strömmat svar. Med
+stall() hänger sig nästa strömmade svar efter första delen, för att testa
+timeout och omförsök.
+"""
+
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.rules import RuleClassifier, ESCALATION
+from core.estimator import BUILDINGS
+
+# Fast materiallista för "byggnadsteknisk assistent"-prompten
+FALLBACK_BOM = {
+    "Stomme/Väggar": {"regel_45x145_3m": 24, "plywood_12mm": 15, "isolering_mineralull_145mm": 8},
+    "Tak": {"råspont_21x95_3m": 25, "takpapp_rulle": 2},
+    "Fästdon": {"spiklåda_70mm": 2},
+}
+
+COMPLAINT_REPLY = """Hej!
+
+Tack för ditt mail, vi har tagit emot ditt ärende om {subject}.
+Vi beklagar det inträffade och har skickat ärendet vidare till ansvarig
+avdelning. Vi återkommer till dig så snart vi kan.
+
+Önskar dig en fortsatt trevlig dag!
+
+Med vänliga hälsningar,
+
+Kontorsassistenten
+Bengtssons Trävaror"""
+
+# Ungefär fyra tecken per token, som i Geminis tokenisering av svensk text
+CHARS_PER_TOKEN = 4
+# Antal tecken per del i ett strömmat svar
+STREAM_CHUNK_CHARS = 16
+
+_FIELD = re.compile(r"Från: (?P<from>.*)\n\s*Ämne: (?P<subject>.*)\n\s*(?:Innehåll|Meddelande): (?P<body>.*)", re.DOTALL)
+_AREA = re.compile(r"(\d+(?:[.,]\d+)?)\s*(?:kvm|m2|m²|kvadrat)", re.IGNORECASE)
+
+
+def _parse_mail(block: str) -> dict:
+    """Plockar ut Från/Ämne/Innehåll ur en del av en prompt."""
+    match = _FIELD.search(block)
+    if not match:
+        return {"from": "", "subject": "", "body": block}
+    return {key: value.strip() for key, value in match.groupdict().items()}
+
+
+def _classify(rules: RuleClassifier, email: dict) -> dict:
+    mail_type, data, _ = rules.classify(email)
+    text = f"{email['subject']}\n{email['body']}"
+    return {**data, "type": mail_type, "high_priority": bool(ESCALATION.search(text))}
+
+
+def respond(prompt: str, rules: RuleClassifier = None) -> str:
+    """Det deterministiska svaret på en prompt."""
+    rules = rules or RuleClassifier()
+
+    if prompt.startswith("Klassificera följande"):
+        mails = prompt[:prompt.rfind("Svara med en lista")]
+        answers = []
+        for block in re.split(r"--- id: ", mails)[1:]:
+            key, _, rest = block.partition(" ---")
+            answers.append({"id": key.strip(), **_classify(rules, _parse_mail(rest))})
+        return json.dumps(answers, ensure_ascii=False)
+
+    if prompt.startswith("Klassificera detta mail"):
+        return json.dumps(_classify(rules, _parse_mail(prompt[:prompt.rfind("Svara med:")])), ensure_ascii=False)
+
+    if prompt.startswith("Tolka följande beskrivning"):
+        description = prompt[:prompt.rfind("Svara med:")].lower()
+        area = _AREA.search(description)
+        building = next((b for b in BUILDINGS if b in description), "annat")
+        return json.dumps({
+            "building": building,
+            "area": float(area.group(1).replace(",", ".")) if area else 20.0,
+            "width": None, "length": None, "wall_height": None,
+            "roof": "sadeltak", "insulated": "isoler" in description,
+        }, ensure_ascii=False)
+
+    if "byggnadsteknisk assistent" in prompt:
+        return json.dumps(FALLBACK_BOM, ensure_ascii=False)
+
+    if "besvarar klagomål" in prompt:
+        email = _parse_mail(prompt[prompt.rfind("Nytt mail:"):prompt.rfind("Innehåll:")])
+        return COMPLAINT_REPLY.format(subject=email["subject"].lower() or "din beställning")
+
+    return "OK"
+
+
+def _usage(prompt: str, text: str) -> dict:
+    prompt_tokens = len(prompt) // CHARS_PER_TOKEN + 1
+    completion_tokens = len(text) // CHARS_PER_TOKEN + 1
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+class FakeLLMServer:
+    """HTTP-server i en bakgrundstråd som beter sig som /chat/completions."""
+
+    def __init__(self, latency: float = 0.0, token_latency: float = 0.0, port: int = 0, host: str = "127.0.0.1"):
+        """
+        Args:
+            latency: Sekunder före första token (för hela svaret utan stream)
+            token_latency: Sekunder mellan delarna i ett strömmat svar
+            port: Port att lyssna på (0 = valfri ledig port)
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, som ett riktigt API
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, b"{}")
+                    return
+                request = json.loads(body)
+                prompt = "\n".join(m.get("content") or "" for m in request.get("messages", []))
+                text = respond(prompt, server._rules())
+                server._count()
+
+                time.sleep(server.latency)
+                if request.get("stream"):
+                    include_usage = (request.get("stream_options") or {}).get("include_usage")
+                    self._stream(request.get("model", ""), text, _usage(prompt, text) if include_usage else None)
+                else:
+                    self._send(200, json.dumps({
+                        "id": "fake-completion",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": request.get("model", ""),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": text}}],
+                        "usage": _usage(prompt, text),
+                    }, ensure_ascii=False).encode())
+
+            def _send(self, status: int, payload: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, model: str, text: str, usage: dict = None):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                stall = server._take_stall()
+                try:
+                    for start in range(0, len(text), STREAM_CHUNK_CHARS):
+                        if start:
+                            time.sleep(stall or server.token_latency)
+                            stall = 0.0
+                        self._chunk(model, {"role": "assistant", "content": text[start:start + STREAM_CHUNK_CHARS]})
+                    self._chunk(model, {}, finish_reason="stop")
+                    if usage is not None:
+                        # stream_options={"include_usage": true}: en sista del utan choices
+                        self._chunk(model, None, usage=usage)
+                    self._write(b"data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # Klienten avbröt strömmen (t.ex. efter signaturen)
+                    self.close_connection = True
+
+            def _chunk(self, model: str, delta: dict | None, finish_reason: str = None, usage: dict = None):
+                event = {
+                    "id": "fake-completion",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                if usage is not None:
+                    event["usage"] = usage
+                self._write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+
+            def _write(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.latency = latency
+        self.token_latency = token_latency
+        self.requests = 0
+        self._stalls = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.base_url = f"http://{host}:{self.port}/v1/"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-llm", daemon=True)
+
+    def _rules(self) -> RuleClassifier:
+        """RuleClassifier per tråd (den håller statistik och är inte trådsäker)."""
+        rules = getattr(self._local, "rules", None)
+        if rules is None:
+            rules = self._local.rules = RuleClassifier()
+        return rules
+
+    def _count(self):
+        with self._lock:
+            self.requests += 1
+
+    def stall(self, seconds: float, times: int = 1):
+        """Låter de nästa times strömmade svaren stå still seconds sekunder efter första delen."""
+        with self._lock:
+            self._stalls.extend([seconds] * times)
+
+    def _take_stall(self) -> float:
+        with self._lock:
+            return self._stalls.pop(0) if self._stalls else 0.0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fejkad OpenAI-kompatibel LLM för benchmarks")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="Sekunder före första token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Sekunder mellan strömmade delar")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.latency, args.token_latency, port=args.port).start()
+    print(f"Fejk-LLM på {server.base_url} (Ctrl+C för att avsluta)")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Syntetiska inkorgar med svenska mail i alla kategorier, för benchmarks.
+
+Kör: python -m benchmarks.inbox_gen 1000 > inbox.json
+     python -m benchmarks.inbox_gen 100000 --seed 7 > inbox.json
+
+Varje mail byggs av en ämnesrad och några meningar ur kategorins mallar,
+med produkter ur katalogen, byggprojekt, datum och ordernummer inskjutna.
+Avsändarna dras med en skev fördelning så att vissa kunder skriver många
+mail (uppföljningar, konversationshistorik) och de flesta bara ett.
+En del mail skickas igen av samma kund, exakt eller med ny hälsning och
+"Sv:" i ämnet (för dubbletthanteringen i core/dedup.py).
+Samma seed ger alltid samma inkorg.
+"""
+
+import sys
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from core.products import PRODUCTS
+from core.estimator import BUILDINGS
+
+# Andel mail per kategori (ungefär som en vanlig vecka)
+CATEGORY_WEIGHTS = {"support": 0.25, "sales": 0.30, "estimate": 0.15, "meeting": 0.15, "other": 0.15}
+# Andel av supportmailen som är eskaleringar (hot, återkommande problem)
+HIGH_PRIORITY_SHARE = 0.15
+# Andel mail som är ett omskick av ett av de senaste RESEND_WINDOW mailen
+DUPLICATE_SHARE = 0.05
+RESEND_WINDOW = 50
+
+FIRST_NAMES = ["Anna", "Erik", "Maria", "Lars", "Karin", "Johan", "Sara", "Anders", "Eva", "Per",
+               "Lena", "Mikael", "Emma", "Nils", "Ingrid", "Oskar", "Elin", "Gustav", "Sofia", "Henrik"]
+LAST_NAMES = ["Andersson", "Johansson", "Karlsson", "Nilsson", "Eriksson", "Larsson", "Olsson",
+              "Persson", "Svensson", "Gustafsson", "Pettersson", "Jonsson", "Lindberg", "Bengtsson"]
+DOMAINS = ["gmail.com", "outlook.com", "hotmail.com", "telia.com", "bredband.net", "bygg-ab.se",
+           "snickeri.se", "fastighet.se"]
+
+WEEKDAYS = ["måndag", "tisdag", "onsdag", "torsdag", "fredag"]
+
+SUBJECTS = {
+    "support": ["Klagomål - fel leverans", "Reklamation order {order}", "Trasiga brädor",
+                "Leveransen har inte kommit", "Problem med min beställning", "Skadad {product}"],
+    "sales": ["Prisförfrågan {product}", "Vad kostar {product}?", "Har ni {product} i lager?",
+              "Fråga om {product}", "Vill beställa {product}"],
+    "estimate": ["Materialberäkning {building}", "Offertförfrågan - {building}",
+                 "Materialbehov för {building} {area} kvm", "Uppskattning {building}"],
+    "meeting": ["Boka möte", "Mötesförfrågan", "Kan vi ses {weekday}?", "Möte om större beställning"],
+    "other": ["Tack!", "Öppettider i sommar?", "Nyhetsbrev", "Faktura {order}", "Adressändring"],
+}
+
+SENTENCES = {
+    "support": [
+        "Jag beställde {qty} st {product} förra veckan men fick bara {short} st.",
+        "Flera av brädorna var spruckna när de kom fram.",
+        "Leveransen med ordernummer {order} har fortfarande inte kommit.",
+        "Förpackningen var skadad och {product} gick inte att använda.",
+        "Jag vill ha ersättning för de skadade varorna.",
+        "Det är inte första gången något saknas i min leverans.",
+        "Hur går jag vidare med en reklamation?",
+    ],
+    "high_priority": [
+        "Det här är tredje gången det händer och nu är det oacceptabelt.",
+        "Om jag inte får svar inom två dagar kontaktar jag min advokat.",
+        "Jag kräver att få prata med en ansvarig chef.",
+        "Annars byter jag till en annan leverantör.",
+        "Jag kommer att anmäla er till Konsumentverket.",
+    ],
+    "sales": [
+        "Vad kostar {product} per styck?",
+        "Har ni {product} i lager just nu?",
+        "Jag skulle vilja köpa {qty} st {product}.",
+        "Finns det mängdrabatt om man köper mer än {qty} st?",
+        "Kan ni leverera till {city}?",
+        "Vilka dimensioner har ni av {category}?",
+    ],
+    "estimate": [
+        "Jag planerar att bygga {article} {building} på {area} kvm.",
+        "Måtten blir ungefär {width}x{length} meter.",
+        "Det ska vara isolerat så att det går att använda året runt.",
+        "Taket blir sadeltak med takpapp.",
+        "Kan ni göra en materialberäkning och skicka en uppskattning?",
+        "Vi behöver reglar, skivor och isolering.",
+    ],
+    "meeting": [
+        "Kan vi boka ett möte på {weekday} kl {hour}:00?",
+        "Jag vill gärna träffas och diskutera en större beställning.",
+        "Passar det att ses {day} {month} kl {hour}?",
+        "Vi är ett byggföretag som vill diskutera ett längre samarbete.",
+    ],
+    "other": [
+        "Tack för snabb leverans förra gången!",
+        "Vilka öppettider har ni under sommaren?",
+        "Jag har bytt adress till {street} {number}, {city}.",
+        "Vill bara tacka för bra service.",
+        "Kan ni skicka fakturan med e-post i stället?",
+    ],
+}
+
+GREETINGS = ["Hej!", "Hej,", "Hejsan!", "God dag,", "Hej Bengtssons!"]
+CLOSINGS = ["Mvh", "Med vänliga hälsningar", "Hälsningar", "Tack på förhand,"]
+CITIES = ["Göteborg", "Borås", "Alingsås", "Kungsbacka", "Jönköping", "Uddevalla"]
+STREETS = ["Storgatan", "Skolvägen", "Björkvägen", "Kyrkogatan", "Ängsvägen"]
+MONTHS = ["januari", "februari", "mars", "april", "maj", "juni", "augusti", "september", "oktober"]
+ARTICLES = {"garage": "ett", "förråd": "ett", "attefall": "ett"}
+
+
+def _senders(rng: random.Random, count: int) -> list[tuple[str, float]]:
+    """Kundadresser med vikter (skev fördelning, några skriver ofta)."""
+    senders = []
+    for n in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        address = f"{first}.{last}{n}@{rng.choice(DOMAINS)}".lower()
+        senders.append((address, rng.paretovariate(1.2)))
+    return senders
+
+
+def _fill(template: str, rng: random.Random) -> str:
+    """Fyller i platshållarna i en mall med slumpade men rimliga värden."""
+    product = rng.choice(list(PRODUCTS))
+    building = rng.choice(list(BUILDINGS))
+    width = rng.randint(2, 6)
+    values = {
+        "product": product.replace("_", " "),
+        "category": product.split("_")[0],
+        "qty": rng.randint(5, 200),
+        "order": f"{rng.randint(2023, 2026)}-{rng.randint(1000, 9999)}",
+        "building": building,
+        "article": ARTICLES.get(building, "en"),
+        "width": width,
+        "length": width + rng.randint(0, 4),
+        "area": rng.randint(8, 60),
+        "weekday": rng.choice(WEEKDAYS),
+        "hour": rng.randint(8, 16),
+        "day": rng.randint(1, 28),
+        "month": rng.choice(MONTHS),
+        "city": rng.choice(CITIES),
+        "street": rng.choice(STREETS),
+        "number": rng.randint(1, 80),
+    }
+    values["short"] = max(1, values["qty"] - rng.randint(1, 10))
+    return template.format(**values)
+
+
+def generate_mail(rng: random.Random, category: str, high_priority: bool = False) -> tuple[str, str]:
+    """Ämnesrad och text för ett mail i kategorin."""
+    subject = _fill(rng.choice(SUBJECTS[category]), rng)
+    sentences = rng.sample(SENTENCES[category], k=min(len(SENTENCES[category]), rng.randint(2, 4)))
+    if high_priority:
+        sentences += rng.sample(SENTENCES["high_priority"], k=2)
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    body = "\n\n".join([
+        rng.choice(GREETINGS),
+        " ".join(_fill(sentence, rng) for sentence in sentences),
+        f"{rng.choice(CLOSINGS)}\n{name}",
+    ])
+    return subject, body
+
+
+def resend(rng: random.Random, email: dict) -> tuple[str, str]:
+    """Ämnesrad och text när kunden skickar samma mail igen (exakt eller med ny hälsning)."""
+    if rng.random() < 0.5:
+        return email["subject"], email["body"]
+    greeting, rest = email["body"].split("\n\n", 1)
+    return f"Sv: {email['subject']}", f"{rng.choice(GREETINGS + ['Hej igen!'])}\n\n{rest}"
+
+
+def generate_inbox(size: int, seed: int = 42, start: datetime = None) -> list[dict]:
+    """Skapar size mail: {"id", "from", "subject", "body", "date", "label", "high_priority"}.
+
+    label är facit (support/sales/estimate/meeting/other) och date är
+    ankomsttiden i ISO-format, äldst först. Omskick har dessutom
+    "duplicate_of" med id:t för kundens första mail.
+    """
+    rng = random.Random(seed)
+    senders = _senders(rng, max(1, size // 4))
+    addresses = [address for address, _ in senders]
+    weights = [weight for _, weight in senders]
+    categories = list(CATEGORY_WEIGHTS)
+    category_weights = list(CATEGORY_WEIGHTS.values())
+    arrival = start or datetime(2026, 1, 12, 7, 0)
+
+    inbox = []
+    for n in range(size):
+        arrival += timedelta(seconds=rng.expovariate(1 / 30))
+        if inbox and rng.random() < DUPLICATE_SHARE:
+            previous = rng.choice(inbox[-RESEND_WINDOW:])
+            subject, body = resend(rng, previous)
+            inbox.append({
+                **previous,
+                "id": f"bench{n:06d}",
+                "subject": subject,
+                "body": body,
+                "date": arrival.isoformat(timespec="seconds"),
+                "duplicate_of": previous.get("duplicate_of", previous["id"]),
+            })
+            continue
+
+        category = rng.choices(categories, category_weights)[0]
+        high_priority = category == "support" and rng.random() < HIGH_PRIORITY_SHARE
+        subject, body = generate_mail(rng, category, high_priority)
+        inbox.append({
+            "id": f"bench{n:06d}",
+            "from": rng.choices(addresses, weights)[0],
+            "subject": subject,
+            "body": body,
+            "date": arrival.isoformat(timespec="seconds"),
+            "label": category,
+            "high_priority": high_priority,
+        })
+    return inbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generera en syntetisk inkorg (JSON på stdout)")
+    parser.add_argument("size", type=int, help="Antal mail")
+    parser.add_argument("--seed", type=int, default=42, help="Slumpfrö (samma frö ger samma inkorg)")
+    args = parser.parse_args()
+
+    json.dump(generate_inbox(args.size, args.seed), sys.stdout, ensure_ascii=False, indent=1)
+    print()
+
+
+if __name__ == "__main__":
+    main()
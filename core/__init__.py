@@ -1,5 +1,10 @@
 """Core-moduler för Bengtssons Trävaror MCP-server."""
 
+from dotenv import load_dotenv
+
+# Ladda .env innan modulerna importeras, flera läser inställningar vid import
+load_dotenv()
+
 from .products import PRODUCTS
 from .agents import SalesAgent, ComplaintAgent
 
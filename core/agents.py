@@ -1,33 +1,83 @@
 """AI-agenter för e-posthantering med Gemini LLM."""
 
-import json
 import os
+import re
+import json
+import time
+import random
+import asyncio
 from datetime import datetime
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
 from .products import PRODUCTS
+from .estimator import BUILDINGS, parse_project, project_from_parameters, estimate_materials
+from .llm import get_llm_client, get_async_llm_client
+from .llm_cache import get_llm_cache
+from .metrics import get_metrics, record_llm_usage
 
 load_dotenv()
 
+MODEL = "gemini-2.5-flash"
+
+# Timeout (sekunder) och antal omförsök per LLM-anrop, samma som i klienten.
+# För strömmade svar gäller timeouten väntan på varje del av svaret.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+LLM_BACKOFF_BASE = 1.0   # Sekunder före första omförsöket (strömmat svar)
+LLM_BACKOFF_MAX = 20.0
+
+# Slutet på klagomålssvarets signatur; strömningen avbryts när den har skrivits
+SIGNATURE_END = re.compile(r"Med vänliga hälsningar.*?Bengtssons Trävaror", re.DOTALL)
+
+
+# Avbrutna strömmar som läses klart i bakgrunden (se _drain_usage)
+_draining = set()
+
+
+async def _drain_usage(stream):
+    """Läser resten av en avbruten ström och registrerar dess tokenåtgång."""
+    usage = None
+    try:
+        async def drain():
+            nonlocal usage
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+        await asyncio.wait_for(drain(), LLM_TIMEOUT)
+    except Exception:
+        pass  # Svaret är redan levererat, bara statistiken går förlorad
+    finally:
+        await stream.close()
+    record_llm_usage(MODEL, usage)
+
 
 class BaseAgent:
     """Basklass för AI-agenter med gemensam LLM-funktionalitet."""
 
     def __init__(self):
-        self.client = OpenAI(
-            api_key=os.getenv("GEMINI_API_KEY"),
-            base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-        )
+        # Processens gemensamma klient (delad anslutningspool, se core.llm)
+        self.client = get_llm_client().with_options(timeout=LLM_TIMEOUT, max_retries=LLM_RETRIES)
 
-    def run_llm(self, prompt: str, temperature: float = 0.5) -> str:
-        """Kör ett prompt mot LLM och returnerar textsvaret."""
-        response = self.client.chat.completions.create(
-            model="gemini-2.5-flash",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=temperature
-        )
+    def run_llm(self, prompt: str, temperature: float = 0.5, use_cache: bool = True) -> str:
+        """Kör ett prompt mot LLM och returnerar textsvaret.
+
+        Identiska anrop besvaras från LLM-cachen (se core.llm_cache) om inte
+        use_cache=False.
+        """
+        cache = get_llm_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(MODEL, temperature, prompt)
+            if cached is not None:
+                return cached
+
+        with get_metrics().timer("llm_request_seconds", model=MODEL, mode="complete"):
+            response = self.client.chat.completions.create(
+                model=MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature
+            )
+        record_llm_usage(MODEL, response.usage)
 
         raw = response.choices[0].message.content.strip()
 
@@ -35,15 +85,134 @@ class BaseAgent:
         if raw.startswith("```"):
             raw = raw.replace("```json", "").replace("```", "").strip()
 
+        if cache is not None:
+            tokens = response.usage.total_tokens if response.usage else 0
+            cache.put(MODEL, temperature, prompt, raw, tokens)
+
         return raw
 
-    def run_llm_json(self, prompt: str, temperature: float = 0.3) -> dict | None:
+    async def stream_llm(self, prompt: str, temperature: float = 0.5, on_progress=None,
+                         stop_pattern: re.Pattern = None, use_cache: bool = True) -> str:
+        """Kör ett prompt med strömmande svar och returnerar hela texten.
+
+        Tidsmätningen sparas i self.last_stream_stats:
+        ttft (sekunder till första token), total (sekunder), chars och
+        stopped_early.
+
+        Tokenåtgången registreras som i run_llm (record_llm_usage) från
+        strömmens sista del. Avbryts strömningen av stop_pattern läses
+        resten av strömmen i bakgrunden för att få med den.
+
+        Samma timeout och antal omförsök som run_llm: strömningen avbryts om
+        ingen del av svaret kommit på LLM_TIMEOUT sekunder och görs då om
+        från början, upp till LLM_RETRIES gånger med exponentiell backoff
+        och full jitter.
+
+        Args:
+            on_progress: Async-funktion som anropas med antal mottagna tecken
+                efter varje del av svaret
+            stop_pattern: Avbryt strömningen när texten matchar mönstret
+                (texten kapas efter matchningen)
+            use_cache: Använd LLM-cachen (se run_llm)
+        """
+        start = time.perf_counter()
+        cache = get_llm_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(MODEL, temperature, prompt)
+            if cached is not None:
+                self.last_stream_stats = {"ttft": 0.0, "total": time.perf_counter() - start,
+                                          "chars": len(cached), "stopped_early": False}
+                return cached
+
+        client = get_async_llm_client().with_options(timeout=LLM_TIMEOUT, max_retries=0)
+        for attempt in range(LLM_RETRIES + 1):
+            try:
+                text, ttft, stopped_early, usage = await self._stream_once(
+                    client, prompt, temperature, start, on_progress, stop_pattern
+                )
+                break
+            except Exception as e:
+                if attempt == LLM_RETRIES:
+                    raise
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+                print(f"Strömmat LLM-anrop misslyckades ({type(e).__name__}), försöker igen om {delay:.1f} s")
+                await asyncio.sleep(delay)
+
+        text = text.strip()
+        self.last_stream_stats = {
+            "ttft": ttft if ttft is not None else time.perf_counter() - start,
+            "total": time.perf_counter() - start,
+            "chars": len(text),
+            "stopped_early": stopped_early,
+        }
+        metrics = get_metrics()
+        metrics.observe("llm_ttft_seconds", self.last_stream_stats["ttft"], model=MODEL)
+        metrics.observe("llm_request_seconds", self.last_stream_stats["total"], model=MODEL, mode="stream")
+        record_llm_usage(MODEL, usage)
+        if cache is not None:
+            cache.put(MODEL, temperature, prompt, text, usage.total_tokens if usage else 0)
+        return text
+
+    async def _stream_once(self, client, prompt: str, temperature: float, start: float,
+                           on_progress, stop_pattern: re.Pattern) -> tuple:
+        """Ett försök att strömma svaret. Returnerar (text, ttft, stopped_early, usage)."""
+        stream = await client.chat.completions.create(
+            model=MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            stream=True,
+            # Sista delen får usage (tokens), som i ett svar utan strömning
+            stream_options={"include_usage": True}
+        )
+
+        text = ""
+        ttft = None
+        stopped_early = False
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                text += chunk.choices[0].delta.content
+
+                if on_progress is not None:
+                    await on_progress(len(text))
+
+                if stop_pattern is not None:
+                    match = stop_pattern.search(text)
+                    if match:
+                        text = text[:match.end()]
+                        stopped_early = True
+                        break
+        except BaseException:
+            await stream.close()
+            raise
+
+        if stopped_early:
+            # Sista delen (med usage) kommer strax efter signaturen; läs den i
+            # bakgrunden så att svaret inte behöver vänta på den
+            task = asyncio.ensure_future(_drain_usage(stream))
+            _draining.add(task)
+            task.add_done_callback(_draining.discard)
+        else:
+            await stream.close()
+        return text, ttft, stopped_early, usage
+
+    def run_llm_json(self, prompt: str, temperature: float = 0.3, use_cache: bool = True) -> dict | None:
         """Kör ett prompt som ska returnera JSON."""
-        raw = self.run_llm(prompt, temperature=temperature)
+        raw = self.run_llm(prompt, temperature=temperature, use_cache=use_cache)
         try:
             return json.loads(raw)
         except json.JSONDecodeError:
             print("AI-svaret gick inte att tolka:", raw)
+            # Cacha inte ett trasigt svar, nästa försök ska gå till LLM:en
+            cache = get_llm_cache() if use_cache else None
+            if cache is not None:
+                cache.discard(MODEL, temperature, prompt)
             return None
 
 
@@ -57,6 +226,27 @@ class ComplaintAgent(BaseAgent):
             email: Dict med 'from', 'subject', 'body'
             history: Formaterad konversationshistorik (valfritt)
         """
+        return self.run_llm(self._complaint_prompt(email, history))
+
+    async def stream_response_to_complaint(self, email: dict, history: str = "", on_progress=None) -> str:
+        """Genererar ett svar på ett kundklagomål med strömmande LLM-svar.
+
+        Strömningen avbryts så fort signaturen har skrivits. Tidsmätningen
+        finns i self.last_stream_stats (se BaseAgent.stream_llm).
+
+        Args:
+            email: Dict med 'from', 'subject', 'body'
+            history: Formaterad konversationshistorik (valfritt)
+            on_progress: Async-funktion som anropas med antal genererade tecken
+        """
+        return await self.stream_llm(
+            self._complaint_prompt(email, history),
+            on_progress=on_progress,
+            stop_pattern=SIGNATURE_END
+        )
+
+    def _complaint_prompt(self, email: dict, history: str = "") -> str:
+        """Bygger prompten för ett klagomålssvar."""
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         history_section = ""
@@ -68,7 +258,7 @@ VIKTIGT: Använd historiken ovan för att ge ett mer personligt svar.
 Om kunden har kontaktat oss tidigare, referera till det.
 """
 
-        prompt = f"""
+        return f"""
         Du är en kontorsassistent som besvarar klagomål via mail.
         Läs följande mail och skapa ett anpassat, trevligt och kort svar.
         {history_section}
@@ -90,14 +280,45 @@ Om kunden har kontaktat oss tidigare, referera till det.
         Bengtssons Trävaror
         """
 
-        return self.run_llm(prompt)
-
 
 class SalesAgent(BaseAgent):
     """Agent som beräknar materialåtgång för byggprojekt."""
 
     def estimate_materials_json(self, description: str) -> dict | None:
-        """Beräknar materialåtgång för ett byggprojekt, grupperat per byggdel."""
+        """Beräknar materialåtgång för ett byggprojekt, grupperat per byggdel.
+
+        Mängderna räknas fram lokalt och deterministiskt (core.estimator).
+        LLM:en används bara för att tolka beskrivningar som inte går att
+        tolka lokalt, och som sista utväg för hela beräkningen.
+        """
+        spec = parse_project(description) or self._parse_project_llm(description)
+        if spec is not None:
+            return estimate_materials(spec)
+        return self._estimate_materials_llm(description)
+
+    def _parse_project_llm(self, description: str) -> dict | None:
+        """Låter LLM:en tolka projektets parametrar (inte mängderna)."""
+        prompt = f"""Tolka följande beskrivning av ett byggprojekt. Svara ENDAST med JSON.
+
+Beskrivning: {description}
+
+Svara med:
+{{
+    "building": {" | ".join(f'"{b}"' for b in BUILDINGS)} | "annat",
+    "area": grundyta i kvm (tal),
+    "width": kortsida i meter om angiven, annars null,
+    "length": långsida i meter om angiven, annars null,
+    "wall_height": vägghöjd i meter om angiven, annars null,
+    "roof": "sadeltak" | "pulpettak" | "platt" | null,
+    "insulated": true | false | null
+}}"""
+        params = self.run_llm_json(prompt, temperature=0.0)
+        if not isinstance(params, dict):
+            return None
+        return project_from_parameters(params)
+
+    def _estimate_materials_llm(self, description: str) -> dict | None:
+        """Låter LLM:en uppskatta hela materiallistan (när projektet inte kan tolkas)."""
         prompt = f"""Du är en byggnadsteknisk assistent. Läs följande beskrivning av ett byggprojekt
 och uppskatta materialåtgången baserat på standardbyggteknik i Sverige.
 
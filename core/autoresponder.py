@@ -1,15 +1,29 @@
 """Gmail API-integration för att läsa och skicka mail."""
 
 import os
+import sys
+import json
+import time
 import pickle
 import base64
+import threading
+from email import message_from_bytes
 from email.mime.text import MIMEText
+from email.policy import default as default_policy
+from datetime import datetime, timezone
+from pathlib import Path
 
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 
-from .agents import ComplaintAgent
+from .metrics import timed, get_metrics
+from .outbox import is_retryable
+from .push import get_notifier
+from .transport import MailTransport
 
 # Gmail API scopes - läsa och skicka mail
 SCOPES = [
@@ -18,20 +32,46 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.modify'  # För att markera som läst
 ]
 
+GMAIL_BATCH_SIZE = 100  # Max antal delanrop per batch-HTTP-anrop (Gmail tillåter 100)
+GMAIL_PAGE_SIZE = 500   # Max antal id:n per messages.list-sida
+GMAIL_MODIFY_BATCH_SIZE = 1000  # Max antal id:n per batchModify-anrop
+# Omförsök för delanrop i ett batch-anrop som misslyckas tillfälligt (429, 5xx)
+GMAIL_BATCH_RETRIES = 3
+GMAIL_BATCH_BACKOFF = 1.0  # Sekunder före första omförsöket, fördubblas per försök
 
-class GmailClient:
+# Pub/Sub-topic för push-notiser (users.watch), t.ex. "projects/<projekt>/topics/gmail".
+# Topicens push-prenumeration ska peka på webhooken i core/push.py.
+GMAIL_PUSH_TOPIC = os.getenv("GMAIL_PUSH_TOPIC", "")
+GMAIL_WATCH_RENEW = 24 * 3600  # Gmail rekommenderar att watch förnyas dagligen (gäller i 7 dagar)
+
+# Senast synkade historyId och hämtade men ännu inte kvitterade mail sparas här
+# mellan körningar (se sync_unread_emails)
+GMAIL_STATE_FILE = Path(__file__).parent.parent / "gmail_state.json"
+
+
+def _internal_date(msg: dict) -> str | None:
+    """Gmails ankomsttid (internalDate, ms sedan epoch) i ISO-format."""
+    if not msg.get('internalDate'):
+        return None
+    return datetime.fromtimestamp(int(msg['internalDate']) / 1000, tz=timezone.utc).isoformat()
+
+
+class GmailClient(MailTransport):
     """Läser och skickar mail via Gmail API."""
 
     def __init__(self):
+        self.creds = None
         self.service = self._authenticate_gmail()
         self.sender_email = os.getenv("SENDER_EMAIL")
-        self._complaint_agent = None
+        # httplib2 är inte trådsäkert: varje tråd som skickar får en egen anslutning
+        self._local = threading.local()
+        self._watch_renewed = 0.0
+        self._watch_lock = threading.Lock()
+        self._state_lock = threading.Lock()
 
     @property
-    def complaint_agent(self):
-        if self._complaint_agent is None:
-            self._complaint_agent = ComplaintAgent()
-        return self._complaint_agent
+    def supports_push(self) -> bool:
+        return bool(GMAIL_PUSH_TOPIC)
 
     def _authenticate_gmail(self):
         """Autentiserar mot Gmail API."""
@@ -56,33 +96,255 @@ class GmailClient:
             with open('token.pickle', 'wb') as token:
                 pickle.dump(creds, token)
 
+        self.creds = creds
         return build('gmail', 'v1', credentials=creds)
 
-    def get_unread_emails(self, max_results: int = 10) -> list:
-        """Hämtar olästa mail från inkorgen."""
-        results = self.service.users().messages().list(
-            userId='me',
-            q='is:unread',
-            maxResults=max_results
-        ).execute()
+    def _thread_http(self) -> AuthorizedHttp:
+        """Returnerar trådens egen autentiserade HTTP-anslutning."""
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._local.http = http
+        return http
 
-        messages = results.get('messages', [])
-        emails = []
+    def get_unread_emails(self, max_results: int | None = 10, format: str = 'full') -> list:
+        """Hämtar olästa mail från inkorgen.
 
-        for msg in messages:
-            email_data = self._parse_message(msg['id'])
-            if email_data:
-                emails.append(email_data)
+        Listningen pagineras med nextPageToken och meddelandena hämtas med
+        batch-anrop (upp till GMAIL_BATCH_SIZE per HTTP-anrop) i stället för
+        ett anrop per mail.
 
-        return emails
+        Args:
+            max_results: Max antal mail att hämta, eller None för alla olästa
+            format: 'full' (headers + body), 'metadata' (bara headers, body
+                ersätts av Gmails snippet) eller 'raw' (hela RFC 822-mailet)
+        """
+        msg_ids, _ = self._list_message_ids('is:unread', max_results)
+        return self._get_messages(msg_ids, format)
 
-    def _parse_message(self, msg_id: str) -> dict | None:
-        """Parsar ett Gmail-meddelande till vårt format."""
-        msg = self.service.users().messages().get(
-            userId='me',
-            id=msg_id,
-            format='full'
-        ).execute()
+    def sync_unread_emails(self, max_results: int | None = None, format: str = 'full') -> list:
+        """Hämtar olästa mail som tillkommit sedan förra synken.
+
+        Använder users.history.list från senast sparade historyId, så att
+        kostnaden skalar med antalet nya mail i stället för med inkorgens
+        storlek. Första gången, eller om historyId har gått ut (HTTP 404),
+        görs en full sökning på olästa mail.
+
+        Mail som returnerats men inte kvitterats (mark_as_read_bulk), t.ex.
+        för att hanteringen misslyckades, sparas i GMAIL_STATE_FILE och
+        hämtas igen vid nästa synk så länge de är olästa. En full sökning
+        som avbröts vid max_results sparar inget historyId, så nästa synk
+        gör en ny full sökning i stället för att hoppa över resten.
+
+        Args:
+            max_results: Max antal mail vid full sökning. Vid inkrementell
+                synk hämtas alltid alla nya mail, annars skulle de som inte
+                får plats hoppas över nästa gång.
+            format: Se get_unread_emails
+        """
+        with self._state_lock:
+            state = self._load_state()
+        history_id = state.get("history_id")
+        msg_ids = None
+
+        if history_id:
+            try:
+                msg_ids, new_history_id = self._list_history_message_ids(history_id)
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                print("historyId har gått ut, gör full synk av olästa mail", file=sys.stderr)
+
+        if msg_ids is None:
+            # Läs historyId före listningen så att inget mail kan hamna mellan
+            new_history_id = self.service.users().getProfile(userId='me').execute()['historyId']
+            msg_ids, truncated = self._list_message_ids('is:unread', max_results)
+            if truncated:
+                new_history_id = None
+
+        # Okvitterade mail från tidigare synkar först, de kom in före de nya
+        new_ids = set(msg_ids)
+        msg_ids = [msg_id for msg_id in state.get("unacked", []) if msg_id not in new_ids] + msg_ids
+        fetched, missing = self._fetch_messages(msg_ids, format)
+
+        # Mail som lästs på annat sätt släpps, mail som inte gick att hämta (utom 404) sparas till nästa gång
+        unread = [msg_id for msg_id in msg_ids
+                  if msg_id in fetched and 'UNREAD' in fetched[msg_id].get('labelIds', ['UNREAD'])]
+        unacked = set(unread) | (set(msg_ids) - fetched.keys() - missing)
+        unacked = [msg_id for msg_id in msg_ids if msg_id in unacked]
+        with self._state_lock:
+            self._save_state({"history_id": new_history_id, "unacked": unacked})
+        return [self._to_email(fetched[msg_id], format) for msg_id in unread]
+
+    def get_emails(self, msg_ids: list, format: str = 'full') -> list:
+        """Hämtar givna mail med batch-anrop (se _get_messages)."""
+        return self._get_messages(list(msg_ids), format)
+
+    @timed("mail_request_seconds", transport="gmail", op="history")
+    def _list_history_message_ids(self, start_history_id: str) -> tuple[list, str]:
+        """Listar id:n för olästa inkorgsmail som lagts till efter start_history_id.
+
+        Returns:
+            (id:n i ankomstordning, senaste historyId)
+        """
+        msg_ids = []
+        seen = set()
+        history_id = start_history_id
+        page_token = None
+
+        while True:
+            results = self.service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                labelId='INBOX',
+                pageToken=page_token
+            ).execute()
+
+            for record in results.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    msg = added['message']
+                    if 'UNREAD' in msg.get('labelIds', []) and msg['id'] not in seen:
+                        seen.add(msg['id'])
+                        msg_ids.append(msg['id'])
+
+            history_id = results.get('historyId', history_id)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        return msg_ids, history_id
+
+    def _load_state(self) -> dict:
+        """Läser synkstatus från GMAIL_STATE_FILE: {"history_id", "unacked": [id, ...]}."""
+        if not GMAIL_STATE_FILE.exists():
+            return {}
+        try:
+            with open(GMAIL_STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+    def _save_state(self, state: dict):
+        """Sparar synkstatus till GMAIL_STATE_FILE."""
+        if state.get("history_id") is not None:
+            state = {**state, "history_id": str(state["history_id"])}
+        with open(GMAIL_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+    def _forget_unacked(self, msg_ids: list):
+        """Tar bort kvitterade mail ur listan med okvitterade i GMAIL_STATE_FILE."""
+        with self._state_lock:
+            state = self._load_state()
+            if not state.get("unacked"):
+                return
+            acked = set(msg_ids)
+            state["unacked"] = [msg_id for msg_id in state["unacked"] if msg_id not in acked]
+            self._save_state(state)
+
+    @timed("mail_request_seconds", transport="gmail", op="list")
+    def _list_message_ids(self, query: str, max_results: int | None) -> tuple[list, bool]:
+        """Listar id:n för meddelanden som matchar query, sida för sida.
+
+        Returns:
+            (id:n, True om listningen avbröts vid max_results och fler finns)
+        """
+        msg_ids = []
+        page_token = None
+
+        while max_results is None or len(msg_ids) < max_results:
+            page_size = GMAIL_PAGE_SIZE
+            if max_results is not None:
+                page_size = min(page_size, max_results - len(msg_ids))
+
+            results = self.service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=page_size,
+                pageToken=page_token
+            ).execute()
+
+            msg_ids.extend(msg['id'] for msg in results.get('messages', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        return msg_ids, bool(page_token)
+
+    def _get_messages(self, msg_ids: list, format: str = 'full') -> list:
+        """Hämtar och parsar flera meddelanden med Gmail batch-anrop (se _fetch_messages)."""
+        fetched, _ = self._fetch_messages(msg_ids, format)
+        # Behåll listningens ordning
+        return [self._to_email(fetched[msg_id], format) for msg_id in msg_ids if msg_id in fetched]
+
+    @timed("mail_request_seconds", transport="gmail", op="get")
+    def _fetch_messages(self, msg_ids: list, format: str = 'full') -> tuple[dict, set]:
+        """Hämtar flera meddelanden (Gmails format) med batch-anrop.
+
+        Delanrop som misslyckas tillfälligt (rate limit, serverfel) görs om i
+        ett nytt batch-anrop, upp till GMAIL_BATCH_RETRIES gånger. Mail som
+        ändå inte gick att hämta skrivs ut, räknas i mail_fetch_failed_total
+        och saknas i resultatet (de förblir olästa).
+
+        Returns:
+            ({id: meddelande}, id:n som inte finns (HTTP 404))
+        """
+        fetched = {}
+        missing = set()
+        pending = list(msg_ids)
+
+        for attempt in range(GMAIL_BATCH_RETRIES + 1):
+            retry = []
+
+            def on_response(request_id, response, exception):
+                if exception is None:
+                    fetched[request_id] = response
+                elif attempt < GMAIL_BATCH_RETRIES and is_retryable(exception):
+                    retry.append(request_id)
+                else:
+                    print(f"Kunde inte hämta mail {request_id}: {exception}", file=sys.stderr)
+                    get_metrics().inc("mail_fetch_failed_total", transport="gmail")
+                    if isinstance(exception, HttpError) and exception.resp.status == 404:
+                        missing.add(request_id)
+
+            for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+                batch = self.service.new_batch_http_request(callback=on_response)
+                for msg_id in pending[start:start + GMAIL_BATCH_SIZE]:
+                    batch.add(self._get_request(msg_id, format), request_id=msg_id)
+                batch.execute()
+
+            if not retry:
+                break
+            print(f"{len(retry)} mail kunde inte hämtas, försöker igen", file=sys.stderr)
+            time.sleep(GMAIL_BATCH_BACKOFF * 2 ** attempt)
+            pending = retry
+
+        return fetched, missing
+
+    def _get_request(self, msg_id: str, format: str):
+        """Bygger ett (ej exekverat) messages.get-anrop."""
+        kwargs = {'userId': 'me', 'id': msg_id, 'format': format}
+        if format == 'metadata':
+            kwargs['metadataHeaders'] = ['From', 'Subject']
+        return self.service.users().messages().get(**kwargs)
+
+    def _parse_message(self, msg_id: str, format: str = 'full') -> dict | None:
+        """Hämtar och parsar ett enskilt Gmail-meddelande till vårt format."""
+        msg = self._get_request(msg_id, format).execute()
+        return self._to_email(msg, format)
+
+    def _to_email(self, msg: dict, format: str = 'full') -> dict:
+        """Konverterar ett Gmail-meddelande till vårt format."""
+        if format == 'raw':
+            parsed = message_from_bytes(base64.urlsafe_b64decode(msg['raw']), policy=default_policy)
+            text_part = parsed.get_body(preferencelist=('plain',))
+            return {
+                'id': msg['id'],
+                'from': parsed.get('From', ''),
+                'subject': parsed.get('Subject', ''),
+                'body': text_part.get_content() if text_part else '',
+                'date': _internal_date(msg)
+            }
 
         headers = msg.get('payload', {}).get('headers', [])
 
@@ -95,14 +357,18 @@ class GmailClient:
             elif header['name'].lower() == 'subject':
                 subject = header['value']
 
-        # Extrahera body
-        body = self._get_body(msg.get('payload', {}))
+        # Extrahera body ('metadata' saknar body, använd Gmails utdrag)
+        if format == 'metadata':
+            body = msg.get('snippet', '')
+        else:
+            body = self._get_body(msg.get('payload', {}))
 
         return {
-            'id': msg_id,
+            'id': msg['id'],
             'from': from_addr,
             'subject': subject,
-            'body': body
+            'body': body,
+            'date': _internal_date(msg)
         }
 
     def _get_body(self, payload: dict) -> str:
@@ -126,6 +392,7 @@ class GmailClient:
 
         return ''
 
+    @timed("mail_request_seconds", transport="gmail", op="modify")
     def mark_as_read(self, msg_id: str):
         """Markerar ett mail som läst."""
         self.service.users().messages().modify(
@@ -133,9 +400,61 @@ class GmailClient:
             id=msg_id,
             body={'removeLabelIds': ['UNREAD']}
         ).execute()
+        self._forget_unacked([msg_id])
+
+    @timed("mail_request_seconds", transport="gmail", op="modify")
+    def mark_as_read_bulk(self, msg_ids: list):
+        """Markerar flera mail som lästa med users.messages.batchModify.
+
+        Ett HTTP-anrop per GMAIL_MODIFY_BATCH_SIZE id:n i stället för ett per mail.
+        """
+        for start in range(0, len(msg_ids), GMAIL_MODIFY_BATCH_SIZE):
+            self.service.users().messages().batchModify(
+                userId='me',
+                body={
+                    'ids': msg_ids[start:start + GMAIL_MODIFY_BATCH_SIZE],
+                    'removeLabelIds': ['UNREAD']
+                }
+            ).execute()
+        self._forget_unacked(msg_ids)
+
+    @timed("mail_request_seconds", transport="gmail", op="watch")
+    def watch(self, topic: str = GMAIL_PUSH_TOPIC) -> dict:
+        """Startar (eller förnyar) push-notiser för inkorgen via users.watch.
+
+        Gmail publicerar då {"emailAddress", "historyId"} på Pub/Sub-topicen
+        vid varje ändring i INBOX.
 
-    def _send_email(self, to: str, subject: str, body: str):
-        """Skickar ett e-postmeddelande."""
+        Returns:
+            {'historyId': ..., 'expiration': ms sedan epoch}
+        """
+        response = self.service.users().watch(
+            userId='me',
+            body={'topicName': topic, 'labelIds': ['INBOX'], 'labelFilterBehavior': 'INCLUDE'}
+        ).execute(http=self._thread_http())
+        self._watch_renewed = time.monotonic()
+        print(f"Gmail watch aktiv till {response.get('expiration')} (ms)", file=sys.stderr)
+        return response
+
+    def wait_for_new_mail(self, timeout: float) -> bool:
+        """Väntar på en push-notis från Gmail (via webhooken i core/push.py).
+
+        Förnyar watch om det behövs innan väntan.
+        """
+        if not GMAIL_PUSH_TOPIC:
+            raise NotImplementedError("GMAIL_PUSH_TOPIC är inte satt")
+        with self._watch_lock:
+            if not self._watch_renewed or time.monotonic() - self._watch_renewed > GMAIL_WATCH_RENEW:
+                self.watch(GMAIL_PUSH_TOPIC)
+        return get_notifier().wait(timeout)
+
+    @timed("mail_request_seconds", transport="gmail", op="send")
+    def send_email(self, to: str, subject: str, body: str):
+        """Skickar ett e-postmeddelande.
+
+        Kan anropas från flera trådar samtidigt (t.ex. utkorgens trådpool,
+        se core.outbox); varje tråd använder sin egen HTTP-anslutning.
+        """
         message = MIMEText(body)
         message['to'] = to
         message['from'] = self.sender_email
@@ -145,25 +464,6 @@ class GmailClient:
         self.service.users().messages().send(
             userId='me',
             body={'raw': raw}
-        ).execute()
+        ).execute(http=self._thread_http())
 
-        print(f"Mail skickat till {to}: {subject}")
-
-    def create_and_send_auto_reply(self, email: dict):
-        """Skapar och skickar ett generiskt autosvar."""
-        subject = f"Autosvar: {email['subject']}"
-        body = (
-            f"Hej!\n\n"
-            f"Tack för ditt mejl angående: {email['subject']}\n\n"
-            f"Vi har mottagit ditt meddelande och återkommer så snart som möjligt.\n\n"
-            f"Vänliga hälsningar,\n"
-            f"Bengtssons Trävaror"
-        )
-        self._send_email(email['from'], subject, body)
-
-    def create_auto_response_complaint(self, email: dict, to: str = None):
-        """Skapar ett AI-genererat svar på ett klagomål."""
-        to = to or email['from']
-        subject = f"Svar på klagomål: {email['subject']}"
-        body = self.complaint_agent.write_response_to_complaint(email)
-        self._send_email(to, subject, body)
+        print(f"Mail skickat till {to}: {subject}", file=sys.stderr)
@@ -1,35 +1,126 @@
-"""Enkel konversationshistorik sparad i JSON-fil.
+"""Konversationshistorik sparad i en SQLite-databas.
 
 Sparar alla konversationer per kund så att AI:n kan se tidigare dialog.
-Filen conversations.json kan läsas/redigeras manuellt vid behov.
+Varje meddelande är en rad i tabellen messages, indexerad på kundens
+e-postadress. Att lägga till ett meddelande är en enda INSERT oavsett hur
+stor historiken är, och databasen körs i WAL-läge så att flera processer
+kan läsa och skriva samtidigt utan att filen går sönder.
+
+Databasen kan inspekteras manuellt, t.ex. med:
+    sqlite3 conversations.db "SELECT * FROM messages WHERE email = '...'"
+
+En befintlig conversations.json (tidigare format) importeras automatiskt
+första gången databasen skapas och döps sedan om till conversations.json.migrated.
+
+Lästa historiker cachas i processen (LRU, HISTORY_CACHE_SIZE kunder).
+add_message lägger det nya meddelandet direkt i kundens cachade historik,
+så att läsningen som följer (supportflödet sparar kundens mail och läser
+sedan historiken) blir en träff. clear_history invaliderar. Cachen ser
+inte skrivningar från andra processer.
 """
 
-import json
 import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 
-# Sökväg till historik-filen (i samma mapp som projektet)
-CONVERSATIONS_FILE = Path(__file__).parent.parent / "conversations.json"
+from .metrics import timed
+
+# Sökvägar (i samma mapp som projektet)
+CONVERSATIONS_DB = Path(__file__).parent.parent / "conversations.db"
+CONVERSATIONS_FILE = Path(__file__).parent.parent / "conversations.json"  # Gammalt format
+
+# En anslutning per tråd (sqlite3-anslutningar får inte delas mellan trådar)
+_local = threading.local()
+_init_lock = threading.Lock()
 
+# LRU-cache för get_history: e-post -> (antal begärda meddelanden, meddelanden)
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "256"))
+_history_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_generation = 0  # Ökas vid varje skrivning
+# Skrivningar i processen görs en i taget, så att cachen får samma ordning som databasen
+_write_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
 
-def _load_conversations() -> dict:
-    """Laddar konversationer från fil."""
-    if CONVERSATIONS_FILE.exists():
-        try:
-            with open(CONVERSATIONS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-    return {}
 
+def _connect() -> sqlite3.Connection:
+    """Returnerar trådens databasanslutning och skapar schemat vid behov."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CONVERSATIONS_DB, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _init_lock:
+            _create_schema(conn)
+        _local.conn = conn
+    return conn
+
+
+def _create_schema(conn: sqlite3.Connection):
+    """Skapar tabeller och index, och migrerar gammal JSON-historik."""
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                role TEXT NOT NULL,
+                subject TEXT NOT NULL DEFAULT '',
+                message TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_email ON messages (email, id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)")
+    _migrate_json(conn)
+
+
+def _migrate_json(conn: sqlite3.Connection):
+    """Importerar conversations.json (engångsmigrering från det gamla formatet).
+
+    Importen och en rad i tabellen migrations sparas i samma transaktion.
+    Filen döps om efter commit; avbryts processen innan dess hoppas
+    importen över nästa gång och filen döps bara om.
+    """
+    if not CONVERSATIONS_FILE.exists():
+        return
+
+    # Skrivlås innan filen kontrolleras igen, så att bara en process migrerar
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        migrated = conn.execute("SELECT 1 FROM migrations WHERE name = 'conversations.json'").fetchone()
+        if CONVERSATIONS_FILE.exists() and migrated is None:
+            try:
+                with open(CONVERSATIONS_FILE, "r", encoding="utf-8") as f:
+                    conversations = json.load(f)
+            except json.JSONDecodeError:
+                conversations = {}
 
-def _save_conversations(data: dict):
-    """Sparar konversationer till fil."""
-    with open(CONVERSATIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+            conn.executemany(
+                "INSERT INTO messages (email, timestamp, role, subject, message) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (email, msg["timestamp"], msg["role"], msg.get("subject", ""), msg["message"])
+                    for email, messages in conversations.items()
+                    for msg in messages
+                ]
+            )
+            conn.execute("INSERT INTO migrations (name) VALUES ('conversations.json')")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
+    try:
+        CONVERSATIONS_FILE.replace(CONVERSATIONS_FILE.with_name(CONVERSATIONS_FILE.name + ".migrated"))
+    except FileNotFoundError:
+        pass  # En annan process hann döpa om den
 
+
+@timed("conversation_seconds", op="write")
 def add_message(email: str, role: str, message: str, subject: str = ""):
     """Lägger till ett meddelande i konversationshistoriken.
 
@@ -39,21 +130,18 @@ def add_message(email: str, role: str, message: str, subject: str = ""):
         message: Meddelandetext
         subject: Ämnesrad (valfritt)
     """
-    conversations = _load_conversations()
-
-    if email not in conversations:
-        conversations[email] = []
-
-    conversations[email].append({
-        "timestamp": datetime.now().isoformat(),
-        "role": role,
-        "subject": subject,
-        "message": message
-    })
-
-    _save_conversations(conversations)
+    msg = {"timestamp": datetime.now().isoformat(), "role": role, "subject": subject, "message": message}
+    conn = _connect()
+    with _write_lock:
+        with conn:
+            conn.execute(
+                "INSERT INTO messages (email, timestamp, role, subject, message) VALUES (?, ?, ?, ?, ?)",
+                (email, msg["timestamp"], role, subject, message)
+            )
+        _append_cached(email, msg)
 
 
+@timed("conversation_seconds", op="read")
 def get_history(email: str, max_messages: int = 10) -> list:
     """Hämtar konversationshistorik för en kund.
 
@@ -62,11 +150,74 @@ def get_history(email: str, max_messages: int = 10) -> list:
         max_messages: Max antal meddelanden att hämta
 
     Returns:
-        Lista med meddelanden (senaste först)
+        Lista med de senaste meddelandena (äldst först)
     """
-    conversations = _load_conversations()
-    history = conversations.get(email, [])
-    return history[-max_messages:]  # Senaste N meddelanden
+    with _cache_lock:
+        cached = _history_cache.get(email)
+        # Träff om cachen har minst lika många meddelanden, eller hela historiken
+        if cached is not None and (cached[0] >= max_messages or len(cached[1]) < cached[0]):
+            _history_cache.move_to_end(email)
+            _cache_stats["hits"] += 1
+            return [dict(msg) for msg in cached[1][-max_messages:]] if max_messages > 0 else []
+        _cache_stats["misses"] += 1
+        generation = _cache_generation
+
+    rows = _connect().execute(
+        """SELECT timestamp, role, subject, message FROM messages
+           WHERE email = ? ORDER BY id DESC LIMIT ?""",
+        (email, max_messages)
+    ).fetchall()
+    history = [dict(row) for row in reversed(rows)]  # Senaste N meddelanden
+
+    with _cache_lock:
+        # Spara inte om någon skrev medan vi läste (då kan raderna vara inaktuella)
+        if HISTORY_CACHE_SIZE > 0 and generation == _cache_generation:
+            _history_cache[email] = (max_messages, [dict(msg) for msg in history])
+            _history_cache.move_to_end(email)
+            while len(_history_cache) > HISTORY_CACHE_SIZE:
+                _history_cache.popitem(last=False)
+                _cache_stats["evictions"] += 1
+
+    return history
+
+
+def _append_cached(email: str, msg: dict):
+    """Lägger ett nytt meddelande sist i kundens cachade historik (om kunden är cachad)."""
+    global _cache_generation
+    with _cache_lock:
+        # Läsningar som pågick under skrivningen sparar inte sina (inaktuella) rader
+        _cache_generation += 1
+        cached = _history_cache.get(email)
+        if cached is None:
+            return
+        limit, messages = cached
+        messages.append(dict(msg))
+        # Cachen håller de senaste `limit` meddelandena (eller hela historiken om den är kortare)
+        if len(messages) > limit:
+            del messages[:len(messages) - limit]
+
+
+def _invalidate(email: str = None):
+    """Tar bort en kund (eller alla om None) ur historikcachen."""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        if email is None:
+            _history_cache.clear()
+        else:
+            _history_cache.pop(email, None)
+
+
+def cache_stats() -> dict:
+    """Returnerar träffar, missar och storlek för historikcachen."""
+    with _cache_lock:
+        lookups = _cache_stats["hits"] + _cache_stats["misses"]
+        return {
+            **_cache_stats,
+            "size": len(_history_cache),
+            "max_size": HISTORY_CACHE_SIZE,
+            "hit_rate": _cache_stats["hits"] / lookups if lookups else 0.0,
+        }
 
 
 def format_history_for_prompt(email: str, max_messages: int = 5) -> str:
@@ -102,10 +253,10 @@ def clear_history(email: str = None):
     Args:
         email: Kundens e-post, eller None för att rensa allt
     """
-    if email is None:
-        _save_conversations({})
-    else:
-        conversations = _load_conversations()
-        if email in conversations:
-            del conversations[email]
-            _save_conversations(conversations)
+    conn = _connect()
+    with conn:
+        if email is None:
+            conn.execute("DELETE FROM messages")
+        else:
+            conn.execute("DELETE FROM messages WHERE email = ?", (email,))
+    _invalidate(email)
@@ -0,0 +1,223 @@
+"""Dubbletthantering: samma mail från samma avsändare hanteras bara en gång.
+
+Kunder skickar ofta samma klagomål två eller tre gånger, och loopar i
+sändlistor levererar samma mail igen. Varje kopia skulle annars kosta en
+klassificering, ett LLM-svar och ett utskick.
+
+Klienten kör DuplicateTracker.fold() på varje hämtad omgång mail innan
+klassificeringen:
+
+- Exakta dubbletter: samma SHA-256 över normaliserat ämne och text
+  (gemener, utan Re:/Sv:/Fwd:, citerade rader och extra blanksteg)
+- Nästan-dubbletter: MinHash (bottom-k) över ord och ordpar i den
+  normaliserade texten, med uppskattad Jaccard-likhet minst
+  DEDUP_SIMILARITY, och exakt samma tal i ämne och text. "altandäck
+  20 kvm" och "altandäck 30 kvm" är alltså två olika förfrågningar även
+  om resten av texten är densamma.
+
+Bara mail från samma avsändare inom DEDUP_WINDOW sekunder (efter
+mailens datum) jämförs. Dubbletterna viks in i originalets ärende och
+kvitteras tillsammans med det. Antalet vikta mail räknas per ärende och
+totalt (stats() och räknaren dedup_folded_total).
+"""
+
+import os
+import re
+import time
+import heapq
+import hashlib
+from collections import Counter
+from datetime import datetime
+from email.utils import parseaddr
+
+from .metrics import get_metrics
+from .search import tokenize, normalize_word
+
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", str(24 * 3600)))
+# Minsta uppskattade Jaccard-likhet (0-1) för att två texter ska räknas som samma mail
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.8"))
+# Antal hashvärden i en MinHash-skiss
+DEDUP_SKETCH_SIZE = 64
+# Kortare texter (antal ord) jämförs bara exakt, likheten är för osäker på få ord
+DEDUP_MIN_WORDS = 8
+
+# Rensa gamla poster var N:e kontroll så att minnet inte växer med tiden
+_PRUNE_EVERY = 1000
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+_SUBJECT_PREFIX = re.compile(r"^\s*((re|sv|vs|fw|fwd|vb)\s*:\s*)+", re.IGNORECASE)
+
+
+def normalize_address(sender: str) -> str:
+    """Avsändarens adress utan namn, i gemener ("Anna <A@x.se>" -> "a@x.se")."""
+    return (parseaddr(sender)[1] or sender).strip().lower()
+
+
+def normalize_subject(subject: str) -> str:
+    """Ämnet utan Re:/Sv:/Fwd:-prefix, i gemener och med enkla blanksteg."""
+    return " ".join(_SUBJECT_PREFIX.sub("", subject or "").lower().split())
+
+
+def body_words(body: str) -> list[str]:
+    """Textens ord, normaliserade, utan citerade rader ("> ...") från tidigare mail."""
+    lines = [line for line in (body or "").splitlines() if not line.lstrip().startswith(">")]
+    return [normalize_word(word) for word in tokenize("\n".join(lines))]
+
+
+def content_hash(subject: str, words: list[str]) -> str:
+    """SHA-256 över normaliserat ämne och text (för exakta dubbletter)."""
+    text = normalize_subject(subject) + "\n" + " ".join(words)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def numbers(subject: str, words: list[str]) -> tuple:
+    """Alla tal i ämne och text, sorterade (mått, antal, datum, ...), med punkt som decimaltecken."""
+    text = normalize_subject(subject) + " " + " ".join(words)
+    return tuple(sorted(number.replace(",", ".") for number in _NUMBER.findall(text)))
+
+
+def _hash64(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash(words: list[str]) -> frozenset:
+    """MinHash-skiss (bottom-k): de DEDUP_SKETCH_SIZE minsta hashvärdena av textens ord och ordpar."""
+    features = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+    return frozenset(heapq.nsmallest(DEDUP_SKETCH_SIZE, map(_hash64, features)))
+
+
+def similarity(a: frozenset, b: frozenset) -> float:
+    """Uppskattad Jaccard-likhet (0-1) mellan två texter utifrån deras MinHash-skisser.
+
+    Bland de minsta hashvärdena i unionen räknas andelen som finns i båda.
+    Exakt om texterna har färre ord och ordpar än DEDUP_SKETCH_SIZE.
+    """
+    shared = a & b
+    if not shared:
+        return 0.0
+    smallest = sorted(a | b)[:DEDUP_SKETCH_SIZE]
+    return sum(h <= smallest[-1] for h in shared) / len(smallest)
+
+
+def mail_time(email: dict) -> float:
+    """Mailets tid i sekunder sedan epoch ("date" i ISO-format), annars nu."""
+    date = email.get("date")
+    if date:
+        try:
+            return datetime.fromisoformat(date).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return time.time()
+
+
+class DuplicateTracker:
+    """Håller reda på nyligen sedda mail per avsändare och viker ihop dubbletter."""
+
+    def __init__(self, window: float = DEDUP_WINDOW, min_similarity: float = DEDUP_SIMILARITY):
+        self.window = window
+        self.min_similarity = min_similarity
+        self._seen = {}              # avsändare -> [{"id", "key", "time", "hash", "sketch", "numbers"}]
+        self._collapsed = Counter()  # originalets id (key) -> antal vikta dubbletter
+        self._stats = {"checked": 0, "exact": 0, "near": 0}
+        self._latest = 0.0
+
+    def check(self, email: dict) -> tuple[dict | None, str | None]:
+        """Jämför ett mail med avsändarens tidigare mail inom fönstret och registrerar det.
+
+        Ett mail med samma id som ett tidigare (t.ex. ett mail som inte
+        hann kvitteras förra körningen) räknas inte som dubblett.
+
+        Returns:
+            (originalets post, "exact" eller "near") för en dubblett,
+            annars (None, None)
+        """
+        self._stats["checked"] += 1
+        sender = normalize_address(email.get("from", ""))
+        words = body_words(email.get("body", ""))
+        entry = {
+            "id": email.get("id"),
+            "key": email.get("id") or f"#{self._stats['checked']}",  # Testmail saknar id
+            "time": mail_time(email),
+            "hash": content_hash(email.get("subject", ""), words),
+            "sketch": minhash(words) if len(words) >= DEDUP_MIN_WORDS else None,
+            "numbers": numbers(email.get("subject", ""), words),
+        }
+
+        self._latest = max(self._latest, entry["time"])
+        if self._stats["checked"] % _PRUNE_EVERY == 0:
+            self._prune()
+
+        recent = self._seen.setdefault(sender, [])
+        for previous in reversed(recent):
+            if abs(entry["time"] - previous["time"]) > self.window:
+                continue
+            if entry["id"] is not None and previous["id"] == entry["id"]:
+                previous["time"] = entry["time"]
+                return None, None
+            if previous["hash"] == entry["hash"]:
+                return self._fold(previous, "exact")
+            # Ett ändrat tal (yta, antal, mått) är en ny förfrågan, hur lika texterna än är
+            if (entry["sketch"] is not None and previous["sketch"] is not None
+                    and entry["numbers"] == previous["numbers"]
+                    and similarity(entry["sketch"], previous["sketch"]) >= self.min_similarity):
+                return self._fold(previous, "near")
+
+        recent.append(entry)
+        return None, None
+
+    def _fold(self, original: dict, kind: str) -> tuple[dict, str]:
+        self._stats[kind] += 1
+        self._collapsed[original["key"]] += 1
+        get_metrics().inc("dedup_folded_total", kind=kind)
+        return original, kind
+
+    def fold(self, emails: list) -> list:
+        """Viker ihop dubbletterna i en omgång hämtade mail.
+
+        Mailen jämförs i datumordning, så att det äldsta blir originalet.
+        Varje original som fått dubbletter i omgången får listan
+        "duplicates" med deras id:n (för kvittering). Dubbletter av mail
+        som hanterats i en tidigare omgång har inget original i listan.
+
+        Returns:
+            De mail som ska hanteras (utan dubbletter), i ursprunglig ordning
+        """
+        by_id = {email["id"]: email for email in emails if email.get("id") is not None}
+        duplicates = set()
+        for position in sorted(range(len(emails)), key=lambda i: mail_time(emails[i])):
+            email = emails[position]
+            original, kind = self.check(email)
+            if original is None:
+                continue
+            duplicates.add(position)
+            email["duplicate_of"] = original["id"]
+            email["duplicate_kind"] = kind
+            in_batch = by_id.get(original["id"])
+            if in_batch is not None and email.get("id") is not None:
+                in_batch.setdefault("duplicates", []).append(email["id"])
+        return [email for position, email in enumerate(emails) if position not in duplicates]
+
+    def _prune(self):
+        """Tar bort poster äldre än fönstret (räknat från senast sedda mail)."""
+        cutoff = self._latest - self.window
+        for sender in list(self._seen):
+            recent = [entry for entry in self._seen[sender] if entry["time"] >= cutoff]
+            if recent:
+                self._seen[sender] = recent
+            else:
+                del self._seen[sender]
+
+    def collapse_count(self, msg_id: str) -> int:
+        """Antal dubbletter som vikts in i mailet med detta id."""
+        return self._collapsed.get(msg_id, 0)
+
+    def stats(self) -> dict:
+        """Antal kontrollerade och vikta mail (exakta och nästan-dubbletter)."""
+        folded = self._stats["exact"] + self._stats["near"]
+        return {
+            **self._stats,
+            "folded": folded,
+            "tickets": len(self._collapsed),
+            "max_collapse": max(self._collapsed.values(), default=0),
+            "fold_rate": folded / self._stats["checked"] if self._stats["checked"] else 0.0,
+        }
@@ -0,0 +1,326 @@
+"""Lokal, deterministisk materialberäkning för byggprojekt.
+
+I stället för att låta LLM:en hitta på mängder tolkas projektbeskrivningen
+lokalt (byggnadstyp, yta, mått, vägghöjd, taktyp, isolering) och
+materiallistan räknas fram med samma tumregler som prompten i
+SalesAgent: reglar cc600, isolering och skivor efter hur många kvm ett
+paket/en skiva täcker i PRODUCTS, råspont och papp per kvm tak osv.
+
+Samma beskrivning ger alltid samma resultat. LLM:en behövs bara för att
+tolka beskrivningar som parse_project() inte förstår (se
+SalesAgent.estimate_materials_json).
+
+Exempel:
+    spec = parse_project("Materialberäkning garage 40kvm med mineralull")
+    estimate_materials(spec)
+    -> {"Stomme/Väggar": {"regel_45x145_3m": 48, ...}, "Tak": {...}, ...}
+"""
+
+import re
+from math import ceil, sqrt
+
+from .products import PRODUCTS
+
+# Standardvärden per byggnadstyp
+BUILDINGS = {
+    #               väggar, golv,  isolerad, vägghöjd, taktyp
+    "garage":      (True,  False, False, 2.6, "sadeltak"),
+    "carport":     (False, False, False, 2.4, "pulpettak"),
+    "altan":       (False, False, False, 0.0, None),
+    "friggebod":   (True,  True,  False, 2.3, "sadeltak"),
+    "förråd":      (True,  True,  False, 2.3, "pulpettak"),
+    "attefall":    (True,  True,  True,  2.4, "sadeltak"),
+    "gäststuga":   (True,  True,  True,  2.4, "sadeltak"),
+    "tillbyggnad": (True,  True,  True,  2.4, "pulpettak"),
+    "bastu":       (True,  True,  True,  2.2, "pulpettak"),
+}
+
+_BUILDING_WORDS = [
+    (re.compile(pattern, re.IGNORECASE), building) for pattern, building in [
+        (r"attefall", "attefall"),
+        (r"friggebod", "friggebod"),
+        (r"carport", "carport"),
+        (r"garage", "garage"),
+        (r"altan|trall|trädäck|uteplats", "altan"),
+        (r"gäststuga|stuga", "gäststuga"),
+        (r"tillbyggnad|bygga ut", "tillbyggnad"),
+        (r"bastu", "bastu"),
+        (r"förråd|\bbod\b|redskapsbod", "förråd"),
+    ]
+]
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+_AREA = re.compile(_NUMBER + r"\s*(?:kvm|m2|m²|kvadrat)", re.IGNORECASE)
+_DIMENSIONS = re.compile(_NUMBER + r"\s*(?:m\s*)?[x×*]\s*" + _NUMBER + r"\s*(?:m\b|meter)", re.IGNORECASE)
+_WALL_HEIGHT = re.compile(
+    r"(?:vägghöjd|takhöjd|höjd)(?:en)?\D{0,15}?" + _NUMBER + r"\s*(cm|m\b|meter)"
+    r"|" + _NUMBER + r"\s*(cm|m|meter)\s+(?:höga|hög)",
+    re.IGNORECASE
+)
+_ROOF = [
+    (re.compile(r"pulpettak|pulpet", re.IGNORECASE), "pulpettak"),
+    (re.compile(r"platt tak|plant tak|platt|flackt tak", re.IGNORECASE), "platt"),
+    (re.compile(r"sadeltak|sadel|valmat|mansard", re.IGNORECASE), "sadeltak"),
+]
+_NOT_INSULATED = re.compile(r"oisolerad|utan isolering|ingen isolering", re.IGNORECASE)
+_INSULATED = re.compile(r"isoler|mineralull|glasull|året runt|vinterbonad|uppvärmd", re.IGNORECASE)
+
+# Takyta per kvm grundyta (lutning + takfot)
+ROOF_FACTOR = {"sadeltak": 1.25, "pulpettak": 1.15, "platt": 1.1}
+
+# Spill per enhet: kvm-varor och löpmeter får lite extra, styckvaror räknas exakt
+WASTE = {"kvm": 1.1, "m": 1.05, "st": 1.0}
+
+STUD_SPACING = 0.6       # cc600
+BATTEN_SPACING = 0.35    # Takläkt för takpannor
+DECK_BOARD_WIDTH = 0.125  # 120 mm trall + 5 mm springa
+GARAGE_DOOR_AREA = 5.0   # Garageport ca 2.4 x 2.1 m
+SIDE_RATIO = 1.5         # Antaget förhållande långsida/kortsida om bara ytan anges
+
+_LENGTH_SUFFIX = re.compile(r"_(\d+(?:\.\d+)?)m$")
+_WIDTH_IN_NAME = re.compile(r"_\d+x(\d+)_")
+
+
+def parse_project(description: str) -> dict | None:
+    """Tolkar en projektbeskrivning till parametrar för estimate_materials().
+
+    Returns:
+        Dict med building, width, length, wall_height, roof, walls, floor,
+        insulated, eller None om byggnadstyp eller yta inte går att hitta.
+    """
+    building = next((b for pattern, b in _BUILDING_WORDS if pattern.search(description)), None)
+    if building is None:
+        return None
+
+    dimensions = _DIMENSIONS.search(description)
+    area = _AREA.search(description)
+    if dimensions:
+        sides = sorted(_to_float(value) for value in dimensions.groups())
+        width, length = sides
+    elif area:
+        width = sqrt(_to_float(area.group(1)) / SIDE_RATIO)
+        length = width * SIDE_RATIO
+    else:
+        return None
+    if width <= 0 or length <= 0:
+        return None
+
+    walls, floor, insulated, wall_height, roof = BUILDINGS[building]
+
+    height = _WALL_HEIGHT.search(description)
+    if height and walls:
+        value, unit = (height.group(1), height.group(2)) if height.group(1) else (height.group(3), height.group(4))
+        wall_height = _to_float(value) / (100 if unit.lower() == "cm" else 1)
+
+    if roof is not None:
+        roof = next((r for pattern, r in _ROOF if pattern.search(description)), roof)
+
+    if _NOT_INSULATED.search(description):
+        insulated = False
+    elif _INSULATED.search(description):
+        insulated = walls
+
+    return {
+        "building": building,
+        "width": round(width, 2),
+        "length": round(length, 2),
+        "wall_height": wall_height,
+        "roof": roof,
+        "walls": walls,
+        "floor": floor,
+        "insulated": insulated,
+    }
+
+
+def project_from_parameters(params: dict) -> dict | None:
+    """Bygger en projektspecifikation från parametrar som LLM:en har tolkat fram.
+
+    Args:
+        params: Dict med building, area eller width/length, och valfritt
+            wall_height, roof och insulated
+
+    Returns:
+        Samma format som parse_project(), eller None om parametrarna är ogiltiga.
+    """
+    building = params.get("building")
+    if building not in BUILDINGS:
+        return None
+    walls, floor, insulated, wall_height, roof = BUILDINGS[building]
+
+    try:
+        if params.get("width") and params.get("length"):
+            width, length = sorted((float(params["width"]), float(params["length"])))
+        else:
+            width = sqrt(float(params["area"]) / SIDE_RATIO)
+            length = width * SIDE_RATIO
+        if walls and params.get("wall_height"):
+            wall_height = float(params["wall_height"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if width <= 0 or length <= 0 or wall_height < 0:
+        return None
+
+    if roof is not None and params.get("roof") in ROOF_FACTOR:
+        roof = params["roof"]
+    if isinstance(params.get("insulated"), bool):
+        insulated = params["insulated"] and walls
+
+    return {
+        "building": building,
+        "width": round(width, 2),
+        "length": round(length, 2),
+        "wall_height": wall_height,
+        "roof": roof,
+        "walls": walls,
+        "floor": floor,
+        "insulated": insulated,
+    }
+
+
+def estimate_materials(spec: dict) -> dict:
+    """Räknar fram materiallistan för ett projekt, grupperad per byggdel.
+
+    Behovet tas först fram per rad som antal, löpmeter eller kvm. Sedan
+    räknas alla rader om till förpackningar/styck i ett svep utifrån
+    katalogens täckning (längd per regel, kvm per skiva/paket) och spill,
+    och avrundas uppåt.
+
+    Returns:
+        {byggdel: {produkt: antal}} i samma format som LLM-beräkningen
+    """
+    lines = _bill_of_materials(spec)
+
+    categories = [category for category, _, _, _ in lines]
+    products = [product for _, product, _, _ in lines]
+    needs = [amount * WASTE[unit] for _, _, amount, unit in lines]
+    coverages = [_coverage(product, unit) for _, product, _, unit in lines]
+    quantities = [ceil(round(need / coverage, 6)) for need, coverage in zip(needs, coverages)]
+
+    result = {}
+    for category, product, quantity in zip(categories, products, quantities):
+        if quantity > 0:
+            group = result.setdefault(category, {})
+            group[product] = group.get(product, 0) + quantity
+    return result
+
+
+def _bill_of_materials(spec: dict) -> list:
+    """Materialbehov som rader (byggdel, produkt, mängd, enhet: st/m/kvm)."""
+    width, length = spec["width"], spec["length"]
+    footprint = width * length
+    perimeter = 2 * (width + length)
+    lines = []
+
+    if spec["building"] == "altan":
+        joist = _length_variant("regel_tryckimp_45x145_", width)
+        joists = ceil(length / STUD_SPACING) + 1
+        posts = (ceil(length / 2) + 1) * (ceil(width / 2) + 1)
+        lines += [
+            ("Stomme", joist, joists * ceil(width / _length_of(joist)), "st"),
+            ("Stomme", "regel_tryckimp_45x145_3m", 2 * length, "m"),
+            ("Stomme", "betong_torr_25kg", posts, "st"),
+            ("Stomme", "universalankare", posts, "st"),
+            ("Trall", "bräda_tryckimp_22x120_3m", footprint / DECK_BOARD_WIDTH, "m"),
+            ("Fästdon", "skruv_trall_4.5x55_250st", footprint * 30 / 250, "st"),
+            ("Fästdon", "balksko_45x145", joists * 2, "st"),
+        ]
+        return lines
+
+    wall_area = 0.0
+    if spec["walls"]:
+        wall_height = spec["wall_height"]
+        wall_area = perimeter * wall_height
+        if spec["building"] == "garage":
+            wall_area -= GARAGE_DOOR_AREA
+        dimension = "45x145" if spec["insulated"] else "45x95"
+        stud = _length_variant(f"regel_{dimension}_", wall_height)
+        lines += [
+            ("Stomme/Väggar", stud, ceil(perimeter / STUD_SPACING) + 4, "st"),
+            ("Stomme/Väggar", _length_variant(f"regel_{dimension}_", 4.8), 2 * perimeter, "m"),
+            ("Panel/Fasad", "ytterpanel_14x145_3m", wall_area, "kvm"),
+        ]
+        if spec["insulated"]:
+            lines += [
+                ("Stomme/Väggar", "plywood_12mm", wall_area, "kvm"),
+                ("Isolering", "isolering_mineralull_145mm", wall_area * 0.9, "kvm"),
+                ("Isolering", "byggplast_0.2mm_50kvm", wall_area + footprint, "kvm"),
+                ("Invändigt", "gipsskiva_13mm", wall_area + footprint, "kvm"),
+            ]
+    else:
+        # Stolpar för carport
+        posts = 2 * (ceil(length / 3) + 1)
+        lines += [
+            ("Stomme", _length_variant("regel_tryckimp_45x145_", spec["wall_height"]), posts, "st"),
+            ("Stomme", "betong_torr_25kg", posts * 2, "st"),
+            ("Stomme", "regel_45x170_4.8m", 2 * length, "m"),
+        ]
+
+    roof = spec["roof"]
+    roof_area = footprint * ROOF_FACTOR[roof]
+    rafter_length = (width / 2 if roof == "sadeltak" else width) * ROOF_FACTOR[roof] + 0.3
+    rafter = _length_variant("regel_45x170_", rafter_length)
+    rafters = (ceil(length / STUD_SPACING) + 1) * (2 if roof == "sadeltak" else 1)
+    lines += [
+        ("Tak", rafter, rafters * ceil(rafter_length / _length_of(rafter)), "st"),
+        ("Tak", "råspontlucka_20x540_4.8m", roof_area, "kvm"),
+        ("Tak", "underlagspapp_rulle", roof_area, "kvm"),
+        ("Fästdon", "vinkel_70x70x55", rafters * 2, "st"),
+    ]
+    if roof == "sadeltak":
+        lines.append(("Tak", "takläkt_25x38_4.2m", roof_area / BATTEN_SPACING, "m"))
+    else:
+        lines.append(("Tak", "takpapp_rulle_20m", roof_area, "kvm"))
+    if spec["insulated"]:
+        lines.append(("Isolering", "isolering_mineralull_195mm", footprint, "kvm"))
+
+    if spec["floor"]:
+        joist = _length_variant("regel_45x170_", width)
+        lines += [
+            ("Golv", joist, (ceil(length / STUD_SPACING) + 1) * ceil(width / _length_of(joist)), "st"),
+            ("Golv", "golvspånskiva_22mm", footprint, "kvm"),
+        ]
+        if spec["insulated"]:
+            lines.append(("Isolering", "isolering_mineralull_145mm", footprint * 0.9, "kvm"))
+
+    framing_area = wall_area + roof_area + (footprint if spec["floor"] else 0)
+    lines += [
+        ("Fästdon", "spik_varmförz_75mm_5kg", framing_area / 40, "st"),
+        ("Fästdon", "skruv_trä_5x80_200st", framing_area / 25, "st"),
+    ]
+    if spec["insulated"]:
+        lines.append(("Fästdon", "skruv_gips_3.5x35_1000st", (wall_area + footprint) * 15 / 1000, "st"))
+    return lines
+
+
+def _length_variant(prefix: str, min_length: float) -> str:
+    """Kortaste längden av en dimension som räcker, annars den längsta (skarvas)."""
+    variants = sorted(
+        (_length_of(name), name) for name in PRODUCTS
+        if name.startswith(prefix) and _LENGTH_SUFFIX.search(name)
+    )
+    return next((name for length, name in variants if length >= min_length), variants[-1][1])
+
+
+def _length_of(product: str) -> float:
+    """Längd i meter för en regel/bräda (från katalogen eller produktnamnet)."""
+    dimension = PRODUCTS[product][1]
+    if dimension is not None:
+        return dimension
+    return float(_LENGTH_SUFFIX.search(product).group(1))
+
+
+def _coverage(product: str, unit: str) -> float:
+    """Hur mycket av behovet en enhet av produkten täcker (st: 1, m: längd, kvm: yta)."""
+    if unit == "st":
+        return 1.0
+    if unit == "m":
+        return _length_of(product)
+    dimension = PRODUCTS[product][1]
+    if dimension is not None:
+        return dimension
+    # Styckvaror utan angiven yta (panel): bredd x längd ur namnet
+    return int(_WIDTH_IN_NAME.search(product).group(1)) / 1000 * _length_of(product)
+
+
+def _to_float(value: str) -> float:
+    return float(value.replace(",", "."))
@@ -0,0 +1,456 @@
+"""IMAP/SMTP-transport för en egen (on-prem) mailserver.
+
+Alternativ till GmailClient som inte behöver Google OAuth eller ett
+HTTPS-anrop per läsning, kvittering och utskick:
+- En IMAP-anslutning hålls öppen. Olästa mail hämtas med ett enda
+  UID FETCH för hela uppsättningen id:n (upp till IMAP_FETCH_CHUNK per
+  kommando) och kvitteras med ett enda UID STORE.
+- Inkrementell synk: högsta synkade UID sparas i imap_state.json
+  (tillsammans med UIDVALIDITY), så att bara nya mail söks igenom. Mail
+  som synkats men inte kvitterats sparas också och tas med i nästa synk
+  om de fortfarande är olästa.
+- wait_for_new_mail() använder IMAP IDLE på en egen anslutning, så att
+  servern meddelar nya mail i stället för att klienten pollar.
+- En SMTP-anslutning loggas in en gång och återanvänds för alla utskick
+  (återansluter automatiskt om servern har stängt den).
+
+Aktiveras med MAIL_TRANSPORT=imap, se README för miljövariablerna.
+Mail-id:n är IMAP-UID:n som strängar.
+"""
+
+import os
+import re
+import ssl
+import sys
+import json
+import time
+import select
+import imaplib
+import smtplib
+import threading
+from email import message_from_bytes
+from email.mime.text import MIMEText
+from email.policy import default as default_policy
+from datetime import datetime
+from pathlib import Path
+
+from .metrics import timed
+from .transport import MailTransport
+
+IMAP_HOST = os.getenv("IMAP_HOST", "localhost")
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+IMAP_SSL = os.getenv("IMAP_SSL", "true").lower() == "true"
+IMAP_USER = os.getenv("IMAP_USER", "")
+IMAP_PASSWORD = os.getenv("IMAP_PASSWORD", "")
+IMAP_MAILBOX = os.getenv("IMAP_MAILBOX", "INBOX")
+
+SMTP_HOST = os.getenv("SMTP_HOST", IMAP_HOST)
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+# "ssl" = implicit TLS (port 465), "starttls" (port 587) eller "none" (lokal testserver)
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "starttls").lower()
+SMTP_USER = os.getenv("SMTP_USER", IMAP_USER)
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", IMAP_PASSWORD)
+
+IMAP_FETCH_CHUNK = 500       # Max antal UID:n per FETCH/STORE-kommando
+IMAP_IDLE_MAX = 29 * 60      # RFC 2177: förnya IDLE minst var 29:e minut
+SNIPPET_BYTES = 200          # Utdrag av texten för format='metadata'
+
+# Senast synkade UID, mappens UIDVALIDITY och okvitterade UID:n sparas här mellan körningar
+IMAP_STATE_FILE = Path(__file__).parent.parent / "imap_state.json"
+
+_UID = re.compile(rb"\bUID (\d+)")
+_INTERNALDATE = re.compile(rb'INTERNALDATE "([^"]+)"')
+_MESSAGE_START = re.compile(rb"^\d+ \(")
+# Namnet på posten som följs av en literal: BODY[], BODY[TEXT]<0>, BODY[HEADER.FIELDS (...)], RFC822
+_LITERAL_ITEM = re.compile(rb"(?:BODY|BINARY)\[([^\]]*)\](?:<\d+>)?\s*\{\d+\}$|(RFC822)(?:\.\w+)?\s*\{\d+\}$")
+_NEW_MAIL = re.compile(rb"^\* \d+ (EXISTS|RECENT)")
+
+
+def _uid_set(uids: list) -> str:
+    """Komprimerar UID:n till en IMAP-mängd: [1, 2, 3, 7] -> "1:3,7"."""
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(f"{a}:{b}" if a != b else str(a) for a, b in ranges)
+
+
+def _parse_fetch(data: list) -> list[dict]:
+    """Delar upp ett FETCH-svar från imaplib per mail.
+
+    Servern får skicka posterna i valfri ordning (UID kan t.ex. komma
+    efter texten), så varje literal kopplas till posten som står närmast
+    före den, och UID och INTERNALDATE letas upp i all text utanför
+    literalerna.
+
+    Returns:
+        [{"meta": text utanför literalerna, "items": {del: literal}}], där
+        del är "" för hela mailet (BODY[], RFC822), "HEADER" eller "TEXT"
+    """
+    messages = []
+    for part in data:
+        prefix, literal = part if isinstance(part, tuple) else (part, None)
+        if not isinstance(prefix, bytes):
+            continue
+        if _MESSAGE_START.match(prefix) or not messages:
+            messages.append({"meta": b"", "items": {}})
+        message = messages[-1]
+        message["meta"] += prefix
+        if literal is not None:
+            match = _LITERAL_ITEM.search(prefix)
+            if match:
+                section = b"" if match.group(2) else match.group(1).upper()
+                # HEADER.FIELDS (FROM SUBJECT) -> HEADER
+                message["items"][section.split(b" ")[0].split(b".")[0].decode()] = literal
+    return messages
+
+
+def _internal_date(meta: bytes) -> str | None:
+    """Serverns ankomsttid (INTERNALDATE i FETCH-svaret) i ISO-format."""
+    match = _INTERNALDATE.search(meta)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1).decode(), "%d-%b-%Y %H:%M:%S %z").isoformat()
+    except ValueError:
+        return None
+
+
+def _new_tag(conn: imaplib.IMAP4) -> bytes:
+    """Nästa kommandotagg för anslutningen.
+
+    imaplib har inget IDLE-kommando (det kommer först i Python 3.14), så
+    IDLE skickas för hand. Taggen måste ändå tas från imaplib:s egen
+    räknare, annars kan den krocka med anslutningens vanliga kommandon.
+    Det är den enda platsen som använder imaplib:s privata API.
+    """
+    return conn._new_tag()
+
+
+class ImapTransport(MailTransport):
+    """Läser mail via IMAP och skickar via SMTP, med återanvända anslutningar."""
+
+    supports_push = True  # IMAP IDLE
+
+    def __init__(self):
+        self.sender_email = os.getenv("SENDER_EMAIL") or SMTP_USER
+        # imaplib och smtplib är inte trådsäkra: en anslutning var, skyddad av lås
+        self._imap = None
+        self._imap_lock = threading.Lock()
+        self._uidvalidity = None
+        self._state_lock = threading.Lock()
+        self._idle = None
+        self._idle_lock = threading.Lock()
+        self._smtp = None
+        self._smtp_lock = threading.Lock()
+
+    # ==================== IMAP ====================
+
+    def _connect_imap(self) -> imaplib.IMAP4:
+        """Öppnar en inloggad IMAP-anslutning med mappen vald."""
+        if IMAP_SSL:
+            conn = imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT, ssl_context=ssl.create_default_context())
+        else:
+            conn = imaplib.IMAP4(IMAP_HOST, IMAP_PORT)
+        conn.login(IMAP_USER, IMAP_PASSWORD)
+        conn.select(IMAP_MAILBOX)
+        _, data = conn.response("UIDVALIDITY")
+        if data and data[0] is not None:
+            self._uidvalidity = data[0].decode()
+        return conn
+
+    def _with_imap(self, command):
+        """Kör command(anslutning) och återansluter en gång om anslutningen har dött."""
+        with self._imap_lock:
+            for attempt in range(2):
+                if self._imap is None:
+                    self._imap = self._connect_imap()
+                try:
+                    return command(self._imap)
+                except (imaplib.IMAP4.abort, OSError):
+                    self._imap = None
+                    if attempt == 1:
+                        raise
+
+    @timed("mail_request_seconds", transport="imap", op="list")
+    def _search(self, criteria: str) -> list[int]:
+        """UID SEARCH, returnerar UID:n i stigande ordning."""
+        def search(conn):
+            typ, data = conn.uid("SEARCH", None, criteria)
+            if typ != "OK":
+                raise imaplib.IMAP4.error(f"SEARCH misslyckades: {data}")
+            return sorted(int(uid) for uid in data[0].split())
+        return self._with_imap(search)
+
+    def get_unread_emails(self, max_results: int | None = 10, format: str = 'full') -> list:
+        """Hämtar olästa mail, äldst först (se MailTransport.get_unread_emails)."""
+        uids = self._search("UNSEEN")
+        if max_results is not None:
+            uids = uids[:max_results]
+        return self._fetch(uids, format)
+
+    def sync_unread_emails(self, max_results: int | None = None, format: str = 'full') -> list:
+        """Hämtar olästa mail med högre UID än förra synken.
+
+        Mail från tidigare synkar som inte har kvitterats (mark_as_read_bulk)
+        och fortfarande är olästa tas med igen, först i listan, så att ett
+        mail som inte kunde hanteras inte försvinner.
+
+        Första gången, eller om mappens UIDVALIDITY har ändrats (då gäller
+        inte gamla UID:n längre), görs en full sökning på olästa mail.
+        Begränsas den av max_results sparas bara det högsta UID:t bland de
+        hämtade, så att resten kommer med i nästa synk.
+        """
+        with self._state_lock:
+            state = self._load_state()
+        last_uid = 0
+        uids = None
+        if state.get("last_uid") and self._current_uidvalidity() == state.get("uidvalidity"):
+            last_uid = int(state["last_uid"])
+            # "n:*" matchar alltid minst det senaste mailet, även om dess UID < n
+            uids = [uid for uid in self._search(f"UID {last_uid + 1}:* UNSEEN") if uid > last_uid]
+            carried = [int(uid) for uid in state.get("unacked", []) if int(uid) <= last_uid]
+            if carried:
+                unseen = set(self._search(f"UID {_uid_set(carried)} UNSEEN"))
+                uids = [uid for uid in carried if uid in unseen] + uids
+        if uids is None:
+            uids = self._search("UNSEEN")
+            if max_results is not None:
+                uids = uids[:max_results]
+
+        emails = self._fetch(uids, format)
+        with self._state_lock:
+            self._save_state({
+                "uidvalidity": self._uidvalidity,
+                "last_uid": max(uids + [last_uid]),
+                "unacked": [int(email["id"]) for email in emails],
+            })
+        return emails
+
+    def get_emails(self, msg_ids: list, format: str = 'full') -> list:
+        """Hämtar givna mail (id = UID) med UID FETCH."""
+        return self._fetch([int(msg_id) for msg_id in msg_ids], format)
+
+    def _current_uidvalidity(self) -> str | None:
+        """Mappens UIDVALIDITY.
+
+        NOOP först, så att en anslutning som servern har stängt (t.ex. när
+        mappen byggts om) upptäcks och UIDVALIDITY läses om vid återanslutningen.
+        """
+        def noop(conn):
+            conn.noop()
+            _, data = conn.response("UIDVALIDITY")
+            if data and data[0] is not None:
+                self._uidvalidity = data[0].decode()
+        self._with_imap(noop)
+        return self._uidvalidity
+
+    def _load_state(self) -> dict:
+        """Läser synkstatus från IMAP_STATE_FILE: {"uidvalidity", "last_uid", "unacked": [uid, ...]}."""
+        if not IMAP_STATE_FILE.exists():
+            return {}
+        try:
+            with open(IMAP_STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+    def _save_state(self, state: dict):
+        """Sparar synkstatus till IMAP_STATE_FILE."""
+        with open(IMAP_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+    def _forget_unacked(self, uids: list):
+        """Tar bort kvitterade mail ur listan med okvitterade i IMAP_STATE_FILE."""
+        with self._state_lock:
+            state = self._load_state()
+            if not state.get("unacked"):
+                return
+            acked = set(uids)
+            state["unacked"] = [uid for uid in state["unacked"] if uid not in acked]
+            self._save_state(state)
+
+    @timed("mail_request_seconds", transport="imap", op="get")
+    def _fetch(self, uids: list, format: str = 'full') -> list:
+        """Hämtar flera mail med ett UID FETCH per IMAP_FETCH_CHUNK UID:n.
+
+        BODY.PEEK används så att mailen inte markeras som lästa av hämtningen.
+        """
+        if format == 'metadata':
+            items = f"(UID INTERNALDATE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT)] BODY.PEEK[TEXT]<0.{SNIPPET_BYTES}>)"
+        else:
+            items = "(UID INTERNALDATE BODY.PEEK[])"
+
+        fetched = {}
+        for start in range(0, len(uids), IMAP_FETCH_CHUNK):
+            chunk = uids[start:start + IMAP_FETCH_CHUNK]
+
+            def fetch(conn):
+                typ, data = conn.uid("FETCH", _uid_set(chunk), items)
+                if typ != "OK":
+                    raise imaplib.IMAP4.error(f"FETCH misslyckades: {data}")
+                return data
+
+            for message in _parse_fetch(self._with_imap(fetch)):
+                match = _UID.search(message["meta"])
+                if match:
+                    fetched[int(match.group(1))] = message
+
+        return [self._to_email(uid, fetched[uid], format) for uid in uids if uid in fetched]
+
+    def _to_email(self, uid: int, message: dict, format: str) -> dict:
+        """Konverterar FETCH-svaret för ett mail (se _parse_fetch) till vårt format."""
+        items = message["items"]
+        if format == 'metadata':
+            headers = message_from_bytes(items.get("HEADER", b""), policy=default_policy)
+            text = items.get("TEXT", b"")
+            return {
+                'id': str(uid),
+                'from': headers.get('From', ''),
+                'subject': headers.get('Subject', ''),
+                'body': text.decode('utf-8', errors='replace').strip(),
+                'date': _internal_date(message["meta"])
+            }
+
+        parsed = message_from_bytes(items.get("", b""), policy=default_policy)
+        text_part = parsed.get_body(preferencelist=('plain',))
+        return {
+            'id': str(uid),
+            'from': parsed.get('From', ''),
+            'subject': parsed.get('Subject', ''),
+            'body': text_part.get_content() if text_part else '',
+            'date': _internal_date(message["meta"])
+        }
+
+    @timed("mail_request_seconds", transport="imap", op="modify")
+    def mark_as_read_bulk(self, msg_ids: list):
+        """Markerar mail som lästa med ett UID STORE per IMAP_FETCH_CHUNK id:n.
+
+        Bara mail som servern har bekräftat tas bort ur listan med okvitterade.
+
+        Raises:
+            imaplib.IMAP4.error: Om servern inte svarar OK på ett STORE
+        """
+        uids = [int(msg_id) for msg_id in msg_ids]
+        acked = []
+        try:
+            for start in range(0, len(uids), IMAP_FETCH_CHUNK):
+                chunk = uids[start:start + IMAP_FETCH_CHUNK]
+
+                def store(conn):
+                    typ, data = conn.uid("STORE", _uid_set(chunk), "+FLAGS.SILENT", "(\\Seen)")
+                    if typ != "OK":
+                        raise imaplib.IMAP4.error(f"STORE misslyckades: {data}")
+
+                self._with_imap(store)
+                acked += chunk
+        finally:
+            self._forget_unacked(acked)
+
+    def wait_for_new_mail(self, timeout: float) -> bool:
+        """Väntar med IMAP IDLE tills servern meddelar nya mail.
+
+        Använder en egen anslutning så att vanliga kommandon inte blockeras.
+
+        Returns:
+            True om nya mail kom, False vid timeout
+        """
+        with self._idle_lock:
+            if self._idle is None:
+                self._idle = self._connect_imap()
+            try:
+                return self._idle_once(self._idle, min(timeout, IMAP_IDLE_MAX))
+            except (imaplib.IMAP4.abort, OSError):
+                self._idle = None
+                raise
+
+    def _idle_once(self, conn: imaplib.IMAP4, timeout: float) -> bool:
+        """Ett IDLE-varv: IDLE, vänta på EXISTS/RECENT eller timeout, DONE."""
+        tag = _new_tag(conn)
+        conn.send(tag + b" IDLE\r\n")
+        line = conn.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"Servern stöder inte IDLE: {line!r}")
+
+        new_mail = False
+        deadline = time.monotonic() + timeout
+        sock = conn.socket()
+        while not new_mail:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # TLS kan ha dekrypterade data i buffert som select() inte ser
+            buffered = isinstance(sock, ssl.SSLSocket) and sock.pending()
+            if not buffered and not select.select([sock], [], [], remaining)[0]:
+                break
+            line = conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("IMAP-servern stängde anslutningen under IDLE")
+            new_mail = bool(_NEW_MAIL.match(line))
+
+        conn.send(b"DONE\r\n")
+        while True:
+            line = conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("IMAP-servern stängde anslutningen under IDLE")
+            if line.startswith(tag):
+                break
+            new_mail = new_mail or bool(_NEW_MAIL.match(line))
+        return new_mail
+
+    # ==================== SMTP ====================
+
+    def _connect_smtp(self) -> smtplib.SMTP:
+        """Öppnar en inloggad SMTP-anslutning."""
+        if SMTP_SECURITY == "ssl":
+            smtp = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+            if SMTP_SECURITY == "starttls":
+                smtp.starttls(context=ssl.create_default_context())
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        return smtp
+
+    @timed("mail_request_seconds", transport="imap", op="send")
+    def send_email(self, to: str, subject: str, body: str):
+        """Skickar ett mail över den återanvända SMTP-anslutningen.
+
+        Anslutningen delas mellan trådar (utskicken serialiseras med ett lås).
+        Har servern stängt den återansluts en gång.
+        """
+        message = MIMEText(body)
+        message['to'] = to
+        message['from'] = self.sender_email
+        message['subject'] = subject
+
+        with self._smtp_lock:
+            for attempt in range(2):
+                if self._smtp is None:
+                    self._smtp = self._connect_smtp()
+                try:
+                    self._smtp.send_message(message)
+                    break
+                except smtplib.SMTPServerDisconnected:
+                    self._smtp = None
+                    if attempt == 1:
+                        raise
+
+        print(f"Mail skickat till {to}: {subject}", file=sys.stderr)
+
+    def close(self):
+        """Stänger IMAP- och SMTP-anslutningarna."""
+        for conn in (self._imap, self._idle):
+            if conn is not None:
+                try:
+                    conn.logout()
+                except (imaplib.IMAP4.error, OSError):
+                    pass
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+        self._imap = self._idle = self._smtp = None
@@ -0,0 +1,71 @@
+"""Gemensamma LLM-klienter (Gemini via OpenAI-kompatibelt API) för hela processen.
+
+Alla agenter och klassificeraren delar samma klient och därmed samma
+HTTP-anslutningspool, så att varma keep-alive-anslutningar återanvänds i
+stället för att varje mail betalar för en ny TLS-handskakning.
+
+Konfiguration via miljövariabler:
+- LLM_MAX_CONNECTIONS: max antal samtidiga anslutningar (standard 20)
+- LLM_KEEPALIVE_EXPIRY: sekunder en ledig anslutning hålls öppen (standard 60)
+- LLM_HTTP2: "true" för HTTP/2 om paketet h2 är installerat (standard)
+- LLM_BASE_URL: annan OpenAI-kompatibel endpoint än Gemini, t.ex. den
+  fejkade LLM:en i benchmarks/fake_llm.py
+"""
+
+import os
+import threading
+import importlib.util
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+GEMINI_BASE_URL = os.getenv("LLM_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/openai/")
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 kräver paketet h2 (pip install httpx[http2]), annars används HTTP/1.1
+LLM_HTTP2 = (
+    os.getenv("LLM_HTTP2", "true").lower() == "true"
+    and importlib.util.find_spec("h2") is not None
+)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+    )
+
+
+def get_llm_client() -> OpenAI:
+    """Returnerar processens gemensamma synkrona LLM-klient."""
+    if "sync" not in _clients:
+        with _lock:
+            if "sync" not in _clients:
+                _clients["sync"] = OpenAI(
+                    api_key=os.getenv("GEMINI_API_KEY"),
+                    base_url=GEMINI_BASE_URL,
+                    http_client=httpx.Client(http2=LLM_HTTP2, limits=_limits())
+                )
+    return _clients["sync"]
+
+
+def get_async_llm_client() -> AsyncOpenAI:
+    """Returnerar processens gemensamma asynkrona LLM-klient.
+
+    Använd client.with_options(timeout=..., max_retries=...) för egna
+    inställningar; kopian delar fortfarande anslutningspoolen.
+    """
+    if "async" not in _clients:
+        with _lock:
+            if "async" not in _clients:
+                _clients["async"] = AsyncOpenAI(
+                    api_key=os.getenv("GEMINI_API_KEY"),
+                    base_url=GEMINI_BASE_URL,
+                    http_client=httpx.AsyncClient(http2=LLM_HTTP2, limits=_limits())
+                )
+    return _clients["async"]
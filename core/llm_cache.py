@@ -0,0 +1,176 @@
+"""Cache för LLM-svar, nycklad på modell, temperatur och normaliserat prompt.
+
+Identiska prompt (t.ex. samma inkorg i dry-run, samma projektbeskrivning
+eller ett mail som levereras igen) besvaras från cachen i stället för att
+skickas till Gemini igen.
+
+Två nivåer:
+- Minne: LRU med LLM_CACHE_MEMORY_SIZE poster, per process
+- Disk: SQLite-filen llm_cache.db med LLM_CACHE_DISK_SIZE poster, delas
+  mellan körningar och mellan klient och server
+
+Poster äldre än LLM_CACHE_TTL sekunder räknas som missar. Sätt
+LLM_CACHE=false för att stänga av cachen helt, eller use_cache=False i
+ett enskilt anrop.
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "true").lower() == "true"
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "512"))
+LLM_CACHE_DISK_SIZE = int(os.getenv("LLM_CACHE_DISK_SIZE", "10000"))
+LLM_CACHE_DB = Path(__file__).parent.parent / "llm_cache.db"
+
+# Storleksgränsen på disk kontrolleras var N:e skrivning
+_EVICT_EVERY = 50
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Tar bort indrag och tomma rader så att omformaterade prompt ger samma nyckel."""
+    return "\n".join(line.strip() for line in prompt.strip().splitlines() if line.strip())
+
+
+class LLMCache:
+    """Tvånivåcache (minne + SQLite) för LLM-svar."""
+
+    def __init__(self, path: Path = LLM_CACHE_DB, ttl: float = LLM_CACHE_TTL,
+                 memory_size: int = LLM_CACHE_MEMORY_SIZE, disk_size: int = LLM_CACHE_DISK_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory = OrderedDict()  # nyckel -> (svar, tokens, skapad)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._puts = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "saved_tokens": 0}
+
+    @staticmethod
+    def key(model: str, temperature: float, prompt: str) -> str:
+        """Innehållsadress för ett anrop."""
+        data = f"{model}\x00{temperature:.3f}\x00{normalize_prompt(prompt)}"
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        tokens INTEGER NOT NULL DEFAULT 0,
+                        created REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, model: str, temperature: float, prompt: str) -> str | None:
+        """Returnerar ett cachat svar, eller None vid miss."""
+        key = self.key(model, temperature, prompt)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[2] < self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                self._stats["saved_tokens"] += entry[1]
+                return entry[0]
+
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT response, tokens, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and now - row[2] < self.ttl:
+            with conn:
+                conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            with self._lock:
+                self._remember(key, row)
+                self._stats["disk_hits"] += 1
+                self._stats["saved_tokens"] += row[1]
+            return row[0]
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, model: str, temperature: float, prompt: str, response: str, tokens: int = 0):
+        """Sparar ett svar i båda nivåerna."""
+        key = self.key(model, temperature, prompt)
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, (response, tokens, now))
+            self._puts += 1
+            evict = self._puts % _EVICT_EVERY == 0
+
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, tokens, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, response, tokens, now, now)
+            )
+            if evict:
+                conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                conn.execute(
+                    """DELETE FROM responses WHERE key IN (
+                           SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                       )""",
+                    (self.disk_size,)
+                )
+
+    def discard(self, model: str, temperature: float, prompt: str):
+        """Tar bort ett svar (t.ex. ett som inte gick att tolka) ur cachen."""
+        key = self.key(model, temperature, prompt)
+        with self._lock:
+            self._memory.pop(key, None)
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def _remember(self, key: str, entry: tuple):
+        """Lägger en post i minnesnivån (anropas med låset taget)."""
+        self._memory[key] = tuple(entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Returnerar träffar per nivå, missar, träffandel och sparade tokens."""
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "memory_size": len(self._memory),
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache | None:
+    """Returnerar processens gemensamma LLM-cache, eller None om LLM_CACHE=false."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
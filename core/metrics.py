@@ -0,0 +1,204 @@
+"""Latenshistogram och räknare för hela kedjan (Gmail/IMAP, LLM, historik, sök, verktyg).
+
+Mätpunkterna registreras i processens gemensamma Metrics-objekt:
+
+    with get_metrics().timer("search_seconds"):
+        ...
+
+    @timed("mail_request_seconds", transport="gmail", op="send")
+    def send_email(...):
+        ...
+
+Servern exponerar mätvärdena som resurserna metrics://server (JSON med
+antal, snitt, p50/p95/p99 och max per mätpunkt) och metrics://prometheus
+(Prometheus textformat). Klienten skriver ut båda sidornas mätvärden
+efter varje körning med --metrics.
+
+Histogrammen har fasta gränser (LATENCY_BUCKETS) så att minnet inte växer
+med antalet mätningar; percentilerna interpoleras inom en bucket.
+"""
+
+import time
+import inspect
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Övre gränser (sekunder) för latenshistogrammen
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Histogram med fasta bucketgränser, summa och max."""
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Sista bucketen: över högsta gränsen
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Uppskattad kvantil (0-1), linjärt interpolerad inom bucketen."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for upper, n in zip(self.bounds + (self.max,), self.counts):
+            upper = min(upper, self.max)
+            if n and cumulative + n >= rank:
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+            lower = upper
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.50), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "max": round(self.max, 6),
+        }
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def _series(name: str, labels: tuple, extra: tuple = ()) -> str:
+    """Serienamn i Prometheus-format, t.ex. tool_seconds{tool="handle_sales_email"}."""
+    pairs = [f'{k}="{v}"' for k, v in labels + extra]
+    return f"{name}{{{','.join(pairs)}}}" if pairs else name
+
+
+class Metrics:
+    """Trådsäker samling av latenshistogram och räknare med etiketter."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (namn, etiketter) -> Histogram
+        self._counters = {}    # (namn, etiketter) -> värde
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Registrerar en latens i sekunder."""
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Räknar upp en räknare."""
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Mäter tiden för ett block. Undantag räknas i <namn>_errors_total."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name.removesuffix('_seconds')}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        """Sammanfattning per serie: {"latency": {serie: {count, avg, p50, ...}}, "counters": {serie: värde}}."""
+        with self._lock:
+            return {
+                "latency": {_series(name, labels): h.summary()
+                            for (name, labels), h in sorted(self._histograms.items())},
+                "counters": {_series(name, labels): value
+                             for (name, labels), value in sorted(self._counters.items())},
+            }
+
+    def prometheus(self) -> str:
+        """Alla mätvärden i Prometheus textformat (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), h in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, n in zip(h.bounds, h.counts):
+                    cumulative += n
+                    lines.append(f"{_series(name + '_bucket', labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{_series(name + '_bucket', labels, (('le', '+Inf'),))} {h.count}")
+                lines.append(f"{_series(name + '_sum', labels)} {h.sum}")
+                lines.append(f"{_series(name + '_count', labels)} {h.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{_series(name, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def timed(name: str, **labels):
+    """Dekorator som mäter varje anrop till en (synkron eller asynkron) funktion."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with _metrics.timer(name, **labels):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _metrics.timer(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(model: str, usage):
+    """Räknar tokens in/ut från ett LLM-svars usage (OpenAI-formatet), om det finns."""
+    if usage is None:
+        return
+    _metrics.inc("llm_tokens_total", usage.prompt_tokens or 0, model=model, direction="in")
+    _metrics.inc("llm_tokens_total", usage.completion_tokens or 0, model=model, direction="out")
+
+
+def format_summary(snapshot: dict, title: str) -> list[str]:
+    """Formaterar en snapshot() som en tabell (textrader) för utskrift."""
+    lines = [f"  {title}"]
+    if not snapshot["latency"] and not snapshot["counters"]:
+        return lines + ["    (inga mätningar)"]
+    lines.append(f"    {'Mätpunkt':<58} {'antal':>6} {'snitt':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for series, s in snapshot["latency"].items():
+        lines.append(f"    {series:<58} {s['count']:>6} " + " ".join(
+            f"{s[k] * 1000:>7.1f}ms" for k in ("avg", "p50", "p95", "p99", "max")))
+    for series, value in snapshot["counters"].items():
+        lines.append(f"    {series:<58} {value:>6g}")
+    return lines
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Returnerar processens gemensamma Metrics."""
+    return _metrics
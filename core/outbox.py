@@ -0,0 +1,283 @@
+"""Utkorg för utgående mail med bakgrundstrådar och omförsök.
+
+Verktygen i server.py lägger svaren i utkorgen och returnerar direkt i
+stället för att vänta på Gmail. Utskicken görs av en pool med
+OUTBOX_WORKERS trådar:
+- Mail till samma mottagare skickas i den ordning de köades, mail till
+  olika mottagare skickas parallellt
+- Rate limits (HTTP 429, 403 rateLimitExceeded), serverfel (5xx),
+  tillfälliga SMTP-fel (4xx) och nätverksfel görs om med exponentiell
+  backoff och jitter (eller efter serverns Retry-After), upp till
+  OUTBOX_MAX_ATTEMPTS gånger. Ett mail som väntar på omförsök läggs
+  tillbaka i kön med en tidigaste sändtid, så att tråden under tiden
+  kan skicka till andra mottagare
+- Ett mail kan köas med en tagg; on_sent anropas med taggen först när
+  mailet faktiskt har skickats (server.py sparar då svaret i historiken)
+- Alla mail sparas i SQLite-filen outbox.db innan verktyget returnerar.
+  Mail som inte hann skickas (t.ex. vid omstart) skickas när utkorgen
+  startas nästa gång (utan att vänta ut ett pågående omförsök). Ett mail
+  som var mitt i ett utskick när processen dog kan därför skickas två
+  gånger.
+
+Databasen kan inspekteras manuellt, t.ex. med:
+    sqlite3 outbox.db "SELECT id, recipient, status, attempts, last_error FROM outbox"
+"""
+
+import os
+import sys
+import time
+import heapq
+import random
+import smtplib
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+
+from googleapiclient.errors import HttpError
+
+OUTBOX_DB = Path(__file__).parent.parent / "outbox.db"
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = 1.0    # Sekunder före första omförsöket
+OUTBOX_BACKOFF_MAX = 300.0
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+    """True för fel som kan gå över: rate limits, serverfel och nätverksfel."""
+    # SMTP (core/imap_transport.py): 4xx är tillfälliga fel, 5xx permanenta
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 403:
+            # Gmail svarar ibland 403 (inte 429) när kvoten per användare är slut
+            return b"rateLimitExceeded" in (error.content or b"")
+        return status in RETRYABLE_STATUS
+    return isinstance(error, (OSError, TimeoutError))
+
+
+def _retry_after(error: Exception) -> float | None:
+    """Väntetid som servern begär i Retry-After-headern, om någon."""
+    if isinstance(error, HttpError):
+        value = error.resp.get("retry-after")
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+    return None
+
+
+class Outbox:
+    """Persistent kö för utgående mail med en trådpool och ordning per mottagare."""
+
+    def __init__(self, send, path: Path = OUTBOX_DB, workers: int = OUTBOX_WORKERS,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, on_sent=None):
+        """
+        Args:
+            send: Funktion send(to, subject, body) som skickar ett mail
+            path: SQLite-fil för kön
+            workers: Antal trådar som skickar
+            max_attempts: Antal försök innan ett mail markeras som misslyckat
+            on_sent: Funktion on_sent(to, subject, body, tag) som anropas när
+                ett mail som köats med en tagg har skickats
+        """
+        self.send = send
+        self.path = path
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.on_sent = on_sent
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = {}      # mottagare -> deque med mail-id:n i köordning
+        self._ready = []        # heap (tidigast, löpnummer, mottagare) för mottagare som ingen tråd skickar till
+        self._order = count()   # Löpnummer, så att mottagare med samma tid tas i köordning
+        self._threads = []
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returnerar trådens databasanslutning och skapar schemat vid behov."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        recipient TEXT NOT NULL,
+                        subject TEXT NOT NULL,
+                        body TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        created TEXT NOT NULL,
+                        sent TEXT,
+                        tag TEXT
+                    )
+                """)
+                # Utkorgar från före taggarna saknar kolumnen
+                if "tag" not in {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}:
+                    conn.execute("ALTER TABLE outbox ADD COLUMN tag TEXT")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, id)")
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        """Startar trådarna och köar om mail som inte hann skickas förra gången."""
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"outbox-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+        rows = self._connect().execute(
+            "SELECT id, recipient FROM outbox WHERE status = 'pending' ORDER BY id"
+        ).fetchall()
+        for msg_id, recipient in rows:
+            self._dispatch(msg_id, recipient)
+        if rows:
+            print(f"Utkorg: {len(rows)} osända mail köade igen", file=sys.stderr)
+
+    def enqueue(self, to: str, subject: str, body: str, tag: str = None) -> int:
+        """Sparar ett mail i utkorgen och returnerar direkt.
+
+        Args:
+            tag: Skickas till on_sent när mailet har skickats (None: inget anrop)
+
+        Returns:
+            Mailets id i utkorgen
+        """
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO outbox (recipient, subject, body, created, tag) VALUES (?, ?, ?, ?, ?)",
+                (to, subject, body, datetime.now().isoformat(), tag)
+            )
+        self._dispatch(cursor.lastrowid, to)
+        return cursor.lastrowid
+
+    def _dispatch(self, msg_id: int, recipient: str):
+        """Lägger ett mail sist i mottagarens kö."""
+        with self._lock:
+            queue = self._pending.get(recipient)
+            if queue is None:
+                # Ingen tråd arbetar med mottagaren, släpp fram den
+                self._pending[recipient] = deque([msg_id])
+                self._release(recipient)
+            else:
+                queue.append(msg_id)
+
+    def _release(self, recipient: str, delay: float = 0.0):
+        """Släpper fram mottagaren till trådarna, tidigast om delay sekunder. Kräver self._lock."""
+        heapq.heappush(self._ready, (time.monotonic() + delay, next(self._order), recipient))
+        self._wakeup.notify()
+
+    def _next_recipient(self) -> str:
+        """Väntar tills en mottagare i kön får skickas till och tar ut den."""
+        with self._lock:
+            while True:
+                wait = self._ready[0][0] - time.monotonic() if self._ready else None
+                if wait is not None and wait <= 0:
+                    return heapq.heappop(self._ready)[2]
+                self._wakeup.wait(wait)
+
+    def _worker(self):
+        """Skickar mail, ett i taget per mottagare."""
+        while True:
+            recipient = self._next_recipient()
+            with self._lock:
+                msg_id = self._pending[recipient][0]
+            try:
+                retry_in = self._deliver(msg_id)
+            except Exception as e:
+                # Får inte döda tråden; mailet ligger kvar som 'pending' till nästa start
+                print(f"Utkorg: internt fel för mail {msg_id}: {e}", file=sys.stderr)
+                retry_in = None
+            with self._lock:
+                if retry_in is not None:
+                    # Mailet ligger kvar först i mottagarens kö, så ordningen bevaras
+                    self._release(recipient, retry_in)
+                    continue
+                queue = self._pending[recipient]
+                queue.popleft()
+                if queue:
+                    self._release(recipient)
+                else:
+                    del self._pending[recipient]
+
+    def _deliver(self, msg_id: int) -> float | None:
+        """Gör ett försök att skicka ett mail och sparar utfallet.
+
+        Returns:
+            Sekunder till nästa försök om felet kan gå över, annars None
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT recipient, subject, body, attempts, tag FROM outbox WHERE id = ? AND status = 'pending'",
+            (msg_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        recipient, subject, body, attempts, tag = row
+
+        attempts += 1
+        try:
+            self.send(recipient, subject, body)
+        except Exception as e:
+            retry = is_retryable(e) and attempts < self.max_attempts
+            with conn:
+                conn.execute(
+                    "UPDATE outbox SET attempts = ?, last_error = ?, status = ? WHERE id = ?",
+                    (attempts, f"{type(e).__name__}: {e}", "pending" if retry else "failed", msg_id)
+                )
+            if not retry:
+                print(f"Utkorg: kunde inte skicka mail {msg_id} till {recipient}: {e}", file=sys.stderr)
+                return None
+            delay = _retry_after(e) or random.uniform(
+                0, min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+            )
+            print(f"Utkorg: mail {msg_id} till {recipient} misslyckades ({type(e).__name__}), "
+                  f"försöker igen om {delay:.1f} s", file=sys.stderr)
+            return delay
+
+        with conn:
+            conn.execute(
+                "UPDATE outbox SET attempts = ?, status = 'sent', sent = ?, last_error = NULL WHERE id = ?",
+                (attempts, datetime.now().isoformat(), msg_id)
+            )
+        if tag is not None and self.on_sent is not None:
+            try:
+                self.on_sent(recipient, subject, body, tag)
+            except Exception as e:
+                # Mailet är redan skickat och får inte skickas igen
+                print(f"Utkorg: on_sent misslyckades för mail {msg_id}: {e}", file=sys.stderr)
+        return None
+
+    def retry_failed(self) -> int:
+        """Köar om alla misslyckade mail. Returnerar antalet."""
+        conn = self._connect()
+        with conn:
+            rows = conn.execute(
+                "SELECT id, recipient FROM outbox WHERE status = 'failed' ORDER BY id"
+            ).fetchall()
+            conn.execute("UPDATE outbox SET status = 'pending', attempts = 0 WHERE status = 'failed'")
+        for msg_id, recipient in rows:
+            self._dispatch(msg_id, recipient)
+        return len(rows)
+
+    def stats(self) -> dict:
+        """Antal mail per status samt hur många som väntar i minnet just nu."""
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        counts = {"pending": 0, "sent": 0, "failed": 0, **dict(rows)}
+        with self._lock:
+            counts["queued"] = sum(len(queue) for queue in self._pending.values())
+        return counts
@@ -0,0 +1,239 @@
+"""Prissättning av materiallistor mot produktkatalogen.
+
+PriceTable är en kompakt tabell över katalogen: priser och täckning ligger
+i två arrayer och varje produkt har ett fast index. Alla rader i alla
+materiallistor plattas först ut till parallella listor och räknas sedan i
+ett svep över arrayerna, i stället för en katalogslagning och strängbygge
+per rad.
+
+quote_many() prissätter många materiallistor på en gång (t.ex. ett
+offertjobb över natten), quote() en enda (t.ex. i handle_estimate_email).
+Katalogpriserna är inklusive moms. Produkter som inte finns i katalogen
+tappas inte tyst utan rapporteras med förslag från sökindexet.
+
+Från kommandoraden:
+    python -m core.pricing boms.json           (sammanfattning per offert)
+    python -m core.pricing boms.json --json    (hela offerterna som JSON)
+
+boms.json är en lista med materiallistor, eller ett objekt {id: materiallista}.
+"""
+
+import sys
+import json
+import argparse
+from array import array
+from math import floor
+
+from .products import PRODUCTS
+from .search import search_products
+
+# Moms som ingår i katalogpriserna
+VAT_RATE = 0.25
+
+# Kategori för materiallistor utan byggdelar ({produkt: antal})
+DEFAULT_CATEGORY = "Material"
+
+SUGGESTION_LIMIT = 3
+
+
+class PriceTable:
+    """Priser och täckning för katalogen i arrayer, med produkt -> index."""
+
+    def __init__(self, products: dict):
+        self.skus = list(products)
+        self.version = getattr(products, "version", None)  # Katalogens version (se core.products.Catalog)
+        self.index = {sku: i for i, sku in enumerate(self.skus)}
+        self.prices = array("d", (price for price, _ in products.values()))
+        # Täckning (meter eller kvm per styck/paket), 0 för styckvaror
+        self.coverage = array("d", (dimension or 0.0 for _, dimension in products.values()))
+
+    def __len__(self) -> int:
+        return len(self.skus)
+
+    def price(self, sku: str) -> float | None:
+        """Pris inklusive moms, eller None om produkten inte finns."""
+        i = self.index.get(sku)
+        return self.prices[i] if i is not None else None
+
+
+_table = PriceTable(PRODUCTS)
+
+
+def get_price_table() -> PriceTable:
+    """Returnerar pristabellen och bygger om den om katalogen har ändrats sedan den byggdes."""
+    global _table
+    if _table.version != PRODUCTS.version:
+        _table = PriceTable(PRODUCTS)
+    return _table
+
+
+def quote(bom: dict, vat_rate: float = VAT_RATE) -> dict:
+    """Prissätter en materiallista. Se quote_many()."""
+    return quote_many([bom], vat_rate)[0]
+
+
+def quote_many(boms: list, vat_rate: float = VAT_RATE) -> list[dict]:
+    """Prissätter flera materiallistor i ett svep.
+
+    Args:
+        boms: Materiallistor, grupperade {byggdel: {produkt: antal}} eller
+            platta {produkt: antal}
+        vat_rate: Momssats som ingår i katalogpriserna
+
+    Returns:
+        En offert per materiallista:
+        {
+            "categories": {byggdel: {"lines": [...], "subtotal": kr}},
+            "total": kr inkl. moms (avrundat till hela kronor),
+            "vat": varav moms,
+            "total_excl_vat": kr exkl. moms,
+            "line_count": antal prissatta rader,
+            "unmatched": [{"sku", "quantity", "category", "reason", "suggestions"}]
+        }
+        Varje rad har sku, name, quantity, unit_price, total och coverage
+        (meter eller kvm som raden täcker, 0 för styckvaror).
+
+    Raises:
+        ValueError: Om en materiallista inte är ett objekt
+    """
+    for n, bom in enumerate(boms):
+        if not isinstance(bom, dict):
+            raise ValueError(f"Materiallista {n + 1} är inte ett objekt: {bom!r}")
+    table = get_price_table()
+
+    # 1. Platta ut alla rader i alla materiallistor till parallella listor
+    owners, categories, skus, quantities = [], [], [], []
+    unmatched = [[] for _ in boms]
+    for n, bom in enumerate(boms):
+        for category, sku, quantity in _rows(bom):
+            amount = _quantity(quantity)
+            if sku not in table.index or amount is None:
+                unmatched[n].append(_unmatched(sku, quantity, category, amount is None))
+                continue
+            owners.append(n)
+            categories.append(category)
+            skus.append(sku)
+            quantities.append(amount)
+
+    # 2. Ett svep över raderna: index, pris och täckning ur arrayerna, radsumma och delsumma
+    quotes = [{"categories": {}, "total": 0.0, "line_count": 0, "unmatched": unmatched[n]}
+              for n in range(len(boms))]
+    prices, coverage, index = table.prices, table.coverage, table.index
+    for n, category, sku, amount in zip(owners, categories, skus, quantities):
+        i = index[sku]
+        line_total = round(prices[i] * amount, 2)
+        group = quotes[n]["categories"].setdefault(category, {"lines": [], "subtotal": 0.0})
+        group["lines"].append({
+            "sku": sku,
+            "name": sku.replace("_", " "),
+            "quantity": amount,
+            "unit_price": prices[i],
+            "total": line_total,
+            "coverage": round(coverage[i] * amount, 2),
+        })
+        group["subtotal"] += line_total
+        quotes[n]["line_count"] += 1
+
+    for q in quotes:
+        for group in q["categories"].values():
+            group["subtotal"] = round(group["subtotal"], 2)
+        # Avrunda till hela kronor, hälften uppåt (inte bankers rounding)
+        total = floor(sum(group["subtotal"] for group in q["categories"].values()) + 0.5)
+        q["total"] = total
+        q["vat"] = round(total * vat_rate / (1 + vat_rate), 2)
+        q["total_excl_vat"] = round(total - q["vat"], 2)
+    return quotes
+
+
+def format_quote(q: dict) -> list[str]:
+    """Formaterar en offert som textrader för ett mail till kunden."""
+    lines = []
+    for category, group in q["categories"].items():
+        lines.append(f"\n📦 {category}:")
+        for line in group["lines"]:
+            lines.append(
+                f"   • {line['name']}: {_number(line['quantity'])} st à "
+                f"{_number(line['unit_price'])} kr = {_number(line['total'])} kr"
+            )
+    lines.append(f"\n💰 Uppskattad totalkostnad: {_number(q['total'])} kr (varav moms {_number(q['vat'])} kr)")
+    return lines
+
+
+def _rows(bom: dict):
+    """Ger (byggdel, produkt, antal) för grupperade och platta materiallistor.
+
+    Raises:
+        ValueError: Om materiallistan inte är ett objekt
+    """
+    if not isinstance(bom, dict):
+        raise ValueError(f"Materiallistan är inte ett objekt: {bom!r}")
+    for key, value in bom.items():
+        if isinstance(value, dict):
+            for sku, quantity in value.items():
+                yield key, sku, quantity
+        else:
+            yield DEFAULT_CATEGORY, key, value
+
+
+def _quantity(value) -> float | None:
+    """Antal som tal, eller None om det inte är ett positivt tal."""
+    if isinstance(value, bool):
+        return None
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return None
+    return amount if amount > 0 else None
+
+
+def _unmatched(sku: str, quantity, category: str, invalid_quantity: bool) -> dict:
+    """Beskriver en rad som inte kunde prissättas, med förslag ur katalogen."""
+    known = sku in get_price_table().index
+    return {
+        "sku": sku,
+        "quantity": quantity,
+        "category": category,
+        "reason": "ogiltigt antal" if invalid_quantity and known else "okänd produkt",
+        "suggestions": [] if known else search_products(sku, SUGGESTION_LIMIT),
+    }
+
+
+def _number(value: float) -> str:
+    """Heltal utan decimaler, annars två decimaler."""
+    return f"{value:.0f}" if float(value).is_integer() else f"{value:.2f}"
+
+
+def main():
+    """Prissätter materiallistor från en JSON-fil (offline offertjobb)."""
+    parser = argparse.ArgumentParser(description="Prissätt materiallistor mot produktkatalogen")
+    parser.add_argument("file", help="JSON-fil med en lista eller ett objekt {id: materiallista}")
+    parser.add_argument("--json", action="store_true", help="Skriv ut hela offerterna som JSON")
+    parser.add_argument("--vat", type=float, default=VAT_RATE, help=f"Momssats (standard {VAT_RATE})")
+    args = parser.parse_args()
+
+    with open(args.file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    ids = list(data) if isinstance(data, dict) else list(range(1, len(data) + 1))
+    boms = list(data.values()) if isinstance(data, dict) else data
+
+    try:
+        quotes = quote_many(boms, args.vat)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.json:
+        json.dump(dict(zip(map(str, ids), quotes)), sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+
+    for bom_id, q in zip(ids, quotes):
+        print(f"{bom_id}: {_number(q['total'])} kr inkl. moms ({_number(q['total_excl_vat'])} kr exkl. moms), "
+              f"{q['line_count']} rader")
+        for item in q["unmatched"]:
+            suggestions = ", ".join(item["suggestions"]) or "inga förslag"
+            print(f"    ! {item['sku']} ({item['reason']}): {suggestions}")
+    print(f"\nTotalt: {_number(sum(q['total'] for q in quotes))} kr för {len(quotes)} offerter")
+
+
+if __name__ == "__main__":
+    main()
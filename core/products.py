@@ -3,9 +3,58 @@
 Format: produktnamn: (pris i SEK, dimension i meter/kvm eller None för styckvaror)
 
 Priser uppdaterade december 2025 baserat på marknadspriser från Byggmax, Beijer m.fl.
+
+PRODUCTS räknar upp PRODUCTS.version vid varje ändring, så att sökindexet
+(core/search.py) och pristabellen (core/pricing.py) vet när de ska byggas om.
 """
 
-PRODUCTS = {
+
+class Catalog(dict):
+    """Dict som räknar upp version vid varje ändring (även byte av namn eller pris)."""
+
+    version = 0
+
+    def _changed(self):
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._changed()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._changed()
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._changed()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._changed()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+PRODUCTS = Catalog({
     # --- VIRKE / TRÄ ---
     # Reglar prissatta per styck baserat på ca 15-45 kr/m beroende på dimension
     "regel_45x45_3m": (55, 3.0),       # ~18 kr/m
@@ -141,4 +190,4 @@ PRODUCTS = {
     "betong_torr_25kg": (79, None),
     "betong_snabb_25kg": (119, None),
     "puts_vägg_25kg": (149, None),
-}
+})
@@ -0,0 +1,148 @@
+"""Push-notiser om nya mail, så att klienten slipper polla med fast intervall.
+
+- MailNotifier: trådsäker "nytt mail"-signal som serverns
+  wait_for_new_mail-verktyg väntar på
+- PushReceiver: liten HTTP-server (webhook) som tar emot Gmail-notiser från
+  Google Pub/Sub (push-prenumeration mot http://<värd>:PUSH_WEBHOOK_PORT/gmail-push)
+  och signalerar MailNotifier. Med testdata (USE_GMAIL=false) kan testmail
+  läggas i inkorgen med POST /test-mail, t.ex.:
+
+    curl -X POST localhost:8085/test-mail -d '{"from": "a@b.se", "subject": "Hej", "body": "..."}'
+
+IMAP använder IDLE direkt mot servern (se core/imap_transport.py) och
+behöver ingen webhook.
+"""
+
+import os
+import sys
+import json
+import base64
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PUSH_WEBHOOK_PORT = int(os.getenv("PUSH_WEBHOOK_PORT", "0"))  # 0 = ingen webhook
+PUSH_WEBHOOK_HOST = os.getenv("PUSH_WEBHOOK_HOST", "127.0.0.1")
+# Hemlig token som Pub/Sub-prenumerationens URL måste innehålla (?token=...)
+PUSH_WEBHOOK_TOKEN = os.getenv("PUSH_WEBHOOK_TOKEN", "")
+
+
+class MailNotifier:
+    """Signal om att nya mail har kommit (från webhook eller test)."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self.notifications = 0
+        self.last_payload = None
+
+    def notify(self, payload: dict = None):
+        """Signalerar nya mail och väcker den som väntar."""
+        with self._lock:
+            self.notifications += 1
+            self.last_payload = payload
+        self._event.set()
+
+    def wait(self, timeout: float) -> bool:
+        """Väntar på en notis. True om en kom (och nollställer signalen), False vid timeout."""
+        if self._event.wait(timeout):
+            self._event.clear()
+            return True
+        return False
+
+
+def decode_pubsub(body: bytes) -> dict:
+    """Avkodar en Pub/Sub-push: {"message": {"data": base64(JSON)}} -> JSON-innehållet.
+
+    För Gmail är innehållet {"emailAddress": ..., "historyId": ...}.
+
+    Raises:
+        ValueError: Om kroppen inte är ett Pub/Sub-kuvert med JSON-data
+    """
+    envelope = json.loads(body or b"{}")
+    message = envelope.get("message", {}) if isinstance(envelope, dict) else None
+    if not isinstance(message, dict):
+        raise ValueError("Pub/Sub-kuvertet saknar message-objekt")
+    data = message.get("data")
+    if not data:
+        return {}
+    if not isinstance(data, str):
+        raise ValueError("message.data måste vara en base64-sträng")
+    payload = json.loads(base64.b64decode(data, validate=True))
+    if not isinstance(payload, dict):
+        raise ValueError("message.data måste innehålla ett JSON-objekt")
+    return payload
+
+
+class PushReceiver:
+    """Webhook i en bakgrundstråd som tar emot push-notiser och testmail."""
+
+    def __init__(self, notifier: MailNotifier, port: int = PUSH_WEBHOOK_PORT,
+                 host: str = PUSH_WEBHOOK_HOST, token: str = PUSH_WEBHOOK_TOKEN, on_test_mail=None):
+        """
+        Args:
+            notifier: Signal som väcks vid varje notis
+            port: Port att lyssna på (0 = valfri ledig port)
+            token: Om satt måste anropen ha ?token=<token>
+            on_test_mail: Funktion som tar emot ett testmail (dict) från
+                POST /test-mail, eller None för att stänga av den vägen
+        """
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                url = urlparse(self.path)
+                if token and parse_qs(url.query).get("token", [""])[0] != token:
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+
+                try:
+                    body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                    status = receiver._handle(url.path, body)
+                except (ValueError, KeyError) as e:
+                    print(f"Webhook: ogiltigt anrop till {url.path}: {e}", file=sys.stderr)
+                    status = 400
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # stdout är MCP-kanalen, logga inte dit
+                pass
+
+        self.notifier = notifier
+        self.on_test_mail = on_test_mail
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="push-webhook", daemon=True)
+
+    def _handle(self, path: str, body: bytes) -> int:
+        """Hanterar ett anrop och returnerar HTTP-status."""
+        if path == "/gmail-push":
+            self.notifier.notify(decode_pubsub(body))
+            return 204  # Kvittens till Pub/Sub, annars skickas notisen igen
+        if path == "/test-mail" and self.on_test_mail is not None:
+            email = json.loads(body)
+            if not isinstance(email, dict) or not {"from", "subject", "body"} <= email.keys():
+                raise ValueError("testmail måste ha from, subject och body")
+            self.on_test_mail(email)
+            self.notifier.notify({"test_mail": email["subject"]})
+            return 204
+        return 404
+
+    def start(self):
+        self._thread.start()
+        print(f"Webhook för push-notiser lyssnar på port {self.port}", file=sys.stderr)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+_notifier = MailNotifier()
+
+
+def get_notifier() -> MailNotifier:
+    """Returnerar processens gemensamma MailNotifier."""
+    return _notifier
@@ -0,0 +1,255 @@
+"""Regelbaserad förklassificering av mail innan LLM:en anropas.
+
+Många mail är uppenbara redan på ämnesraden ("Prisförfrågan plywood",
+"Boka möte"). RuleClassifier klassificerar dem lokalt med förkompilerade
+nyckelordsregler, träffar på produktnamn i katalogen och tolkning av
+svenska datum/tider för möten. Bara om säkerheten är under tröskeln
+(RULES_CONFIDENCE_THRESHOLD) behöver LLM:en anropas.
+
+Reglerna sätter aldrig high_priority. Mail med tecken på eskalering
+(advokat, "igen", byter leverantör, ...) lämnas därför alltid till LLM:en.
+"""
+
+import os
+import re
+from datetime import datetime, timedelta
+
+from .products import PRODUCTS
+from .search import tokenize, normalize_word
+
+RULES_CONFIDENCE_THRESHOLD = float(os.getenv("RULES_CONFIDENCE_THRESHOLD", "0.8"))
+
+# Poäng som motsvarar full säkerhet för en kategori
+STRONG_SCORE = 3
+
+# (mönster, vikt) per kategori. Ämnesraden räknas dubbelt.
+CATEGORY_RULES = {
+    "support": [
+        (r"klagomål|reklamation|reklamera", 3),
+        (r"fel leverans|felleverans|trasig|skadad|spruck|sprucken|spruckna|fick bara|saknas|saknade", 2),
+        (r"ersättning|återbetalning|pengarna tillbaka|missnöjd|inte nöjd", 2),
+        (r"\bproblem\b|\bfel\b|försenad|har inte kommit", 1),
+    ],
+    "sales": [
+        (r"prisförfrågan|prislista|vad kostar|vad är priset", 3),
+        (r"\bpris(?:et|er|erna)?\b|\bkostar\b|har ni\b|i lager|köpa|beställa", 1),
+    ],
+    "estimate": [
+        (r"materialberäkning|materialbehov|materialåtgång|materiallista", 3),
+        (r"offert|uppskattning|beräkna|räkna på", 1),
+        (r"\b\d+(?:[.,]\d+)?\s*(?:kvm|m2|m²|kvadrat)", 1),
+        (r"garage|altan|friggebod|attefall|carport|förråd|tillbyggnad|gäststuga|bastu", 1),
+    ],
+    "meeting": [
+        (r"boka (?:ett )?möte|mötesförfrågan|mötesbokning", 3),
+        (r"\bmöte\b|träffas|kan vi ses|ses på", 2),
+    ],
+}
+
+ESCALATION = re.compile(
+    r"advokat|jurist|polis|anmäl|konsumentverket|\barn\b|media|tidning|kvällspress"
+    r"|byter (?:till )?(?:en annan )?leverantör|konkurrent|\bigen\b|tredje gången|flera gånger"
+    r"|\bchef\b|ansvarig|ultimatum|sista chansen|oacceptabelt",
+    re.IGNORECASE
+)
+
+_COMPILED = {
+    category: [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in rules]
+    for category, rules in CATEGORY_RULES.items()
+}
+
+# Katalogens produktkategorier (första ordet i namnet), normaliserade som i sökindexet
+CATALOG_WORDS = {normalize_word(tokenize(name)[0]) for name in PRODUCTS}
+_MEASURE = re.compile(r"^\d+(?:\.\d+)?(?:x\d+(?:\.\d+)?|mm|m)$")
+
+WEEKDAYS = ["måndag", "tisdag", "onsdag", "torsdag", "fredag", "lördag", "söndag"]
+MONTHS = ["januari", "februari", "mars", "april", "maj", "juni", "juli",
+          "augusti", "september", "oktober", "november", "december"]
+
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_DAY_MONTH = re.compile(r"\b(\d{1,2})(?::e|:a)?\s+(" + "|".join(MONTHS) + r")\b", re.IGNORECASE)
+_NUMERIC_DATE = re.compile(r"\b(\d{1,2})/(\d{1,2})\b")
+_RELATIVE_DAY = re.compile(r"\b(idag|i dag|imorgon|i morgon|i övermorgon|övermorgon)\b", re.IGNORECASE)
+_WEEKDAY = re.compile(r"\b(?:på |nästa )?(" + "|".join(WEEKDAYS) + r")\b", re.IGNORECASE)
+_TIME = re.compile(r"\b(?:kl(?:ockan)?\.?\s*(\d{1,2})(?:[:.](\d{2}))?|(\d{1,2})[:.](\d{2}))\b", re.IGNORECASE)
+
+
+def extract_meeting_time(text: str, now: datetime = None) -> str | None:
+    """Tolkar svensk datum- och tidsangivelse till ISO-format (YYYY-MM-DDTHH:MM:SS).
+
+    Klarar t.ex. "fredag kl 14", "imorgon 10:30", "15 mars kl. 9" och
+    "2025-03-15 13:00". Returnerar None om datum eller klockslag saknas.
+    """
+    now = now or datetime.now()
+    date = _extract_date(text, now)
+    time_match = _TIME.search(text)
+    if date is None or time_match is None:
+        return None
+
+    hour = int(time_match.group(1) or time_match.group(3))
+    minute = int(time_match.group(2) or time_match.group(4) or 0)
+    if hour > 23 or minute > 59:
+        return None
+    return date.replace(hour=hour, minute=minute, second=0, microsecond=0).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _extract_date(text: str, now: datetime) -> datetime | None:
+    """Hittar första datumangivelsen i texten (nästa förekomst om året saknas)."""
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    match = _ISO_DATE.search(text)
+    if match:
+        try:
+            return datetime(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError:
+            return None
+
+    match = _DAY_MONTH.search(text) or _NUMERIC_DATE.search(text)
+    if match:
+        day = int(match.group(1))
+        month_text = match.group(2).lower()
+        month = MONTHS.index(month_text) + 1 if month_text in MONTHS else int(month_text)
+        try:
+            date = datetime(today.year, month, day)
+        except ValueError:
+            return None
+        return date if date >= today else date.replace(year=today.year + 1)
+
+    match = _RELATIVE_DAY.search(text)
+    if match:
+        word = match.group(1).lower()
+        offset = 0 if "dag" in word else 2 if "över" in word else 1
+        return today + timedelta(days=offset)
+
+    match = _WEEKDAY.search(text)
+    if match:
+        days_ahead = (WEEKDAYS.index(match.group(1).lower()) - today.weekday()) % 7 or 7
+        return today + timedelta(days=days_ahead)
+
+    return None
+
+
+def catalog_terms(text: str) -> list[str]:
+    """Produkter från katalogen som nämns i texten, var och en med närliggande mått.
+
+    "Vad kostar plywood 12mm? Har ni OSB?" -> ["plywood 12mm", "osb"]
+    """
+    words = tokenize(text)
+    terms = []
+    for i, word in enumerate(words):
+        if normalize_word(word) in CATALOG_WORDS:
+            # Mått direkt efter produktnamnet hör till sökningen
+            measures = [following for following in words[i + 1:i + 3] if _MEASURE.match(following)]
+            terms.append(" ".join([word] + measures))
+    # Ett ensamt produktnamn behövs inte om samma produkt också nämns med mått
+    measured = {term.split()[0] for term in terms if " " in term}
+    return list(dict.fromkeys(term for term in terms if " " in term or term not in measured))
+
+
+class RuleClassifier:
+    """Snabb lokal klassificerare med statistik över hur ofta LLM:en kan hoppas över."""
+
+    def __init__(self, threshold: float = RULES_CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+        self._stats = {"total": 0, "bypassed": 0, "compared": 0, "disagreements": 0}
+
+    def classify(self, email: dict, now: datetime = None) -> tuple[str, dict, float]:
+        """Klassificerar ett mail med reglerna.
+
+        Returns:
+            (typ, data i samma format som LLM-klassificeringen, säkerhet 0-1)
+        """
+        subject = email.get('subject', '')
+        text = f"{subject}\n{email.get('body', '')}"
+
+        scores = {}
+        for category, rules in _COMPILED.items():
+            score = 0
+            for pattern, weight in rules:
+                if pattern.search(subject):
+                    score += 2 * weight
+                elif pattern.search(text):
+                    score += weight
+            scores[category] = score
+
+        products = catalog_terms(text)
+        scores["sales"] += min(sum(len(product.split()) for product in products), 2)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        (mail_type, best), (_, second) = ranked[0], ranked[1]
+        if best == 0:
+            return "other", {"type": "other", "high_priority": False}, 0.0
+
+        confidence = (best - second) / best * min(1.0, best / STRONG_SCORE)
+        if ESCALATION.search(text):
+            # Prioriteringen kräver LLM:ens bedömning
+            confidence = 0.0
+
+        data = {"type": mail_type, "high_priority": False}
+        if mail_type == "sales":
+            # En uppräkning, så att varje produkt söks för sig (se search_products)
+            data["product"] = ", ".join(products) if products else subject
+        elif mail_type == "estimate":
+            data["project_description"] = text
+        elif mail_type == "meeting":
+            data["meeting_time"] = extract_meeting_time(text, now)
+
+        return mail_type, data, confidence
+
+    def decide(self, email: dict) -> tuple[str, dict, float, bool]:
+        """Klassificerar och räknar om LLM:en kan hoppas över.
+
+        Returns:
+            (typ, data, säkerhet, True om säkerheten räcker för att hoppa över LLM:en)
+        """
+        mail_type, data, confidence = self.classify(email)
+        confident = confidence >= self.threshold
+        self._stats["total"] += 1
+        if confident:
+            self._stats["bypassed"] += 1
+        return mail_type, data, confidence, confident
+
+    def record_llm_result(self, rule_type: str, llm_type: str):
+        """Noterar LLM:ens klassificering av ett mail som reglerna inte avgjorde."""
+        self._stats["compared"] += 1
+        if rule_type != llm_type:
+            self._stats["disagreements"] += 1
+
+    def stats(self) -> dict:
+        """Andel mail som klarats utan LLM och hur ofta reglerna och LLM:en var oense."""
+        total, compared = self._stats["total"], self._stats["compared"]
+        return {
+            **self._stats,
+            "bypass_rate": self._stats["bypassed"] / total if total else 0.0,
+            "disagreement_rate": self._stats["disagreements"] / compared if compared else 0.0,
+        }
+
+
+def evaluate(classifier: RuleClassifier, labeled: list) -> dict:
+    """Utvärderar reglerna mot ett facit.
+
+    Args:
+        labeled: Lista med (mail, förväntad typ)
+
+    Returns:
+        Täckning (andel över tröskeln), träffsäkerhet för de mail som
+        reglerna avgör själva och totalt, samt felklassade mail.
+    """
+    decided = correct_decided = correct_total = 0
+    mistakes = []
+    for email, expected in labeled:
+        mail_type, _, confidence = classifier.classify(email)
+        correct_total += mail_type == expected
+        if confidence >= classifier.threshold:
+            decided += 1
+            correct_decided += mail_type == expected
+            if mail_type != expected:
+                mistakes.append((email['subject'], expected, mail_type))
+
+    return {
+        "total": len(labeled),
+        "coverage": decided / len(labeled) if labeled else 0.0,
+        "accuracy_decided": correct_decided / decided if decided else 0.0,
+        "accuracy_total": correct_total / len(labeled) if labeled else 0.0,
+        "mistakes": mistakes,
+    }
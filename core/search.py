@@ -0,0 +1,316 @@
+"""Sökindex över produktkatalogen.
+
+Indexet byggs en gång vid import (och när PRODUCTS.version ändras) så att en
+sökning inte behöver gå igenom och normalisera alla produkter:
+- Produktnamnen delas upp i ord (regel, 45x145, 3m, ...)
+- Orden normaliseras: å/ä/ö viks till a/o och plural/bestämd form tas bort,
+  så att "reglar", "regel" och "brädor"/"bräda" matchar varandra
+- Ord slås upp exakt, som prefix (sorterat ordförråd), som delsträng
+  (trigram-index) och till sist med stavfelstolerans (trigram-kandidater
+  som verifieras med redigeringsavstånd), i den ordningen
+- Resultaten rankas efter hur många sökord som matchade och hur bra.
+  Sökord som inte matchar något alls (t.ex. "pris") ignoreras, och
+  småord (i, på, och, för, ...) tas bort innan sökningen
+- En uppräkning av flera produkter ("plywood 12mm, osb", "spik och
+  skruv") söks en produkt i taget, så att en produkt som matchar fler
+  sökord inte tränger undan de andra
+
+Exempel:
+    search_products("reglar 45*145")  -> ["regel_45x145_3m", "regel_45x145_3.6m", ...]
+    search_products("plywod 12")      -> ["plywood_12mm"]
+    search_products("osb skiva")      -> ["osb_11mm", "osb_18mm"]
+    search_products("tryckimpregnerat regel") -> ["regel_tryckimp_45x95_3m", ...]
+    search_products("plywood 12mm, osb") -> ["plywood_12mm", "osb_11mm", "osb_18mm"]
+"""
+
+import re
+from bisect import bisect_left
+
+from .metrics import timed
+from .products import PRODUCTS
+
+# Poäng per sökord beroende på hur det matchade ett ord i produktnamnet
+SCORE_EXACT = 4
+SCORE_PREFIX = 3
+SCORE_SUBSTRING = 2
+SCORE_FUZZY = 1
+
+# Minsta längd för ett katalogord som förkortning av ett längre sökord
+MIN_ABBREVIATION = 5
+
+# Minsta längd för att ett sökord utan siffror ska matcha som prefix ("i" ska inte hitta "isolering")
+MIN_PREFIX = 3
+
+# Skiljer produkterna i en uppräkning åt. Kräver blanksteg efter kommat, så att "1,2 cm" hålls ihop.
+_LIST_SEPARATOR = re.compile(r"[,;]\s+|\s+(?:och|samt|eller)\s+", re.IGNORECASE)
+
+# Minsta andel gemensamma trigram för att ett ord ska prövas som stavfel
+FUZZY_MIN_OVERLAP = 0.3
+
+# Generiska ord som kunder använder för en hel kategori
+CATEGORY_ALIASES = {
+    "skiva": ("plywood", "osb", "masonit", "spånskiva", "gipsskiva", "golvspånskiva"),
+    "virke": ("regel", "bräda", "råspont", "takläkt"),
+    "golv": ("golvspånskiva", "parkettgolv", "laminatgolv", "undergolv"),
+}
+
+# Småord som inte beskriver någon produkt. Tas bort ur sökfrågan innan sökningen,
+# annars matchar de som prefix/delsträng ("på" -> "parkettgolv", "för" -> "varmförz").
+STOP_WORDS = (
+    "i", "på", "och", "för", "med", "av", "till", "om", "från", "hos", "som", "eller",
+    "en", "ett", "den", "det", "de", "att", "är", "har", "kan", "ska", "vill", "behöver",
+    "jag", "vi", "ni", "du", "mig", "oss", "er", "min", "mitt", "mina", "vår", "ert",
+    "hej", "tack", "pris", "priser", "vad", "hur", "många", "några", "finns", "lager",
+)
+
+_DIMENSION = re.compile(r"(\d+(?:\.\d+)?)\s*[x*×]\s*(\d+(?:\.\d+)?)")
+_UNIT = re.compile(r"(\d+(?:\.\d+)?)\s*(mm|cm|meter|m|kg|l|ml|st|kvm)\b")
+_TOKEN = re.compile(r"[0-9a-zåäöé][0-9a-zåäöé.]*")
+
+_FOLD = str.maketrans("åäöé", "aaoe")
+_VOWELS = set("aeiouy")
+# Plural- och bestämd-form-ändelser, längsta först
+_SUFFIXES = ("orna", "arna", "erna", "or", "ar", "er", "na", "en", "et", "a", "e")
+
+
+def _unit(match: re.Match) -> str:
+    value, unit = match.group(1), match.group(2)
+    if unit == "cm":
+        return f"{float(value) * 10:g}mm"
+    if unit == "meter":
+        unit = "m"
+    return f"{value}{unit}"
+
+
+def tokenize(text: str) -> list[str]:
+    """Delar upp en sökfråga eller ett produktnamn i ord (utan normalisering).
+
+    Måttangivelser skrivs om till katalogens format: "45 * 145" och
+    "45 x 145" blir "45x145", "12 mm" och "1,2 cm" blir "12mm", "3,6 meter"
+    blir "3.6m".
+    """
+    text = text.lower().replace("_", " ")
+    text = re.sub(r"(\d),(\d)", r"\1.\2", text)
+    text = _DIMENSION.sub(r"\1x\2", text)
+    text = _UNIT.sub(_unit, text)
+    return [token.rstrip(".") for token in _TOKEN.findall(text)]
+
+
+def normalize_word(word: str) -> str:
+    """Viker svenska tecken och tar bort plural/bestämd form från ett ord.
+
+    Ord med siffror (mått) lämnas orörda förutom teckenvikningen.
+    """
+    word = word.translate(_FOLD)
+    if not word.isalpha():
+        return word
+
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+
+    # Regel/reglar, nyckel/nycklar: stryk obetonat e före l/n/r
+    if len(word) >= 4 and word[-2] == "e" and word[-1] in "lnr" and word[-3] not in _VOWELS:
+        word = word[:-2] + word[-1]
+    return word
+
+
+_STOP_WORDS = {normalize_word(word) for word in STOP_WORDS}
+
+
+def _trigrams(word: str) -> set:
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def _padded_trigrams(word: str) -> set:
+    """Trigram med ordgränser, så att även korta ord och felstavade början/slut räknas."""
+    return _trigrams(f"^{word}$")
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Redigeringsavstånd med byte av intilliggande tecken (OSA).
+
+    Avbryter tidigt och returnerar max_distance + 1 om avståndet är större.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _max_edits(term: str) -> int:
+    """Antal tillåtna stavfel beroende på ordets längd (inga för korta ord och mått)."""
+    if len(term) <= 3 or not term.isalpha():
+        return 0
+    return 1 if len(term) <= 6 else 2
+
+
+class ProductIndex:
+    """Inverterat index över produktnamn med exakt-, prefix-, delsträngs- och stavfelsuppslag."""
+
+    def __init__(self, products: dict):
+        self.names = list(products)
+        self.size = len(self.names)
+        self.version = getattr(products, "version", None)  # Katalogens version (se core.products.Catalog)
+        self._postings = {}         # normaliserat ord -> set med produktindex
+        self._trigrams = {}         # trigram -> set med ord (delsträngar)
+        self._padded_trigrams = {}  # trigram med ordgränser -> set med ord (stavfel)
+
+        for i, name in enumerate(self.names):
+            words = tokenize(name)
+            # Kategorin (första ordet) ger även träff på dess alias
+            words += [alias for alias, categories in CATEGORY_ALIASES.items() if words[0] in categories]
+            for word in words:
+                self._postings.setdefault(normalize_word(word), set()).add(i)
+
+        self._vocabulary = sorted(self._postings)
+        for token in self._vocabulary:
+            for trigram in _trigrams(token):
+                self._trigrams.setdefault(trigram, set()).add(token)
+            for trigram in _padded_trigrams(token):
+                self._padded_trigrams.setdefault(trigram, set()).add(token)
+
+    def search(self, query: str, limit: int = None) -> list[str]:
+        """Returnerar matchande produktnamn, bäst först.
+
+        Produkter som matchar flest sökord vinner; inom dem rankas de efter
+        summerad poäng och därefter katalogordning.
+        """
+        terms = []
+        for term in dict.fromkeys(normalize_word(word) for word in tokenize(query)):
+            if term in _STOP_WORDS:
+                continue
+            groups = self._match_term(term)
+            if groups:
+                terms.append(groups)
+
+        if not terms:
+            return []
+
+        # Vanligaste fallet: produkter som matchar alla sökord (mängdsnitt i C)
+        term_sets = [set().union(*(products for _, products in groups)) for groups in terms]
+        candidates = set.intersection(*sorted(term_sets, key=len))
+        if not candidates:
+            # Annars: de produkter som matchar flest sökord
+            counts = {}
+            for products in term_sets:
+                for i in products:
+                    counts[i] = counts.get(i, 0) + 1
+            best_count = max(counts.values())
+            candidates = {i for i, count in counts.items() if count == best_count}
+
+        def score(i: int) -> int:
+            return sum(next((s for s, products in groups if i in products), 0) for groups in terms)
+
+        scores = {i: score(i) for i in candidates}
+        ranked = sorted(candidates, key=lambda i: (-scores[i], i))
+        return [self.names[i] for i in ranked[:limit]]
+
+    def _match_term(self, term: str) -> list:
+        """Returnerar [(poäng, produktmängd)] för ett normaliserat sökord, högst poäng först."""
+        by_score = {}
+        for token, score in self._matching_tokens(term):
+            by_score.setdefault(score, []).append(self._postings[token])
+        return [(score, set().union(*postings)) for score, postings in sorted(by_score.items(), reverse=True)]
+
+    def _matching_tokens(self, term: str) -> list:
+        """Returnerar (ord, poäng) för alla ord i ordförrådet som sökordet matchar."""
+        matches = []
+        if term in self._postings:
+            matches.append((term, SCORE_EXACT))
+
+        # Prefix: alla ord som börjar med term ligger i följd i det sorterade ordförrådet.
+        # Mått får vara korta ("12" -> "12mm"), ord måste ha minst MIN_PREFIX tecken.
+        start = bisect_left(self._vocabulary, term)
+        if len(term) < MIN_PREFIX and term.isalpha():
+            start = len(self._vocabulary)
+        for i in range(start, len(self._vocabulary)):
+            token = self._vocabulary[i]
+            if not token.startswith(term):
+                break
+            if token != term:
+                matches.append((token, SCORE_PREFIX))
+
+        # Delsträng: kandidater som innehåller alla sökordets trigram
+        if len(term) >= 3:
+            candidates = None
+            for trigram in _trigrams(term):
+                candidates = self._trigrams.get(trigram, set()) if candidates is None \
+                    else candidates & self._trigrams.get(trigram, set())
+                if not candidates:
+                    break
+            for token in candidates or ():
+                if term in token and not token.startswith(term):
+                    matches.append((token, SCORE_SUBSTRING))
+
+        # Förkortningar i katalogen: "tryckimpregnerat" ska hitta "tryckimp"
+        for end in range(len(term) - 1, MIN_ABBREVIATION - 1, -1):
+            if term[:end] in self._postings:
+                matches.append((term[:end], SCORE_SUBSTRING))
+
+        # Stavfel: bara om inget annat matchade
+        if not matches:
+            matches = [(token, SCORE_FUZZY) for token in self._fuzzy_tokens(term)]
+        return matches
+
+    def _fuzzy_tokens(self, term: str) -> list:
+        """Ord inom tillåtet redigeringsavstånd, förfiltrerade på gemensamma trigram."""
+        max_edits = _max_edits(term)
+        if max_edits == 0:
+            return []
+
+        term_trigrams = _padded_trigrams(term)
+        overlap = {}
+        for trigram in term_trigrams:
+            for token in self._padded_trigrams.get(trigram, ()):
+                overlap[token] = overlap.get(token, 0) + 1
+
+        min_overlap = FUZZY_MIN_OVERLAP * len(term_trigrams)
+        return [
+            token for token, count in overlap.items()
+            if count >= min_overlap and edit_distance(term, token, max_edits) <= max_edits
+        ]
+
+
+_index = ProductIndex(PRODUCTS)
+
+
+def get_index() -> ProductIndex:
+    """Returnerar sökindexet och bygger om det om katalogen har ändrats sedan det byggdes."""
+    if _index.version != PRODUCTS.version:
+        rebuild_index()
+    return _index
+
+
+def rebuild_index():
+    """Bygger om sökindexet från PRODUCTS (anropa efter ändringar i katalogen)."""
+    global _index
+    _index = ProductIndex(PRODUCTS)
+
+
+@timed("search_seconds")
+def search_products(query: str, limit: int = None) -> list[str]:
+    """Söker i produktkatalogen och returnerar matchande produktnamn, bäst först.
+
+    Är frågan en uppräkning söks varje del för sig och träffarna läggs
+    efter varandra i uppräkningens ordning.
+    """
+    index = get_index()
+    parts = [part for part in _LIST_SEPARATOR.split(query) if part.strip()]
+    if len(parts) <= 1:
+        return index.search(query, limit)
+    names = list(dict.fromkeys(name for part in parts for name in index.search(part)))
+    return names[:limit] if limit else names
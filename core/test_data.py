@@ -71,3 +71,54 @@ Har ni OSB-skivor också?
 /Anders"""
     },
 ]
+
+# Facit för utvärdering av den regelbaserade klassificeringen (core/rules.py):
+# FAKE_INBOX samt några svårare fall (eskalering, blandade ärenden, övrigt)
+LABELED_INBOX = list(zip(FAKE_INBOX, ["estimate", "support", "meeting", "estimate", "sales"])) + [
+    ({
+        "from": "karin.ek@example.com",
+        "subject": "Reklamation - trasiga gipsskivor IGEN",
+        "body": """Hej,
+
+Det är tredje gången vi får trasiga gipsskivor från er. Om inte detta
+löses i veckan byter vi leverantör och kontaktar Konsumentverket.
+
+Karin Ek"""
+    }, "support"),
+    ({
+        "from": "olle@example.com",
+        "subject": "Har ni tryckimpregnerat virke?",
+        "body": """Hej!
+
+Har ni tryckimpregnerade reglar 45x95 i lager? Vad är priset per meter?
+
+Olle"""
+    }, "sales"),
+    ({
+        "from": "sara.holm@example.com",
+        "subject": "Mötesförfrågan",
+        "body": """Hej,
+
+Vi vill gärna träffas och diskutera ett samarbete kring en ny bostadsrättsförening.
+Passar imorgon kl 10:30?
+
+Sara Holm"""
+    }, "meeting"),
+    ({
+        "from": "per@example.com",
+        "subject": "Friggebod 15 kvm",
+        "body": """Hej!
+
+Kan ni räkna på vad jag behöver för material till en friggebod på 15 kvm
+med pulpettak?
+
+Per"""
+    }, "estimate"),
+    ({
+        "from": "info@leverantor.se",
+        "subject": "Nyhetsbrev oktober",
+        "body": """Hej,
+
+Här kommer månadens nyheter från oss. Trevlig läsning!"""
+    }, "other"),
+]
@@ -0,0 +1,107 @@
+"""Gemensamt gränssnitt för mailtransporter (läsa, kvittera och skicka mail).
+
+Servern pratar bara med en MailTransport. Vilken som används väljs med
+MAIL_TRANSPORT:
+- "gmail" (standard): GmailClient i core/autoresponder.py (Gmail API, OAuth)
+- "imap": ImapTransport i core/imap_transport.py (IMAP + SMTP, t.ex. en
+  egen mailserver)
+
+Mail representeras som dict med 'id', 'from', 'subject', 'body' och
+'date' (serverns ankomsttid i ISO-format, eller None).
+"""
+
+import os
+
+from .agents import ComplaintAgent
+
+MAIL_TRANSPORT = os.getenv("MAIL_TRANSPORT", "gmail").lower()
+
+
+class MailTransport:
+    """Basklass för mailtransporter."""
+
+    _complaint_agent = None
+
+    # True om transporten kan vänta på nya mail (wait_for_new_mail) i stället för att pollas
+    supports_push = False
+
+    def get_unread_emails(self, max_results: int | None = 10, format: str = 'full') -> list:
+        """Hämtar olästa mail.
+
+        Args:
+            max_results: Max antal mail, eller None för alla olästa
+            format: 'full' (headers + body), 'metadata' (bara headers och
+                ett utdrag som body) eller 'raw' (hela RFC 822-mailet tolkat)
+        """
+        raise NotImplementedError
+
+    def sync_unread_emails(self, max_results: int | None = None, format: str = 'full') -> list:
+        """Hämtar olästa mail som tillkommit sedan förra synken.
+
+        Standard: samma som get_unread_emails (transporter utan inkrementell synk).
+        """
+        return self.get_unread_emails(max_results, format)
+
+    def get_emails(self, msg_ids: list, format: str = 'full') -> list:
+        """Hämtar givna mail (i samma ordning, mail som inte finns hoppas över)."""
+        raise NotImplementedError
+
+    def mark_as_read_bulk(self, msg_ids: list):
+        """Markerar flera mail som lästa."""
+        raise NotImplementedError
+
+    def mark_as_read(self, msg_id: str):
+        """Markerar ett mail som läst."""
+        self.mark_as_read_bulk([msg_id])
+
+    def wait_for_new_mail(self, timeout: float) -> bool:
+        """Blockerar tills nya mail har kommit eller timeout (sekunder) passerat.
+
+        Returns:
+            True om nya mail kom, False vid timeout
+        """
+        raise NotImplementedError
+
+    def send_email(self, to: str, subject: str, body: str):
+        """Skickar ett e-postmeddelande. Måste tåla anrop från flera trådar."""
+        raise NotImplementedError
+
+    # Äldre namn, används fortfarande på sina håll
+    def _send_email(self, to: str, subject: str, body: str):
+        return self.send_email(to, subject, body)
+
+    @property
+    def complaint_agent(self):
+        if self._complaint_agent is None:
+            self._complaint_agent = ComplaintAgent()
+        return self._complaint_agent
+
+    def create_and_send_auto_reply(self, email: dict):
+        """Skapar och skickar ett generiskt autosvar."""
+        subject = f"Autosvar: {email['subject']}"
+        body = (
+            f"Hej!\n\n"
+            f"Tack för ditt mejl angående: {email['subject']}\n\n"
+            f"Vi har mottagit ditt meddelande och återkommer så snart som möjligt.\n\n"
+            f"Vänliga hälsningar,\n"
+            f"Bengtssons Trävaror"
+        )
+        self.send_email(email['from'], subject, body)
+
+    def create_auto_response_complaint(self, email: dict, to: str = None):
+        """Skapar ett AI-genererat svar på ett klagomål."""
+        to = to or email['from']
+        subject = f"Svar på klagomål: {email['subject']}"
+        body = self.complaint_agent.write_response_to_complaint(email)
+        self.send_email(to, subject, body)
+
+
+def create_transport(name: str = MAIL_TRANSPORT) -> MailTransport:
+    """Skapar transporten som MAIL_TRANSPORT anger ("gmail" eller "imap")."""
+    if name == "imap":
+        from .imap_transport import ImapTransport
+        return ImapTransport()
+    if name == "gmail":
+        from .autoresponder import GmailClient
+        return GmailClient()
+    raise ValueError(f"Okänd MAIL_TRANSPORT: {name} (ska vara 'gmail' eller 'imap')")
@@ -1,8 +1,14 @@
 """Autonom MCP-klient som hanterar alla mail automatiskt.
 
-Kör: python mcp_client.py              (en gång)
-     python mcp_client.py --loop       (kontinuerligt, var 5:e minut)
-     python mcp_client.py --loop 60    (kontinuerligt, var 60:e minut)
+Kör: python mcp_client.py                   (en gång)
+     python mcp_client.py --loop            (kontinuerligt, var 5:e minut)
+     python mcp_client.py --loop 60         (kontinuerligt, var 60:e minut)
+     python mcp_client.py --watch           (händelsestyrt: hanterar mail direkt när de kommer)
+     python mcp_client.py --concurrency 8   (hantera upp till 8 mail samtidigt)
+     python mcp_client.py --page-size 50    (hämta inkorgen sida för sida, nästa sida medan en hanteras)
+     python mcp_client.py --bulk            (hantera alla mail med ett verktygsanrop per BULK_SIZE mail)
+     python mcp_client.py --metrics         (skriv ut latens per steg i klient och server efter körningen)
+     python mcp_client.py --evaluate-rules  (jämför regelklassificering med LLM)
 
 Arkitektur (enligt MCP-principerna):
 - KLIENTEN (denna fil) = AI som bestämmer vad som ska göras
@@ -11,26 +17,43 @@ Arkitektur (enligt MCP-principerna):
 Klienten:
 1. Ansluter till MCP-servern
 2. Hämtar alla mail (via tool)
-3. AI:n klassificerar varje mail (LOKALT i klienten)
-4. Anropar rätt handler (via tool)
-5. Avslutar (eller väntar och upprepar om --loop)
+3. Viker ihop dubbletter från samma avsändare (core/dedup.py)
+4. Uppenbara mail klassificeras med regler (core/rules.py), övriga av AI:n
+   (LOKALT i klienten)
+5. Anropar rätt handler (via tool)
+6. Avslutar (eller väntar och upprepar om --loop)
+
+I --loop- och --watch-läge hålls en och samma serverprocess (och
+MCP-session) vid liv mellan körningarna, så uppstart och Gmail-inloggning
+sker bara en gång. I --watch-läge väntar klienten på serverns
+wait_for_new_mail (IMAP IDLE eller Gmail-push) och pollar bara om push
+inte är konfigurerat, då med ett intervall som växer när inget händer.
 """
 
 import sys
-import io
 import os
 import json
 import asyncio
 import argparse
+import random
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+# Svenska tecken även i Windows-konsolen (utan att ersätta sys.stdout, som kan vara omdirigerad)
+sys.stdout.reconfigure(encoding='utf-8')
 
 from dotenv import load_dotenv
-from openai import OpenAI
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
+from core.llm import get_async_llm_client
+from core.llm_cache import get_llm_cache
+from core.metrics import get_metrics, record_llm_usage, format_summary
+from core.dedup import DuplicateTracker
+from core.rules import RuleClassifier, evaluate
+from core.test_data import LABELED_INBOX
+
 load_dotenv()
 
 # Miljövariabler laddas från .env och ärvs av servern
@@ -39,44 +62,41 @@ load_dotenv()
 print(f"USE_GMAIL={os.getenv('USE_GMAIL', 'false')}")
 print(f"SEND_REAL_EMAILS={os.getenv('SEND_REAL_EMAILS', 'false')}")
 
+# Klassificering: modell, timeout per LLM-anrop (sekunder) och antal omförsök
+CLASSIFIER_MODEL = "gemini-2.0-flash"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+LLM_BACKOFF_BASE = 1.0   # Sekunder före första omförsöket
+LLM_BACKOFF_MAX = 20.0
 
-class MailAgent:
-    """Agent som använder AI för att klassificera mail och MCP-tools för att hantera dem."""
+# Förloppsnotifieringar från långa verktygsanrop skrivs ut högst så här ofta (sekunder)
+PROGRESS_INTERVAL = 5.0
 
-    def __init__(self, session):
-        self.session = session
-        # AI-modellen som är "hjärnan" i klienten
-        self.llm = OpenAI(
-            api_key=os.getenv("GEMINI_API_KEY"),
-            base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-        )
+# Loop-läge: väntetid (sekunder) innan en död MCP-server startas om
+RECONNECT_BACKOFF_MIN = 2.0
+RECONNECT_BACKOFF_MAX = 300.0
 
-    async def call_tool(self, name: str, arguments: dict = None) -> str:
-        """Anropar ett MCP-verktyg."""
-        result = await self.session.call_tool(name, arguments or {})
-        if result.content:
-            for content in result.content:
-                if hasattr(content, 'text'):
-                    return content.text
-        return str(result)
+# --watch: max väntan per wait_for_new_mail-anrop (sekunder). Efter en timeout
+# kollas inkorgen ändå, ifall en notis har gått förlorad.
+WATCH_TIMEOUT = int(os.getenv("WATCH_TIMEOUT", "600"))
+# --watch utan push: pollintervall direkt efter hanterade mail, fördubblas
+# för varje tom koll upp till max
+WATCH_POLL_MIN = 15.0
+WATCH_POLL_MAX = 600.0
 
-    def classify_email(self, email: dict) -> tuple[str, dict]:
-        prompt = f"""Klassificera detta mail. Svara ENDAST med JSON.
+# --page-size: texten kortas till så många tecken vid hämtningen (räcker för
+# klassificeringen), hela texten hämtas bara för mail som ska besvaras
+PAGE_BODY_CHARS = 2000
 
-                Mail:
-                Från: {email['from']}
-                Ämne: {email['subject']}
-                Innehåll: {email['body']}
+# --bulk: antal mail per handle_emails_bulk-anrop
+BULK_SIZE = 50
+
+# --ack-after: antal hanterade mail som samlas innan de markeras som lästa
+ACK_FLUSH_SIZE = 50
 
-                Svara med:
-                {{
-                    "type": "support" | "sales" | "estimate" | "meeting" | "other",
-                    "high_priority": true | false,
-                    "product": "produktnamn om sales",
-                    "project_description": "beskrivning om estimate",
-                    "meeting_time": "YYYY-MM-DDTHH:MM:SS om meeting"
-                }}
 
+# Kategorier och prioriteringsregler, gemensamma för enskild och batchad klassificering
+CLASSIFICATION_RULES = """
                 Kategorier:
                 - support: Klagomål, reklamationer, problem
                 - sales: Frågor om produkter, priser, vill köpa något
@@ -98,33 +118,267 @@ class MailAgent:
 
                 Var restriktiv - de flesta klagomål är INTE high_priority."""
 
-        response = self.llm.chat.completions.create(
-            model="gemini-2.0-flash",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
+
+def _parse_json(raw: str):
+    """Tolkar ett LLM-svar som JSON (tar bort markdown-kodblock). None om det misslyckas."""
+    if raw.startswith("```"):
+        raw = raw.replace("```json", "").replace("```", "").strip()
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return None
+
+
+class ToolCallError(Exception):
+    """Verktyget svarade med isError (t.ex. ett svar som inte kunde köas)."""
+
+
+async def _ready(value):
+    """Awaitable med ett redan känt värde (t.ex. en klassificering från reglerna)."""
+    return value
+
+
+class MailAgent:
+    """Agent som använder AI för att klassificera mail och MCP-tools för att hantera dem."""
+
+    def __init__(self, session, concurrency: int = 1, batch_size: int = 1,
+                 ack_after: bool = False, use_rules: bool = True, bulk: bool = False,
+                 page_size: int = 0, show_metrics: bool = False, dedup: bool = True):
+        self.session = session
+        # Max antal mail som bearbetas samtidigt (mail från samma avsändare körs alltid i ordning)
+        self.concurrency = max(1, concurrency)
+        # Antal mail per klassificeringsanrop (1 = ett LLM-anrop per mail)
+        self.batch_size = max(1, batch_size)
+        # Markera mail som lästa först när de hanterats (i stället för vid hämtning)
+        self.ack_after = ack_after
+        self._handled_ids = []
+        # Hantera mailen med handle_emails_bulk i stället för ett verktygsanrop per mail
+        self.bulk = bulk
+        # Hämta inkorgen sida för sida med list_unread_emails (0 = allt på en gång)
+        self.page_size = max(0, page_size)
+        # Skriv ut latens per steg (klientens och serverns mätvärden) efter varje körning
+        self.show_metrics = show_metrics
+        # Dubbletter (samma avsändare, samma eller nästan samma text) hanteras bara en gång.
+        # Hålls mellan körningarna i --loop/--watch så att fönstret gäller över omgångarna.
+        self.dedup = DuplicateTracker() if dedup else None
+        # Regelbaserad förklassificering: uppenbara mail klassificeras utan LLM
+        self.rules = RuleClassifier() if use_rules else None
+        # AI-modellen som är "hjärnan" i klienten. Asynkron klient så att ett
+        # långsamt LLM-svar inte blockerar event-loopen (och MCP-trafiken).
+        # Delar anslutningspool med övriga LLM-anrop i processen (se core.llm).
+        # Omförsök sköts av _complete() med jitter, inte av SDK:n.
+        self.llm = get_async_llm_client().with_options(
+            max_retries=0,
+            timeout=LLM_TIMEOUT
         )
 
-        raw = response.choices[0].message.content.strip()
-        if raw.startswith("```"):
-            raw = raw.replace("```json", "").replace("```", "").strip()
+    async def call_tool(self, name: str, arguments: dict = None) -> str:
+        """Anropar ett MCP-verktyg (tiden mäts som mcp_call_seconds, inklusive stdio).
+
+        Servern skickar förloppsnotifieringar för långa anrop (strömmade
+        supportsvar, handle_emails_bulk); de räknas som mcp_progress_total
+        och skrivs ut högst var PROGRESS_INTERVAL:e sekund.
+
+        Raises:
+            ToolCallError: Om verktyget svarade med isError
+        """
+        last_print = time.monotonic()
+
+        async def on_progress(progress: float, total: float | None, message: str | None):
+            nonlocal last_print
+            get_metrics().inc("mcp_progress_total", tool=name)
+            now = time.monotonic()
+            if now - last_print >= PROGRESS_INTERVAL:
+                last_print = now
+                done = f"{progress:.0f}/{total:.0f}" if total else f"{progress:.0f}"
+                print(f"    … {name}: {message or done}")
+
+        with get_metrics().timer("mcp_call_seconds", tool=name):
+            result = await self.session.call_tool(name, arguments or {}, progress_callback=on_progress)
+        text = str(result)
+        if result.content:
+            for content in result.content:
+                if hasattr(content, 'text'):
+                    text = content.text
+                    break
+        if result.isError:
+            raise ToolCallError(text)
+        return text
+
+    async def _complete(self, prompt: str, model: str = CLASSIFIER_MODEL,
+                        temperature: float = 0.3, use_cache: bool = True) -> str:
+        """Kör ett prompt mot LLM med timeout och omförsök.
+
+        Identiska anrop besvaras från LLM-cachen (se core.llm_cache) om inte
+        use_cache=False.
+
+        Varje försök avbryts efter LLM_TIMEOUT sekunder. Misslyckade försök
+        görs om upp till LLM_RETRIES gånger med exponentiell backoff och
+        full jitter. CancelledError ärver inte från Exception och släpps
+        därför alltid igenom, så att anropet kan avbrytas (t.ex. vid Ctrl+C).
+        """
+        cache = get_llm_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(model, temperature, prompt)
+            if cached is not None:
+                return cached
+
+        for attempt in range(LLM_RETRIES + 1):
+            try:
+                with get_metrics().timer("llm_request_seconds", model=model, mode="classify"):
+                    response = await asyncio.wait_for(
+                        self.llm.chat.completions.create(
+                            model=model,
+                            messages=[{"role": "user", "content": prompt}],
+                            temperature=temperature
+                        ),
+                        timeout=LLM_TIMEOUT
+                    )
+                record_llm_usage(model, response.usage)
+                raw = response.choices[0].message.content.strip()
+                if cache is not None:
+                    tokens = response.usage.total_tokens if response.usage else 0
+                    cache.put(model, temperature, prompt, raw, tokens)
+                return raw
+            except Exception as e:
+                if attempt == LLM_RETRIES:
+                    raise
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+                print(f"    LLM-anrop misslyckades ({type(e).__name__}), försöker igen om {delay:.1f} s")
+                await asyncio.sleep(delay)
+
+    def _discard_cached(self, prompt: str):
+        """Tar bort ett svar som inte gick att tolka ur LLM-cachen."""
+        cache = get_llm_cache()
+        if cache is not None:
+            cache.discard(CLASSIFIER_MODEL, 0.3, prompt)
+
+    async def classify_email(self, email: dict) -> tuple[str, dict]:
+        """Klassificerar ett mail med LLM:en.
+
+        Om anropet misslyckas eller svaret inte går att tolka returneras
+        ("other", {"failed": True}); mailet hanteras då inte och lämnas
+        oläst med --ack-after.
+        """
+        prompt = f"""Klassificera detta mail. Svara ENDAST med JSON.
+
+                Mail:
+                Från: {email['from']}
+                Ämne: {email['subject']}
+                Innehåll: {email['body']}
+
+                Svara med:
+                {{
+                    "type": "support" | "sales" | "estimate" | "meeting" | "other",
+                    "high_priority": true | false,
+                    "product": "produktnamn om sales",
+                    "project_description": "beskrivning om estimate",
+                    "meeting_time": "YYYY-MM-DDTHH:MM:SS om meeting"
+                }}
+{CLASSIFICATION_RULES}"""
 
         try:
-            data = json.loads(raw)
-            return data.get("type", "other"), data
-        except:
-            return "other", {}
+            raw = await self._complete(prompt)
+        except Exception as e:
+            print(f"    Klassificering misslyckades: {e}")
+            return "other", {"failed": True}
+
+        data = _parse_json(raw)
+        if not isinstance(data, dict):
+            self._discard_cached(prompt)
+            print("    Klassificeringen gick inte att tolka")
+            return "other", {"failed": True}
+        return data.get("type", "other"), data
+
+    async def classify_batch(self, emails: list) -> list[tuple[str, dict]]:
+        """Klassificerar flera mail i ett enda LLM-anrop.
+
+        Reglerna skickas en gång för hela batchen och svaret är en JSON-lista
+        med ett objekt per mail, nycklat på mailets id. Mail som saknas i
+        svaret (eller om svaret inte går att tolka) klassificeras ett och ett
+        med classify_email().
+        """
+        keys = [str(email.get('id') or i) for i, email in enumerate(emails, 1)]
+        mail_blocks = "\n\n".join(
+            f"""                --- id: {key} ---
+                Från: {email['from']}
+                Ämne: {email['subject']}
+                Innehåll: {email['body']}"""
+            for key, email in zip(keys, emails)
+        )
 
+        prompt = f"""Klassificera följande {len(emails)} mail. Svara ENDAST med en JSON-lista.
 
-    async def process_email(self, email: dict, index: int):
-        """Bearbetar ett mail: AI klassificerar, sedan anropas rätt tool."""
-        print(f"\n[{index}] {email['subject']}")
-        print(f"    Från: {email['from']}")
+{mail_blocks}
 
+                Svara med en lista med ett objekt per mail:
+                [
+                    {{
+                        "id": "mailets id",
+                        "type": "support" | "sales" | "estimate" | "meeting" | "other",
+                        "high_priority": true | false,
+                        "product": "produktnamn om sales",
+                        "project_description": "beskrivning om estimate",
+                        "meeting_time": "YYYY-MM-DDTHH:MM:SS om meeting"
+                    }}
+                ]
+{CLASSIFICATION_RULES}"""
+
+        by_key = {}
+        try:
+            data = _parse_json(await self._complete(prompt))
+        except Exception as e:
+            print(f"    Batch-klassificering misslyckades: {e}")
+            data = None
+
+        if isinstance(data, list):
+            for item in data:
+                if isinstance(item, dict) and "id" in item:
+                    by_key[str(item["id"])] = item
+        else:
+            self._discard_cached(prompt)
+            print(f"    Batch-svaret gick inte att tolka, klassificerar {len(emails)} mail ett och ett")
+
+        async def classify_one(key: str, email: dict) -> tuple[str, dict]:
+            item = by_key.get(key)
+            if item is not None:
+                return item.get("type", "other"), item
+            return await self.classify_email(email)
+
+        return list(await asyncio.gather(*(classify_one(k, e) for k, e in zip(keys, emails))))
+
+    async def process_email(self, email: dict, index: int, classification=None) -> bool:
+        """Bearbetar ett mail: AI klassificerar, sedan anropas rätt tool.
+
+        Args:
+            classification: Awaitable med färdig (typ, data)-klassificering,
+                t.ex. från classify_batch(). Annars klassificeras mailet här.
+
+        Returns:
+            True om mailet hanterades, False om klassificeringen misslyckades
+
+        Raises:
+            ToolCallError: Om handler-verktyget inte kunde hantera mailet
+        """
         # 1. AI klassificerar
-        mail_type, data = self.classify_email(email)
+        if classification is not None:
+            mail_type, data = await classification
+        else:
+            mail_type, data = await self.classify_email(email)
+
+        print(f"\n[{index}] {email['subject']}")
+        print(f"    Från: {email['from']}")
         high_priority = data.get("high_priority", False)
         priority_str = "HÖG PRIO" if high_priority else "normal"
         print(f"Typ: {mail_type.upper()} ({priority_str})")
+        if email.get("duplicates"):
+            print(f"    + {len(email['duplicates'])} dubbletter vikta in i ärendet")
+        if data.get("failed"):
+            print("    → Ej hanterat, klassificeringen misslyckades (mailet lämnas oläst)")
+            return False
+
+        if mail_type != "other" or high_priority:
+            await self._load_body(email, data)
 
         # 2. Om hög prioritet, notifiera chef och skippa AI-svar
         if high_priority:
@@ -135,76 +389,415 @@ class MailAgent:
                 "email_type": mail_type
             })
             print("    → Eskalerat till chef (inget automatiskt svar)")
-            return  # Chefen hanterar ärendet
+            return True  # Chefen hanterar ärendet
 
         # 3. Anropa rätt handler via MCP-tool (servern utför arbete)
-        if mail_type == "support":
-            await self.call_tool("handle_support_email", {
-                "from_email": email['from'],
-                "subject": email['subject'],
-                "body": email['body']
-            })
-
-        elif mail_type == "sales":
-            product = data.get("product", "produkt")
-            await self.call_tool("handle_sales_email", {
-                "from_email": email['from'],
-                "subject": email['subject'],
-                "product_query": product if product else "produkt"
-            })
-
-        elif mail_type == "estimate":
-            description = data.get("project_description", email['body'])
-            await self.call_tool("handle_estimate_email", {
-                "from_email": email['from'],
-                "subject": email['subject'],
-                "project_description": description
-            })
+        handler = _handler_call(email, mail_type, data)
+        if handler is not None:
+            await self.call_tool(*handler)
+        return True
 
-        elif mail_type == "meeting":
-            meeting_time = data.get("meeting_time")
-            args = {
-                "from_email": email['from'],
-                "subject": email['subject']
-            }
-            if meeting_time:
-                args["meeting_time"] = meeting_time
-            await self.call_tool("handle_meeting_email", args)
-
-    async def run(self):
-        """Kör agenten."""
+    async def run(self) -> int:
+        """Kör agenten. Returnerar antalet hanterade mail."""
         print("\n" + "======================================================")
         print("  MCP MAIL-AGENT")
         print("======================================================")
 
-        # Hämta mail via MCP-tool
+        # Hämta mail via MCP-tool och bearbeta dem, flera samtidigt om --concurrency > 1
         print("\nHämtar mail...")
-        result = await self.call_tool("get_unread_emails")
+        start = time.perf_counter()
+        try:
+            if self.page_size:
+                handled = await self._process_pages()
+            else:
+                handled = await self._process_inbox()
+        finally:
+            # Kvittera även det som hann hanteras om körningen avbryts
+            await self._flush_acks()
+        if not handled:
+            return 0
+        elapsed = time.perf_counter() - start
+        per_minute = handled / elapsed * 60 if elapsed > 0 else 0.0
+
+        print("\n" + "======================================================")
+        print(f"  KLART! Hanterade {handled} mail på {elapsed:.1f} s ({per_minute:.1f} mail/min)")
+        if self.rules is not None:
+            stats = self.rules.stats()
+            print(f"  Regler: {stats['bypass_rate']:.0%} av mailen klassificerade utan LLM, "
+                  f"oense med LLM i {stats['disagreements']}/{stats['compared']} fall")
+        if self.dedup is not None:
+            stats = self.dedup.stats()
+            print(f"  Dubbletter: {stats['folded']} mail vikta ({stats['exact']} exakta, {stats['near']} nästan), "
+                  f"högst {stats['max_collapse']} i samma ärende")
+        cache = get_llm_cache()
+        if cache is not None:
+            stats = cache.stats()
+            print(f"  LLM-cache: {stats['hit_rate']:.0%} träffar, {stats['saved_tokens']} tokens sparade")
+        if self.show_metrics:
+            await self.print_metrics()
+        print("======================================================")
+        return handled
+
+    async def print_metrics(self):
+        """Skriver ut klientens mätvärden och serverns (resursen metrics://server)."""
+        print("\n".join(format_summary(get_metrics().snapshot(), "Klient (LLM-klassificering, verktygsanrop):")))
+        try:
+            result = await self.session.read_resource("metrics://server")
+            server_metrics = json.loads(result.contents[0].text)
+        except Exception as e:
+            print(f"  Kunde inte läsa serverns mätvärden: {e}")
+            return
+        print("\n".join(format_summary(server_metrics, "Server (Gmail/IMAP, LLM, historik, sök, verktyg):")))
+
+    async def _process_inbox(self) -> int:
+        """Hämtar alla olästa mail i ett anrop och bearbetar dem. Returnerar antalet."""
+        try:
+            result = await self.call_tool("get_unread_emails", {"mark_as_read": not self.ack_after})
+        except ToolCallError as e:
+            print(f"Kunde inte hämta mail: {e}")
+            return 0
 
         try:
             emails = json.loads(result)
             if isinstance(emails, dict) and "message" in emails:
                 print("Inga mail att hantera.")
-                return
+                return 0
             if not isinstance(emails, list):
                 emails = [emails]
         except:
             print(f"Kunde inte läsa mail: {result}")
-            return
+            return 0
 
         print(f"Hittade {len(emails)} mail")
-
-        # Bearbeta varje mail
+        await self._process(emails)
+        return len(emails)
+
+    async def _process_pages(self) -> int:
+        """Hämtar inkorgen sida för sida och bearbetar varje sida. Returnerar antalet mail.
+
+        Nästa sida hämtas medan föregående bearbetas. Sidorna bearbetas i
+        tur och ordning, så mail från samma avsändare hanteras fortfarande
+        i ankomstordning.
+        """
+        handled = 0
+        page = await self._fetch_page(None)
+        while page is not None:
+            emails, cursor = page
+            prefetch = asyncio.ensure_future(self._fetch_page(cursor)) if cursor else None
+            try:
+                if emails:
+                    print(f"\nSida med {len(emails)} mail (mail {handled + 1}-{handled + len(emails)})")
+                    await self._process(emails)
+                    handled += len(emails)
+            except BaseException:
+                if prefetch is not None:
+                    prefetch.cancel()
+                raise
+            page = await prefetch if prefetch is not None else None
+
+        if not handled:
+            print("Inga mail att hantera.")
+        return handled
+
+    async def _fetch_page(self, cursor: str | None) -> tuple[list, str | None] | None:
+        """Hämtar en sida med list_unread_emails. None om den inte gick att läsa."""
+        args = {"limit": self.page_size, "body_chars": PAGE_BODY_CHARS, "mark_as_read": not self.ack_after}
+        if cursor:
+            args["cursor"] = cursor
+        try:
+            result = await self.call_tool("list_unread_emails", args)
+        except ToolCallError as e:
+            print(f"Kunde inte hämta mail: {e}")
+            return None
+        try:
+            page = json.loads(result)
+            return page["emails"], page["next_cursor"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            print(f"Kunde inte läsa mail: {result}")
+            return None
+
+    async def _process(self, emails: list):
+        """Bearbetar hämtade mail (utan dubbletter), med handle_emails_bulk om --bulk."""
+        if self.dedup is not None:
+            emails = self._fold_duplicates(emails)
+        if self.bulk:
+            await self.process_bulk(emails)
+        else:
+            await self.process_all(emails)
+
+    def _fold_duplicates(self, emails: list) -> list:
+        """Viker ihop dubbletter innan klassificeringen och returnerar mailen som ska hanteras.
+
+        En dubblett kvitteras tillsammans med sitt original (se _mark_handled),
+        eller direkt om originalet hanterades i en tidigare omgång.
+        """
+        unique = self.dedup.fold(emails)
+        with_original = {msg_id for email in unique for msg_id in email.get("duplicates", [])}
+        for email in emails:
+            if "duplicate_of" not in email:
+                continue
+            kind = "exakt" if email["duplicate_kind"] == "exact" else "nästan"
+            print(f"\n[dubblett] {email['subject']}")
+            print(f"    Från: {email['from']} ({kind} samma som {email['duplicate_of'] or 'tidigare mail'}, hanteras inte)")
+            if self.ack_after and 'id' in email and email['id'] not in with_original:
+                self._handled_ids.append(email['id'])
+        return unique
+
+    def _mark_handled(self, email: dict):
+        """Noterar ett hanterat mail, och dubbletterna som vikts in i det, för kvittering."""
+        if self.ack_after and 'id' in email:
+            self._handled_ids.append(email['id'])
+            self._handled_ids.extend(email.get("duplicates", []))
+
+    async def _load_body(self, email: dict, data: dict):
+        """Hämtar hela texten för ett mail som list_unread_emails kortade av.
+
+        En projektbeskrivning som reglerna tog ur den avkortade texten
+        byts också mot hela texten.
+        """
+        if not email.get("truncated"):
+            return
+        try:
+            body = await self.call_tool("get_email_body", {"message_id": email['id']})
+        except ToolCallError as e:
+            body = f"[FEL] {e}"
+        if body.startswith("[FEL]"):
+            # Hanteras med den avkortade texten hellre än inte alls
+            print(f"    Kunde inte hämta hela texten: {body}")
+            return
+        description = data.get("project_description")
+        if description and email['body'] and email['body'] in description:
+            data["project_description"] = description.replace(email['body'], body)
+        email['body'] = body
+        email['truncated'] = False
+
+    async def wait_for_new_mail(self, timeout: int = WATCH_TIMEOUT) -> tuple[bool, bool]:
+        """Väntar på nya mail via serverns push (IMAP IDLE/Gmail-notiser).
+
+        Returns:
+            (push, new_mail) där push=False betyder att servern inte har push
+            och att klienten får polla
+        """
+        result = json.loads(await self.call_tool("wait_for_new_mail", {"timeout_seconds": timeout}))
+        return result["push"], result["new_mail"]
+
+    async def process_all(self, emails: list):
+        """Bearbetar alla mail med begränsad samtidighet.
+
+        Mailen grupperas per avsändare. Varje avsändares mail hanteras i
+        ankomstordning så att en uppföljning aldrig hanteras före första
+        mailet, medan olika avsändare bearbetas parallellt.
+        """
+        by_sender = {}
         for i, email in enumerate(emails, 1):
-            await self.process_email(email, i)
-
-        print("\n" + "======================================================")
-        print(f"  KLART! Hanterade {len(emails)} mail")
-        print("======================================================")
-
-
-async def run_once():
-    """Kör agenten en gång."""
+            by_sender.setdefault(email.get('from', ''), []).append((i, email))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        classifications = self._start_classification(emails)
+
+        async def process_sender(items: list):
+            for i, email in items:
+                async with semaphore:
+                    try:
+                        handled = await self.process_email(email, i, classifications.get(i))
+                    except Exception as e:
+                        # Mailet (och dess dubbletter) förblir oläst och hanteras vid nästa körning
+                        print(f"[{i}] Fel vid hantering av mail: {e}")
+                        continue
+                if handled:
+                    self._mark_handled(email)
+                if len(self._handled_ids) >= ACK_FLUSH_SIZE:
+                    await self._flush_acks()
+
+        await asyncio.gather(*(process_sender(items) for items in by_sender.values()))
+
+    async def process_bulk(self, emails: list):
+        """Klassificerar alla mail och hanterar dem med handle_emails_bulk.
+
+        Ett verktygsanrop per BULK_SIZE mail i stället för ett per mail.
+        Servern hanterar mailen parallellt men i ordning per avsändare, och
+        rapporterar utfallet per mail så att bara lyckade mail kvitteras.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        classifications = self._start_classification(emails)
+
+        async def classify(i: int, email: dict) -> tuple[str, dict]:
+            if i in classifications:
+                return await classifications[i]
+            async with semaphore:
+                return await self.classify_email(email)
+
+        classified = await asyncio.gather(*(classify(i, email) for i, email in enumerate(emails, 1)))
+
+        async def load_body(email: dict, data: dict):
+            async with semaphore:
+                await self._load_body(email, data)
+
+        # Mail som inte gick att klassificera hanteras inte och förblir olästa
+        pending = []  # (mailindex, mail, typ, data)
+        for i, (email, (mail_type, data)) in enumerate(zip(emails, classified), 1):
+            if data.get("failed"):
+                print(f"\n[{i}] {email['subject']}")
+                print("    → Ej hanterat, klassificeringen misslyckades (mailet lämnas oläst)")
+            else:
+                pending.append((i, email, mail_type, data))
+
+        await asyncio.gather(*(load_body(email, data) for _, email, mail_type, data in pending
+                               if mail_type != "other" or data.get("high_priority")))
+        items = [_bulk_item(email, mail_type, data) for _, email, mail_type, data in pending]
+
+        for start in range(0, len(items), BULK_SIZE):
+            chunk = items[start:start + BULK_SIZE]
+            try:
+                report = json.loads(await self.call_tool("handle_emails_bulk", {"emails": chunk}))
+            except Exception as e:
+                # Mailen i chunken förblir okvitterade och hanteras vid nästa körning
+                print(f"[{pending[start][0]}-{pending[start + len(chunk) - 1][0]}] Fel vid bulk-hantering: {e}")
+                continue
+
+            for item in report["results"]:
+                i, email, _, _ = pending[start + item["index"]]
+                priority_str = "HÖG PRIO" if chunk[item["index"]]["high_priority"] else "normal"
+                print(f"\n[{i}] {email['subject']}")
+                print(f"    Typ: {item['type'].upper()} ({priority_str})")
+                if not item["ok"]:
+                    print(f"    Fel: {item['error']}")
+                    continue
+                print(f"    → {item['result']}")
+                if email.get("duplicates"):
+                    print(f"    + {len(email['duplicates'])} dubbletter vikta in i ärendet")
+                self._mark_handled(email)
+            if len(self._handled_ids) >= ACK_FLUSH_SIZE:
+                await self._flush_acks()
+
+    async def _flush_acks(self):
+        """Markerar hanterade mail som lästa i ett bulk-anrop."""
+        if not self._handled_ids:
+            return
+        ids, self._handled_ids = self._handled_ids, []
+        try:
+            await self.call_tool("mark_emails_read", {"message_ids": ids})
+        except Exception as e:
+            # Mailen förblir olästa och hanteras igen vid nästa körning
+            print(f"Kunde inte markera {len(ids)} mail som lästa: {e}")
+
+    def _start_classification(self, emails: list) -> dict:
+        """Förklassificerar med reglerna och startar LLM-klassificering för resten.
+
+        Mail som reglerna är tillräckligt säkra på får sin klassificering
+        direkt. Övriga klassificeras av LLM:en (i batchar om --batch-size > 1)
+        och reglernas gissning jämförs med LLM:ens svar.
+
+        Returnerar {mailindex: awaitable (typ, data)}. Mail som saknas
+        klassificeras av process_email().
+        """
+        classifications = {}
+        undecided = []
+        rule_guesses = {}
+        for i, email in enumerate(emails, 1):
+            if self.rules is not None:
+                mail_type, data, _, confident = self.rules.decide(email)
+                if confident:
+                    classifications[i] = _ready((mail_type, data))
+                    continue
+                rule_guesses[i] = mail_type
+            undecided.append((i, email))
+
+        batched = self._start_batch_classification(undecided)
+        for i, email in undecided:
+            if i in rule_guesses:
+                classification = batched.get(i) or self.classify_email(email)
+                classifications[i] = self._compare_with_rules(rule_guesses[i], classification)
+            elif i in batched:
+                classifications[i] = batched[i]
+        return classifications
+
+    async def _compare_with_rules(self, rule_type: str, classification) -> tuple[str, dict]:
+        """Väntar in LLM:ens klassificering och noterar om reglerna gissade annorlunda."""
+        mail_type, data = await classification
+        if not data.get("failed"):
+            self.rules.record_llm_result(rule_type, mail_type)
+        return mail_type, data
+
+    def _start_batch_classification(self, items: list) -> dict:
+        """Startar batch-klassificering i bakgrunden om --batch-size > 1.
+
+        Args:
+            items: Lista med (mailindex, mail)
+
+        Returnerar {mailindex: awaitable (typ, data)} så att varje mail kan
+        hanteras så fort dess egen batch är klar.
+        """
+        if self.batch_size <= 1:
+            return {}
+
+        # Egen semafor: hanteringen håller sin semafor medan den väntar på
+        # klassificeringen, så en gemensam semafor skulle kunna låsa sig.
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def classify_chunk(chunk: list):
+            async with semaphore:
+                return await self.classify_batch(chunk)
+
+        async def pick(task, position: int):
+            return (await task)[position]
+
+        classifications = {}
+        for start in range(0, len(items), self.batch_size):
+            chunk = items[start:start + self.batch_size]
+            task = asyncio.ensure_future(classify_chunk([email for _, email in chunk]))
+            for position, (i, _) in enumerate(chunk):
+                classifications[i] = pick(task, position)
+        return classifications
+
+
+def _handler_call(email: dict, mail_type: str, data: dict) -> tuple[str, dict] | None:
+    """Vilket handler-verktyg (och argument) som hanterar ett klassificerat mail, None för other."""
+    args = {
+        "from_email": email['from'],
+        "subject": email['subject']
+    }
+    if mail_type == "support":
+        args["body"] = email['body']
+        return "handle_support_email", args
+    if mail_type == "sales":
+        product = data.get("product", "produkt")
+        args["product_query"] = product if product else "produkt"
+        return "handle_sales_email", args
+    if mail_type == "estimate":
+        args["project_description"] = data.get("project_description", email['body'])
+        return "handle_estimate_email", args
+    if mail_type == "meeting":
+        meeting_time = data.get("meeting_time")
+        if meeting_time:
+            args["meeting_time"] = meeting_time
+        return "handle_meeting_email", args
+    return None
+
+
+def _bulk_item(email: dict, mail_type: str, data: dict) -> dict:
+    """Ett klassificerat mail i formatet som handle_emails_bulk tar emot."""
+    item = {
+        "from": email['from'],
+        "subject": email['subject'],
+        "body": email['body'],
+        "type": mail_type,
+        "high_priority": bool(data.get("high_priority", False)),
+    }
+    if 'id' in email:
+        item["id"] = email['id']
+    handler = _handler_call(email, mail_type, data)
+    if handler is not None:
+        _, args = handler
+        for key in ("product_query", "project_description", "meeting_time"):
+            if key in args:
+                item[key] = args[key]
+    return item
+
+
+@asynccontextmanager
+async def connect_to_server():
+    """Startar server.py som subprocess och öppnar en initierad MCP-session."""
     server_params = StdioServerParameters(
         command="python",
         args=["server.py"],
@@ -219,9 +812,106 @@ async def run_once():
             tools_response = await session.list_tools()
             print(f"MCP-server ansluten ({len(tools_response.tools)} verktyg)")
 
-            # Kör agenten
-            agent = MailAgent(session)
-            await agent.run()
+            yield session
+
+
+async def run_once(**agent_options):
+    """Kör agenten en gång."""
+    async with connect_to_server() as session:
+        agent = MailAgent(session, **agent_options)
+        await agent.run()
+
+
+async def run_daemon(interval_minutes: int, watch: bool = False, **agent_options):
+    """Kör agenten kontinuerligt mot en och samma, varm, MCP-server.
+
+    Servern (och dess GmailClient) startas en gång och återanvänds mellan
+    körningarna. Före varje körning pingas servern; om den har dött eller
+    anslutningen bryts startas en ny med exponentiell backoff.
+
+    Med watch=True körs agenten när servern meddelar nya mail i stället för
+    med fast intervall (se watch_for_mail).
+    """
+    backoff = RECONNECT_BACKOFF_MIN
+
+    while True:
+        try:
+            async with connect_to_server() as session:
+                backoff = RECONNECT_BACKOFF_MIN
+                agent = MailAgent(session, **agent_options)
+                if watch:
+                    await watch_for_mail(session, agent)
+
+                while True:
+                    await session.send_ping()
+
+                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    print(f"\n[{timestamp}] Kollar mail...")
+                    await agent.run()
+
+                    print(f"\nVäntar {interval_minutes} minuter till nästa körning...")
+                    await asyncio.sleep(interval_minutes * 60)
+
+        except Exception as e:
+            print(f"\nAnslutningen till MCP-servern bröts ({type(e).__name__}: {e})")
+            print(f"Startar om servern om {backoff:.0f} s...")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+
+async def watch_for_mail(session, agent: MailAgent):
+    """Händelsestyrd loop: hanterar mail så fort servern meddelar att de kommit.
+
+    Utan push på servern pollas inkorgen i stället, var WATCH_POLL_MIN
+    sekund efter hanterade mail och sedan med dubbla intervallet för varje
+    tom koll, upp till WATCH_POLL_MAX.
+    """
+    push = True
+    interval = WATCH_POLL_MIN
+
+    while True:
+        await session.send_ping()
+
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print(f"\n[{timestamp}] Kollar mail...")
+        handled = await agent.run()
+
+        if push:
+            print(f"\nVäntar på nya mail (push, max {WATCH_TIMEOUT} s)...")
+            push, new_mail = await agent.wait_for_new_mail(WATCH_TIMEOUT)
+            if push:
+                if not new_mail:
+                    print("Ingen notis, kollar inkorgen ändå")
+                continue
+            print("Servern har inte push konfigurerat, pollar i stället")
+
+        interval = WATCH_POLL_MIN if handled else min(interval * 2, WATCH_POLL_MAX)
+        print(f"\nNästa koll om {interval:.0f} s...")
+        await asyncio.sleep(interval)
+
+
+async def evaluate_rules():
+    """Jämför reglerna med LLM:en och facit på LABELED_INBOX (ingen MCP-server behövs)."""
+    agent = MailAgent(session=None)
+    report = evaluate(agent.rules, LABELED_INBOX)
+    llm_types = [mail_type for mail_type, _ in
+                 await asyncio.gather(*(agent.classify_email(email) for email, _ in LABELED_INBOX))]
+
+    print(f"{'Ämne':<40} {'Facit':<9} {'Regler':<16} {'LLM':<9}")
+    for (email, expected), llm_type in zip(LABELED_INBOX, llm_types):
+        mail_type, _, confidence = agent.rules.classify(email)
+        print(f"{email['subject'][:40]:<40} {expected:<9} {mail_type + f' ({confidence:.2f})':<16} {llm_type:<9}")
+
+    total = len(LABELED_INBOX)
+    llm_correct = sum(llm_type == expected for (_, expected), llm_type in zip(LABELED_INBOX, llm_types))
+    disagreements = sum(agent.rules.classify(email)[0] != llm_type
+                        for (email, _), llm_type in zip(LABELED_INBOX, llm_types))
+    print(f"\nRegler: {report['coverage']:.0%} avgörs utan LLM (tröskel {agent.rules.threshold}), "
+          f"{report['accuracy_decided']:.0%} rätt av dessa, {report['accuracy_total']:.0%} rätt totalt")
+    print(f"LLM: {llm_correct / total:.0%} rätt")
+    print(f"Regler och LLM oense i {disagreements}/{total} fall")
+    for subject, expected, mail_type in report['mistakes']:
+        print(f"  Felklassad av reglerna: {subject} (facit {expected}, regler {mail_type})")
 
 
 async def main():
@@ -229,28 +919,58 @@ async def main():
     parser = argparse.ArgumentParser(description="MCP Mail Agent")
     parser.add_argument("--loop", nargs="?", const=5, type=int, metavar="MINUTER",
                         help="Kör kontinuerligt (standard: var 5:e minut)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Kör kontinuerligt och hantera mail direkt när de kommer (push, annars adaptiv polling)")
+    parser.add_argument("--concurrency", type=int, default=1, metavar="N",
+                        help="Antal mail som hanteras samtidigt (standard: 1)")
+    parser.add_argument("--batch-size", type=int, default=1, metavar="K",
+                        help="Klassificera K mail per LLM-anrop (standard: 1)")
+    parser.add_argument("--page-size", type=int, default=0, metavar="N",
+                        help="Hämta inkorgen N mail i taget (nästa sida hämtas medan en hanteras)")
+    parser.add_argument("--bulk", action="store_true",
+                        help=f"Hantera mailen med handle_emails_bulk ({BULK_SIZE} mail per verktygsanrop)")
+    parser.add_argument("--ack-after", action="store_true",
+                        help="Markera mail som lästa först när de hanterats")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Skriv ut latens per steg (klient och server) efter varje körning")
+    parser.add_argument("--no-rules", action="store_true",
+                        help="Klassificera alla mail med LLM (ingen regelbaserad förklassificering)")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Hantera även dubbletter (ingen sammanvikning av samma mail från samma avsändare)")
+    parser.add_argument("--evaluate-rules", action="store_true",
+                        help="Jämför reglerna med LLM:en på ett facit och avsluta")
     args = parser.parse_args()
 
-    if args.loop:
+    if args.evaluate_rules:
+        await evaluate_rules()
+        return
+
+    agent_options = {
+        "concurrency": args.concurrency,
+        "batch_size": args.batch_size,
+        "ack_after": args.ack_after,
+        "use_rules": not args.no_rules,
+        "bulk": args.bulk,
+        "page_size": args.page_size,
+        "show_metrics": args.metrics,
+        "dedup": not args.no_dedup,
+    }
+
+    if args.watch:
+        print("Startar i watch-läge (väntar på nya mail)")
+        print("Tryck Ctrl+C för att avsluta\n")
+        await run_daemon(0, watch=True, **agent_options)
+    elif args.loop:
         interval_minutes = args.loop
         print(f"Startar i loop-läge (var {interval_minutes}:e minut)")
         print("Tryck Ctrl+C för att avsluta\n")
-
-        while True:
-            try:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                print(f"\n[{timestamp}] Kollar mail...")
-                await run_once()
-
-                print(f"\nVäntar {interval_minutes} minuter till nästa körning...")
-                await asyncio.sleep(interval_minutes * 60)
-
-            except KeyboardInterrupt:
-                print("\n\nAvslutar...")
-                break
+        await run_daemon(interval_minutes, **agent_options)
     else:
-        await run_once()
+        await run_once(**agent_options)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n\nAvslutar...")
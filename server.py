@@ -2,43 +2,172 @@
 MCP Server för Bengtssons Trävaror - E-posthantering.
 
 Denna server exponerar verktyg för att hantera inkommande mail:
-- Hämta e-post
+- Hämta e-post (allt på en gång eller sida för sida)
 - Hantera supportärenden
 - Hantera försäljningsförfrågningar
 - Hantera materialberäkningar
 - Hantera mötesförfrågningar
+- Hantera många klassificerade mail i ett anrop
+- Vänta på nya mail (push via IMAP IDLE eller Gmail Pub/Sub)
 """
 
 import os
 import json
-from mcp.server.fastmcp import FastMCP
-
-from core.autoresponder import GmailClient
+import uuid
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict
+from mcp.server.fastmcp import FastMCP, Context
+from mcp.server.fastmcp.exceptions import ToolError
+
+from core.transport import create_transport, MAIL_TRANSPORT
+from core.push import PushReceiver, get_notifier, PUSH_WEBHOOK_PORT
 from core.products import PRODUCTS
+from core.search import search_products
+from core.pricing import quote as quote_bom, format_quote
 from core.test_data import FAKE_INBOX
-from core.conversations import add_message, format_history_for_prompt
+from core.conversations import add_message, format_history_for_prompt, cache_stats
+from core.llm_cache import get_llm_cache
+from core.outbox import Outbox
+from core.metrics import get_metrics, timed
 
 # Konfiguration via miljövariabler
 SEND_EMAILS = os.environ.get("SEND_REAL_EMAILS", "false").lower() == "true"
 USE_GMAIL = os.environ.get("USE_GMAIL", "false").lower() == "true"
 MANAGER_EMAIL = os.environ.get("MANAGER_EMAIL", "")
+# Max antal olästa mail per hämtning (0 = alla)
+GMAIL_MAX_RESULTS = int(os.environ.get("GMAIL_MAX_RESULTS", "100"))
+# Hämta bara mail som tillkommit sedan förra synken (Gmail history-API)
+GMAIL_INCREMENTAL_SYNC = os.environ.get("GMAIL_INCREMENTAL_SYNC", "true").lower() == "true"
+# Max väntetid (sekunder) för ett anrop till wait_for_new_mail
+WAIT_MAX_SECONDS = 1800
+# list_unread_emails: max antal mail per sida och antal pågående hämtningar som sparas
+PAGE_SIZE_MAX = 500
+PAGE_SNAPSHOTS_MAX = 16
+# Testdata: max antal hämtade testmail som sparas för get_email_body (äldst används tas bort först)
+FAKE_MESSAGES_MAX = 1000
+# Max antal mail som handle_emails_bulk hanterar samtidigt
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", "8"))
 
 # Skapa MCP-server
 mcp = FastMCP("bengtssons-travaror")
 
 # Initiera system
 _fake_inbox = FAKE_INBOX.copy()  # Kopia som töms vid hämtning
+_fake_inbox_lock = threading.Lock()  # Webhookens tråd lägger till testmail medan verktygen tömmer
+_fake_ids = itertools.count(1)
+# id -> testmail som hämtats men inte kvitterats (för get_email_body), högst FAKE_MESSAGES_MAX
+_fake_messages = OrderedDict()
+
+# Sidindelad hämtning: olästa mail (id och headers) per pågående hämtning, äldst först
+_snapshots = OrderedDict()
+_snapshots_lock = threading.Lock()
 
-# Lazy-loading för Gmail API
+# Lazy-loading av mailtransporten, Gmail API eller IMAP/SMTP enligt MAIL_TRANSPORT
+# (låst, eftersom utkorgens trådar också hämtar klienten)
 _gmail_client = None
+_gmail_lock = threading.Lock()
 
 def get_gmail_client():
     global _gmail_client
     if _gmail_client is None:
-        _gmail_client = GmailClient()
+        with _gmail_lock:
+            if _gmail_client is None:
+                _gmail_client = create_transport()
     return _gmail_client
 
 
+# Utkorg: svaren skickas i bakgrunden så att verktygen kan returnera direkt
+# (låst, så att samtidiga verktygsanrop inte startar två utkorgar)
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def get_outbox() -> Outbox:
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                outbox = create_outbox()
+                outbox.start()
+                _outbox = outbox
+    return _outbox
+
+
+def create_outbox(**kwargs) -> Outbox:
+    """Skapar en utkorg som skickar via mailtransporten och sparar svar i historiken när de skickats."""
+    return Outbox(lambda to, subject, body: get_gmail_client().send_email(to, subject, body),
+                  on_sent=_on_sent, **kwargs)
+
+
+def _on_sent(to: str, subject: str, body: str, tag: str):
+    """Anropas av utkorgen när ett mail har skickats."""
+    if tag == "history":
+        add_message(to, "agent", body, subject)
+
+
+def _deliver(to: str, subject: str, body: str, history: bool = False) -> int:
+    """Lägger ett mail i utkorgen (sparas på disk, skickas i bakgrunden med omförsök).
+
+    Args:
+        history: Spara mailet i mottagarens historik när det har skickats
+    """
+    return get_outbox().enqueue(to, subject, body, tag="history" if history else None)
+
+
+def _unread_snapshot() -> list:
+    """Olästa mail utan fulltext (id, from, subject), för en ny sidindelad hämtning."""
+    if USE_GMAIL:
+        gmail = get_gmail_client()
+        if GMAIL_INCREMENTAL_SYNC:
+            emails = gmail.sync_unread_emails(max_results=GMAIL_MAX_RESULTS or None, format='metadata')
+        else:
+            emails = gmail.get_unread_emails(max_results=GMAIL_MAX_RESULTS or None, format='metadata')
+        return [{"id": e["id"], "from": e["from"], "subject": e["subject"]} for e in emails]
+
+    # Testdata: ge mailen id:n så att texten kan hämtas med get_email_body
+    emails = []
+    for email in _take_fake_inbox():
+        email = {"id": f"test-{next(_fake_ids)}", **email}
+        _fake_messages[email["id"]] = email
+        emails.append(email)
+    while len(_fake_messages) > FAKE_MESSAGES_MAX:
+        _fake_messages.popitem(last=False)
+    return emails
+
+
+def _fetch_page(page: list) -> list:
+    """Hämtar hela mailen för en sida (ett batch-anrop i stället för ett per mail)."""
+    if USE_GMAIL:
+        return get_gmail_client().get_emails([e["id"] for e in page], 'full')
+    return [_fake_messages[e["id"]] for e in page if e["id"] in _fake_messages]
+
+
+def _take_fake_inbox() -> list:
+    """Tömmer testinkorgen och returnerar mailen. Byter listan under låset, så att inget testmail tappas."""
+    global _fake_inbox
+    with _fake_inbox_lock:
+        emails, _fake_inbox = _fake_inbox, []
+    return emails
+
+
+def _add_test_mail(email: dict):
+    """Lägger ett testmail från webhooken sist i testinkorgen."""
+    with _fake_inbox_lock:
+        _fake_inbox.append(email)
+
+
+# Webhook för push-notiser (Gmail via Pub/Sub, testmail med testdata), startas om PUSH_WEBHOOK_PORT är satt
+_push_receiver = None
+
+def start_push_receiver() -> PushReceiver | None:
+    global _push_receiver
+    if _push_receiver is None and PUSH_WEBHOOK_PORT:
+        _push_receiver = PushReceiver(get_notifier(), on_test_mail=None if USE_GMAIL else _add_test_mail)
+        _push_receiver.start()
+    return _push_receiver
+
+
 # ==================== RESOURCES ====================
 
 @mcp.resource("products://catalog")
@@ -51,103 +180,78 @@ def get_product_catalog() -> str:
     return "\n".join(catalog_lines)
 
 
-# ==================== TOOLS ====================
+@mcp.resource("conversations://cache-stats")
+def get_history_cache_stats() -> str:
+    """Returnerar träff/miss-statistik för konversationshistorikens cache."""
+    return json.dumps(cache_stats(), ensure_ascii=False)
 
-@mcp.tool()
-def get_unread_emails() -> str:
-    """
-    Hämtar olästa e-postmeddelanden från inkorgen.
-
-    Returnerar en lista med e-post i JSON-format med fälten:
-    - from: avsändarens e-postadress
-    - subject: ämnesrad
-    - body: meddelandetext
 
-    Använder Gmail API om USE_GMAIL=true, annars testdata.
-    """
-    global _fake_inbox
+@mcp.resource("outbox://status")
+def get_outbox_status() -> str:
+    """Returnerar antal mail i utkorgen per status (pending/sent/failed)."""
+    if not SEND_EMAILS:
+        return json.dumps({"enabled": False}, ensure_ascii=False)
+    return json.dumps(get_outbox().stats(), ensure_ascii=False)
 
-    if USE_GMAIL:
-        gmail = get_gmail_client()
-        emails = gmail.get_unread_emails()
-        # Markera som lästa
-        for email in emails:
-            if 'id' in email:
-                gmail.mark_as_read(email['id'])
-    else:
-        emails = _fake_inbox.copy()
-        _fake_inbox.clear()
 
-    if not emails:
-        return json.dumps({"message": "Inga nya mail"}, ensure_ascii=False)
-    return json.dumps(emails, ensure_ascii=False, indent=2)
+@mcp.resource("llm://cache-stats")
+def get_llm_cache_stats() -> str:
+    """Returnerar träffandel och sparade tokens för LLM-cachen."""
+    cache = get_llm_cache()
+    stats = cache.stats() if cache is not None else {"enabled": False}
+    return json.dumps(stats, ensure_ascii=False)
 
 
-@mcp.tool()
-def handle_support_email(from_email: str, subject: str, body: str) -> str:
-    """
-    Hanterar ett supportärende/klagomål komplett:
-    1. Sparar kundens meddelande i historik
-    2. Genererar AI-svar (med konversationshistorik)
-    3. Skickar svar till kunden
+# ==================== HANDLERS ====================
+# Kärnan i varje handler: tar fram svaret men skickar det inte. Används av
+# de enskilda verktygen och av handle_emails_bulk. Ett svar är en dict med
+# to, subject, body och summary (resultattext), samt valfritt note (läggs
+# sist i resultatet), queued (text när mailet köats) och history (spara
+# svaret i kundens konversationshistorik).
 
-    Returns:
-        Bekräftelse på vad som gjordes
-    """
+@timed("handler_seconds", type="support")
+async def _support_reply(from_email: str, subject: str, body: str, on_progress=None) -> dict:
+    """Sparar kundens meddelande och genererar ett AI-svar med konversationshistorik."""
     from core.agents import ComplaintAgent
 
-    # 1. Spara kundens meddelande i historik
-    add_message(from_email, "customer", body, subject)
+    # 1. Spara kundens meddelande i historik (SQLite blockerar, kör i en tråd
+    #    så att andra verktygsanrop och förloppsnotifieringar inte står still)
+    await asyncio.to_thread(add_message, from_email, "customer", body, subject)
 
     # 2. Hämta tidigare konversation och generera svar
     email = {"from": from_email, "subject": subject, "body": body}
-    history = format_history_for_prompt(from_email)
+    history = await asyncio.to_thread(format_history_for_prompt, from_email)
     agent = ComplaintAgent()
-    response_body = agent.write_response_to_complaint(email, history)
-
-    # 3. Skicka svar (om aktiverat)
-    if SEND_EMAILS:
-        try:
-            gmail = get_gmail_client()
-            gmail._send_email(from_email, f"Re: {subject}", response_body)
-            # Spara vårt svar i historik
-            add_message(from_email, "agent", response_body, f"Re: {subject}")
-            return f"Supportärende hanterat för {from_email}: Ärende skapat + svar skickat"
-        except Exception as e:
-            return f"Supportärende skapat men kunde inte skicka svar: {e}"
-    else:
-        # Spara även i dry-run för testning
-        add_message(from_email, "agent", response_body, f"Re: {subject}")
-        return f"[DRY-RUN] Supportärende hanterat för {from_email}: Ärende skapat (mail EJ skickat)"
 
+    response_body = await agent.stream_response_to_complaint(email, history, on_progress=on_progress)
+    stats = agent.last_stream_stats
 
-@mcp.tool()
-def handle_sales_email(from_email: str, subject: str, product_query: str) -> str:
-    """
-    Hanterar en försäljningsförfrågan komplett:
-    1. Söker efter produkter
-    2. Formaterar snyggt svar
-    3. Skickar svar till kunden
+    return {
+        "to": from_email,
+        "subject": f"Re: {subject}",
+        "body": response_body,
+        "summary": f"Supportärende hanterat för {from_email}: Ärende skapat",
+        "note": f" (första token {stats['ttft']:.2f} s, totalt {stats['total']:.2f} s)",
+        "history": True,
+    }
 
-    Args:
-        product_query: Sökterm för produkter (t.ex. "plywood", "regel")
 
-    Returns:
-        Bekräftelse på vad som gjordes
-    """
-    # 1. Sök produkter
-    query_normalized = product_query.lower().replace(" ", "_")
+@timed("handler_seconds", type="sales")
+def _sales_reply(from_email: str, subject: str, product_query: str) -> dict:
+    """Söker produkter och formaterar ett svar med sortimentet."""
+    # 1. Sök produkter (förbyggt index, bästa träff först)
     matches = []
 
-    for name, (price, dimension) in PRODUCTS.items():
-        name_lower = name.lower()
-        if query_normalized in name_lower or product_query.lower().replace("_", " ") in name_lower.replace("_", " "):
-            dim_str = f"{dimension} m/kvm" if dimension else "styck"
-            matches.append({
-                "name": name,
-                "price": price,
-                "dimension": dim_str
-            })
+    for name in search_products(product_query):
+        if name not in PRODUCTS:
+            continue  # Borttagen ur katalogen sedan sökningen
+        price, dimension = PRODUCTS[name]
+        dim_str = f"{dimension} m/kvm" if dimension else "styck"
+        matches.append({
+            "name": name,
+            "price": price,
+            "dimension": dim_str
+        })
 
     # 2. Formatera svar
     if matches:
@@ -171,31 +275,20 @@ Kontakta oss gärna för offert!
 Vänliga hälsningar,
 Bengtssons Trävaror"""
 
-    # 3. Skicka svar (om aktiverat)
-    if SEND_EMAILS:
-        try:
-            gmail = get_gmail_client()
-            gmail._send_email(from_email, f"Re: {subject}", response_body)
-            return f"Försäljningsförfrågan hanterad för {from_email}: {len(matches)} produkter hittades, svar skickat"
-        except Exception as e:
-            return f"Kunde inte skicka svar: {e}"
-    else:
-        return f"[DRY-RUN] Försäljningsförfrågan hanterad för {from_email}: {len(matches)} produkter (mail EJ skickat)"
+    return {
+        "to": from_email,
+        "subject": f"Re: {subject}",
+        "body": response_body,
+        "summary": f"Försäljningsförfrågan hanterad för {from_email}: {len(matches)} produkter hittades",
+    }
 
 
-@mcp.tool()
-def handle_estimate_email(from_email: str, subject: str, project_description: str) -> str:
-    """
-    Hanterar en materialberäkningsförfrågan komplett:
-    1. Beräknar materialbehov med AI
-    2. Formaterar snyggt svar
-    3. Skickar svar till kunden
-
-    Args:
-        project_description: Beskrivning av projektet (t.ex. "garage 40 kvm")
+@timed("handler_seconds", type="estimate")
+def _estimate_reply(from_email: str, subject: str, project_description: str) -> dict:
+    """Beräknar material och priser och formaterar en uppskattning.
 
-    Returns:
-        Bekräftelse på vad som gjordes
+    Raises:
+        ValueError: Om materialet inte gick att beräkna
     """
     from core.agents import SalesAgent
 
@@ -204,36 +297,20 @@ def handle_estimate_email(from_email: str, subject: str, project_description: st
     estimated = agent.estimate_materials_json(project_description)
 
     if not estimated:
-        return f"Kunde inte beräkna material för: {project_description}"
+        raise ValueError(f"Kunde inte beräkna material för: {project_description}")
 
     # 2. Beräkna priser och formatera per kategori
-    total = 0
-    lines = ["Här är vår uppskattning av materialbehov:\n"]
-
-    for category, products in estimated.items():
-        # Hantera både ny grupperad struktur och gammal platt struktur
-        if isinstance(products, dict):
-            lines.append(f"\n📦 {category}:")
-            for product, qty in products.items():
-                if product in PRODUCTS:
-                    price = PRODUCTS[product][0]
-                    line_total = price * qty
-                    total += line_total
-                    name = product.replace('_', ' ')
-                    lines.append(f"   • {name}: {qty} st à {price} kr = {line_total} kr")
-        else:
-            # Fallback för gammal platt struktur
-            product, qty = category, products
-            if product in PRODUCTS:
-                price = PRODUCTS[product][0]
-                line_total = price * qty
-                total += line_total
-                name = product.replace('_', ' ')
-                lines.append(f"• {name}: {qty} st à {price} kr = {line_total} kr")
-
-    lines.append(f"\n💰 Uppskattad totalkostnad: {total} kr")
+    quote = quote_bom(estimated)
+    lines = ["Här är vår uppskattning av materialbehov:\n"] + format_quote(quote)
     lines.append("\nVill du att vi tar fram en officiell offert?")
 
+    # Okända produkter (från AI-beräkningen) rapporteras till klienten, inte till kunden
+    unmatched = ""
+    if quote["unmatched"]:
+        unmatched = "; okända produkter: " + ", ".join(
+            f"{item['sku']} (förslag: {', '.join(item['suggestions']) or 'inga'})" for item in quote["unmatched"]
+        )
+
     response_body = f"""Hej!
 
 Tack för din förfrågan.
@@ -243,31 +320,19 @@ Tack för din förfrågan.
 Vänliga hälsningar,
 Bengtssons Trävaror"""
 
-    # 3. Skicka svar (om aktiverat)
-    if SEND_EMAILS:
-        try:
-            gmail = get_gmail_client()
-            gmail._send_email(from_email, f"Re: {subject}", response_body)
-            return f"Materialberäkning hanterad för {from_email}: {len(estimated)} produkter beräknade, totalt {total} kr, svar skickat"
-        except Exception as e:
-            return f"Kunde inte skicka svar: {e}"
-    else:
-        return f"[DRY-RUN] Materialberäkning hanterad för {from_email}: {len(estimated)} produkter, totalt {total} kr (mail EJ skickat)"
-
-
-@mcp.tool()
-def handle_meeting_email(from_email: str, subject: str, meeting_time: str = None) -> str:
-    """
-    Hanterar en mötesförfrågan komplett:
-    1. Noterar önskad tid (om angiven)
-    2. Skickar bekräftelse till kunden
+    return {
+        "to": from_email,
+        "subject": f"Re: {subject}",
+        "body": response_body,
+        "summary": f"Materialberäkning hanterad för {from_email}: "
+                   f"{quote['line_count']} produkter beräknade, totalt {quote['total']} kr",
+        "note": unmatched,
+    }
 
-    Args:
-        meeting_time: Önskad mötestid (ISO-format) eller None om ej angiven
 
-    Returns:
-        Bekräftelse på vad som gjordes
-    """
+@timed("handler_seconds", type="meeting")
+def _meeting_reply(from_email: str, subject: str, meeting_time: str = None) -> dict:
+    """Formaterar en bekräftelse på en mötesförfrågan."""
     if meeting_time:
         response_body = f"""Hej!
 
@@ -279,8 +344,8 @@ Vi återkommer med bekräftelse.
 
 Vänliga hälsningar,
 Bengtssons Trävaror"""
-                        
-        result = f"Mötesförfrågan hanterad för {from_email}: Tid noterad ({meeting_time}), bekräftelse skickad"
+
+        summary = f"Mötesförfrågan hanterad för {from_email}: Tid noterad ({meeting_time})"
     else:
         response_body = f"""Hej!
 
@@ -290,36 +355,26 @@ Vänligen ange önskad tid så återkommer vi.
 
 Vänliga hälsningar,
 Bengtssons Trävaror"""
-                    
-        result = f"Mötesförfrågan hanterad för {from_email}: Ingen tid angiven, svar skickat"
 
-    if SEND_EMAILS:
-        try:
-            gmail = get_gmail_client()
-            gmail._send_email(from_email, f"Re: {subject}", response_body)
-            return result
-        except Exception as e:
-            return f"Kunde inte skicka svar: {e}"
-    else:
-        return f"[DRY-RUN] {result.replace('skickad', '(mail EJ skickat)')}"
+        summary = f"Mötesförfrågan hanterad för {from_email}: Ingen tid angiven"
 
+    return {
+        "to": from_email,
+        "subject": f"Re: {subject}",
+        "body": response_body,
+        "summary": summary,
+    }
 
-@mcp.tool()
-def notify_manager(from_email: str, subject: str, body: str, email_type: str) -> str:
-    """
-    Skickar notifikation till chef om ett högprioriterat ärende.
 
-    Args:
-        from_email: Kundens e-postadress
-        subject: Ärendeämne
-        body: Meddelandetext
-        email_type: Typ av ärende (support/sales/estimate/meeting/other)
+@timed("handler_seconds", type="escalation")
+def _manager_notification(from_email: str, subject: str, body: str, email_type: str) -> dict:
+    """Formaterar en eskalering av ett högprioriterat ärende till chefen.
 
-    Returns:
-        Bekräftelse på om notifikation skickades
+    Raises:
+        ValueError: Om MANAGER_EMAIL inte är konfigurerad
     """
     if not MANAGER_EMAIL:
-        return "[VARNING] MANAGER_EMAIL ej konfigurerad - kunde inte eskalera"
+        raise ValueError("[VARNING] MANAGER_EMAIL ej konfigurerad - kunde inte eskalera")
 
     notification_body = f"""HÖGPRIORITERAT ÄRENDE
 
@@ -336,22 +391,459 @@ Vänligen granska och vidta lämplig åtgärd.
 
 / Bengtssons Trävaror - Automatisk notifikation"""
 
+    return {
+        "to": MANAGER_EMAIL,
+        "subject": f"Hög prioritet: {subject}",
+        "body": notification_body,
+        "summary": f"Eskalering till {MANAGER_EMAIL}",
+        "queued": "köad för utskick",
+    }
+
+
+def _finish(reply: dict) -> str:
+    """Köar svaret (om SEND_REAL_EMAILS) och returnerar resultattexten.
+
+    Svaret sparas i historiken först när utkorgen har skickat det (se
+    _on_sent), så att ett mail som aldrig går fram inte hamnar där. I
+    dry-run sparas det direkt, för testning.
+
+    Raises:
+        Exception: Om svaret inte kunde köas
+    """
+    if SEND_EMAILS:
+        _deliver(reply["to"], reply["subject"], reply["body"], history=bool(reply.get("history")))
+    elif reply.get("history"):
+        add_message(reply["to"], "agent", reply["body"], reply["subject"])
+
+    note = reply.get("note", "")
     if SEND_EMAILS:
-        try:
-            gmail = get_gmail_client()
-            gmail._send_email(
-                MANAGER_EMAIL,
-                f"Hög prioritet: {subject}",
-                notification_body
-            )
-            return f"Eskalering skickad till {MANAGER_EMAIL}"
-        except Exception as e:
-            return f"Kunde inte skicka eskalering: {e}"
+        return f"{reply['summary']}, {reply.get('queued', 'svar köat för utskick')}{note}"
+    return f"[DRY-RUN] {reply['summary']} (mail EJ skickat){note}"
+
+
+async def _bulk_reply(email: dict) -> dict | None:
+    """Tar fram svaret för ett mail i handle_emails_bulk (None för typen other)."""
+    missing = {"from", "subject", "body"} - email.keys()
+    if missing:
+        raise ValueError(f"saknar fält: {', '.join(sorted(missing))}")
+
+    from_email, subject, body = email["from"], email["subject"], email["body"]
+    mail_type = email.get("type", "other")
+
+    # Högprioriterade ärenden eskaleras till chefen i stället för att besvaras
+    if email.get("high_priority"):
+        return await asyncio.to_thread(_manager_notification, from_email, subject, body, mail_type)
+    if mail_type == "support":
+        return await _support_reply(from_email, subject, body)
+    if mail_type == "sales":
+        return await asyncio.to_thread(_sales_reply, from_email, subject, email.get("product_query") or "produkt")
+    if mail_type == "estimate":
+        return await asyncio.to_thread(_estimate_reply, from_email, subject, email.get("project_description") or body)
+    if mail_type == "meeting":
+        return _meeting_reply(from_email, subject, email.get("meeting_time"))
+    if mail_type == "other":
+        return None
+    raise ValueError(f"okänd typ: {mail_type}")
+
+
+async def _handle_bulk_item(index: int, email: dict) -> dict:
+    """Hanterar ett mail i handle_emails_bulk. Fel fångas och rapporteras per mail."""
+    item = {"index": index, "id": email.get("id"), "from": email.get("from"), "type": email.get("type", "other")}
+    try:
+        reply = await _bulk_reply(email)
+        result = await asyncio.to_thread(_finish, reply) if reply else "Ingen åtgärd för typen other"
+    except Exception as e:
+        # ValueError har redan ett begripligt meddelande (saknade fält, okänd typ, ...)
+        item.update(ok=False, error=str(e) if isinstance(e, ValueError) else f"{type(e).__name__}: {e}")
     else:
-        return f"[DRY-RUN] Eskalering till {MANAGER_EMAIL} (mail EJ skickat)"
+        item.update(ok=True, result=result)
+    return item
+
+
+@mcp.resource("metrics://server")
+def get_server_metrics() -> str:
+    """Returnerar latens (antal, snitt, p50/p95/p99, max) och räknare per mätpunkt (JSON)."""
+    return json.dumps(get_metrics().snapshot(), ensure_ascii=False)
+
+
+@mcp.resource("metrics://prometheus")
+def get_prometheus_metrics() -> str:
+    """Returnerar alla mätvärden i Prometheus textformat."""
+    return get_metrics().prometheus()
+
+
+# ==================== TOOLS ====================
+# Handler-verktygen som inte kunde hantera ett mail (svaret gick inte att
+# köa, materialet gick inte att beräkna, ...) kastar ToolError. Svaret får
+# då isError=true, och klienten lämnar mailet oläst i stället för att
+# kvittera det (--ack-after).
+
+@mcp.tool()
+@timed("tool_seconds", tool="get_unread_emails")
+def get_unread_emails(mark_as_read: bool = True) -> str:
+    """
+    Hämtar olästa e-postmeddelanden från inkorgen.
+
+    Returnerar en lista med e-post i JSON-format med fälten:
+    - id: meddelande-id (endast Gmail)
+    - from: avsändarens e-postadress
+    - subject: ämnesrad
+    - body: meddelandetext
+    - date: ankomsttid i ISO-format (endast Gmail/IMAP)
+
+    Använder Gmail API om USE_GMAIL=true, annars testdata.
+
+    Args:
+        mark_as_read: Markera mailen som lästa direkt. Sätt till false och
+            anropa mark_emails_read efter hanteringen för att inte tappa
+            mail om klienten kraschar mitt i en körning.
+    """
+    if USE_GMAIL:
+        gmail = get_gmail_client()
+        if GMAIL_INCREMENTAL_SYNC:
+            emails = gmail.sync_unread_emails(max_results=GMAIL_MAX_RESULTS or None)
+        else:
+            emails = gmail.get_unread_emails(max_results=GMAIL_MAX_RESULTS or None)
+        # Markera som lästa (ett batchModify-anrop i stället för ett per mail)
+        if mark_as_read:
+            gmail.mark_as_read_bulk([email['id'] for email in emails if 'id' in email])
+    else:
+        emails = _take_fake_inbox()
+
+    if not emails:
+        return json.dumps({"message": "Inga nya mail"}, ensure_ascii=False)
+    # Kompakt JSON: ingen indentering som blåser upp stora inkorgar
+    return json.dumps(emails, ensure_ascii=False, separators=(",", ":"))
+
+
+@mcp.tool()
+@timed("tool_seconds", tool="list_unread_emails")
+def list_unread_emails(limit: int = 25, cursor: str = None, body_chars: int = 0,
+                       mark_as_read: bool = True) -> str:
+    """
+    Hämtar olästa e-postmeddelanden sida för sida, som kompakt JSON.
+
+    Första anropet (utan cursor) listar olästa mail (bara id och headers)
+    och returnerar första sidan. Nästa sida hämtas med next_cursor, och
+    texten hämtas först när mailets sida efterfrågas. Klienten kan alltså
+    hantera en sida medan nästa hämtas.
+
+    Args:
+        limit: Antal mail per sida (högst 500)
+        cursor: next_cursor från föregående sida, utelämnas för en ny hämtning
+        body_chars: Korta av texten till högst så många tecken (0 = hela
+            texten). Avkortade mail får "truncated": true och hela texten
+            hämtas vid behov med get_email_body.
+        mark_as_read: Markera sidans mail som lästa direkt (se get_unread_emails)
+
+    Returns:
+        JSON {"emails": [{"id", "from", "subject", "body", "truncated", "date"}],
+        "next_cursor": cursor för nästa sida eller null när inga fler finns}
+    """
+    limit = max(1, min(limit, PAGE_SIZE_MAX))
+
+    if cursor:
+        snapshot_id, _, offset = cursor.rpartition(":")
+        with _snapshots_lock:
+            pending = _snapshots.get(snapshot_id)
+        if pending is None or not offset.isdigit():
+            return json.dumps({"error": "Okänd eller utgången cursor, börja om utan cursor"}, ensure_ascii=False)
+        offset = int(offset)
+    else:
+        pending = _unread_snapshot()
+        snapshot_id, offset = uuid.uuid4().hex, 0
+        with _snapshots_lock:
+            _snapshots[snapshot_id] = pending
+            while len(_snapshots) > PAGE_SNAPSHOTS_MAX:
+                _snapshots.popitem(last=False)
+
+    page = pending[offset:offset + limit]
+    emails = _fetch_page(page)
+
+    next_offset = offset + len(page)
+    if next_offset < len(pending):
+        next_cursor = f"{snapshot_id}:{next_offset}"
+    else:
+        next_cursor = None
+        with _snapshots_lock:
+            _snapshots.pop(snapshot_id, None)
+
+    if mark_as_read and USE_GMAIL:
+        get_gmail_client().mark_as_read_bulk([email['id'] for email in emails])
+
+    page_emails = []
+    for email in emails:
+        body = email["body"]
+        truncated = 0 < body_chars < len(body)
+        page_emails.append({
+            "id": email["id"],
+            "from": email["from"],
+            "subject": email["subject"],
+            "body": body[:body_chars] if truncated else body,
+            "truncated": truncated,
+            "date": email.get("date"),
+        })
+    return json.dumps({"emails": page_emails, "next_cursor": next_cursor},
+                      ensure_ascii=False, separators=(",", ":"))
+
+
+@mcp.tool()
+@timed("tool_seconds", tool="get_email_body")
+def get_email_body(message_id: str) -> str:
+    """
+    Hämtar hela texten för ett mail, t.ex. ett som list_unread_emails
+    returnerade avkortat.
+
+    Args:
+        message_id: Id från list_unread_emails
+
+    Returns:
+        Mailets text
+    """
+    if USE_GMAIL:
+        emails = get_gmail_client().get_emails([message_id], 'full')
+        email = emails[0] if emails else None
+    else:
+        email = _fake_messages.get(message_id)
+        if email is not None:
+            _fake_messages.move_to_end(message_id)
+
+    if email is None:
+        return f"[FEL] Hittade inget mail med id {message_id}"
+    return email["body"]
+
+
+@mcp.tool()
+@timed("tool_seconds", tool="mark_emails_read")
+def mark_emails_read(message_ids: list[str]) -> str:
+    """
+    Markerar mail som lästa i ett bulk-anrop (Gmail batchModify).
+
+    Args:
+        message_ids: Id:n från get_unread_emails
+
+    Returns:
+        Bekräftelse på hur många mail som markerades
+    """
+    if not message_ids:
+        return "Inga mail att markera"
+
+    if USE_GMAIL:
+        get_gmail_client().mark_as_read_bulk(message_ids)
+        return f"{len(message_ids)} mail markerade som lästa"
+    for message_id in message_ids:
+        _fake_messages.pop(message_id, None)
+    return f"[TESTDATA] {len(message_ids)} mail kvitterade"
+
+
+@mcp.tool()
+async def wait_for_new_mail(timeout_seconds: int = 300) -> str:
+    """
+    Väntar tills nya mail har kommit, så att klienten slipper polla.
+
+    - IMAP (MAIL_TRANSPORT=imap): IMAP IDLE mot mailservern
+    - Gmail: push-notis från Pub/Sub till webhooken (kräver GMAIL_PUSH_TOPIC
+      och PUSH_WEBHOOK_PORT)
+    - Testdata: testmail som postas till webhooken (kräver PUSH_WEBHOOK_PORT)
+
+    Args:
+        timeout_seconds: Max väntetid i sekunder (högst 1800)
+
+    Returns:
+        JSON {"push": bool, "new_mail": bool}. push=false betyder att push
+        inte är konfigurerat och att klienten får polla i stället.
+    """
+    timeout = max(1, min(timeout_seconds, WAIT_MAX_SECONDS))
+
+    if USE_GMAIL:
+        transport = get_gmail_client()
+        # Gmail-notiserna kommer via webhooken, IMAP väntar direkt mot servern
+        if not transport.supports_push or (MAIL_TRANSPORT == "gmail" and start_push_receiver() is None):
+            return json.dumps({"push": False, "new_mail": False})
+        wait = transport.wait_for_new_mail
+    else:
+        if _fake_inbox:
+            return json.dumps({"push": True, "new_mail": True})
+        if start_push_receiver() is None:
+            return json.dumps({"push": False, "new_mail": False})
+        wait = get_notifier().wait
+
+    # Väntan blockerar, kör den i en tråd så att andra verktygsanrop kan hanteras under tiden
+    new_mail = await asyncio.to_thread(wait, timeout)
+    return json.dumps({"push": True, "new_mail": new_mail})
+
+
+@mcp.tool()
+@timed("tool_seconds", tool="handle_support_email")
+async def handle_support_email(from_email: str, subject: str, body: str, ctx: Context) -> str:
+    """
+    Hanterar ett supportärende/klagomål komplett:
+    1. Sparar kundens meddelande i historik
+    2. Genererar AI-svar (med konversationshistorik), strömmande med
+       förloppsnotifieringar till klienten medan svaret skrivs
+    3. Skickar svar till kunden
+
+    Returns:
+        Bekräftelse på vad som gjordes
+    """
+    async def on_progress(chars: int):
+        await ctx.report_progress(chars)
+
+    reply = await _support_reply(from_email, subject, body, on_progress=on_progress)
+    try:
+        return await asyncio.to_thread(_finish, reply)
+    except Exception as e:
+        raise ToolError(f"Supportärende skapat men kunde inte köa svar: {e}") from e
+
+
+@mcp.tool()
+@timed("tool_seconds", tool="handle_sales_email")
+def handle_sales_email(from_email: str, subject: str, product_query: str) -> str:
+    """
+    Hanterar en försäljningsförfrågan komplett:
+    1. Söker efter produkter
+    2. Formaterar snyggt svar
+    3. Skickar svar till kunden
+
+    Args:
+        product_query: Sökterm för produkter (t.ex. "plywood", "regel")
+
+    Returns:
+        Bekräftelse på vad som gjordes
+    """
+    reply = _sales_reply(from_email, subject, product_query)
+    try:
+        return _finish(reply)
+    except Exception as e:
+        raise ToolError(f"Kunde inte köa svar: {e}") from e
+
+
+@mcp.tool()
+@timed("tool_seconds", tool="handle_estimate_email")
+def handle_estimate_email(from_email: str, subject: str, project_description: str) -> str:
+    """
+    Hanterar en materialberäkningsförfrågan komplett:
+    1. Beräknar materialbehov lokalt (AI bara om beskrivningen inte går att tolka)
+    2. Formaterar snyggt svar
+    3. Skickar svar till kunden
+
+    Args:
+        project_description: Beskrivning av projektet (t.ex. "garage 40 kvm")
+
+    Returns:
+        Bekräftelse på vad som gjordes
+    """
+    try:
+        reply = _estimate_reply(from_email, subject, project_description)
+    except ValueError as e:
+        raise ToolError(str(e)) from e
+    try:
+        return _finish(reply)
+    except Exception as e:
+        raise ToolError(f"Kunde inte köa svar: {e}") from e
+
+
+@mcp.tool()
+@timed("tool_seconds", tool="handle_meeting_email")
+def handle_meeting_email(from_email: str, subject: str, meeting_time: str = None) -> str:
+    """
+    Hanterar en mötesförfrågan komplett:
+    1. Noterar önskad tid (om angiven)
+    2. Skickar bekräftelse till kunden
+
+    Args:
+        meeting_time: Önskad mötestid (ISO-format) eller None om ej angiven
+
+    Returns:
+        Bekräftelse på vad som gjordes
+    """
+    reply = _meeting_reply(from_email, subject, meeting_time)
+    try:
+        return _finish(reply)
+    except Exception as e:
+        raise ToolError(f"Kunde inte köa svar: {e}") from e
+
+
+@mcp.tool()
+@timed("tool_seconds", tool="notify_manager")
+def notify_manager(from_email: str, subject: str, body: str, email_type: str) -> str:
+    """
+    Skickar notifikation till chef om ett högprioriterat ärende.
+
+    Args:
+        from_email: Kundens e-postadress
+        subject: Ärendeämne
+        body: Meddelandetext
+        email_type: Typ av ärende (support/sales/estimate/meeting/other)
+
+    Returns:
+        Bekräftelse på att notifikationen köats
+    """
+    try:
+        reply = _manager_notification(from_email, subject, body, email_type)
+    except ValueError as e:
+        raise ToolError(str(e)) from e
+    try:
+        return _finish(reply)
+    except Exception as e:
+        raise ToolError(f"Kunde inte köa eskalering: {e}") from e
+
+
+@mcp.tool()
+@timed("tool_seconds", tool="handle_emails_bulk")
+async def handle_emails_bulk(emails: list[dict], ctx: Context) -> str:
+    """
+    Hanterar många redan klassificerade mail i ett enda anrop.
+
+    Mailen hanteras parallellt (upp till BULK_CONCURRENCY åt gången), men
+    mail från samma avsändare hanteras i listans ordning. Högprioriterade
+    mail eskaleras till chefen i stället för att besvaras. Ett mail som
+    misslyckas stoppar inte de övriga. Förloppet rapporteras som antal
+    färdiga mail.
+
+    Args:
+        emails: Lista med mail, var och ett med from, subject, body och
+            type (support/sales/estimate/meeting/other), samt valfritt id,
+            high_priority, product_query (sales), project_description
+            (estimate) och meeting_time (meeting)
+
+    Returns:
+        JSON {"total", "succeeded", "failed", "results"} där results har ett
+        objekt per mail i samma ordning: {"index", "id", "from", "type",
+        "ok", "result"} eller med "error" i stället för "result"
+    """
+    results = [None] * len(emails)
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    done = 0
+
+    by_sender = {}
+    for i, email in enumerate(emails):
+        by_sender.setdefault(email.get("from", ""), []).append(i)
+
+    async def handle_sender(indices: list):
+        nonlocal done
+        for i in indices:
+            async with semaphore:
+                results[i] = await _handle_bulk_item(i, emails[i])
+            done += 1
+            await ctx.report_progress(done, len(emails))
+
+    await asyncio.gather(*(handle_sender(indices) for indices in by_sender.values()))
+
+    failed = sum(not item["ok"] for item in results)
+    return json.dumps({
+        "total": len(results),
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "results": results,
+    }, ensure_ascii=False)
 
 
 # ==================== MAIN ====================
 
 if __name__ == "__main__":
+    if SEND_EMAILS:
+        # Skicka mail som inte hann skickas innan förra avstängningen
+        get_outbox()
+    start_push_receiver()
     mcp.run()
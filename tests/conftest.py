@@ -0,0 +1,10 @@
+"""Gemensam testkonfiguration: inga riktiga tjänster och inga tillståndsfiler i repot."""
+
+import os
+
+# Sätts före importen av core, som läser dem vid import
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ["LLM_CACHE"] = "false"
+os.environ["USE_GMAIL"] = "false"
+os.environ["SEND_REAL_EMAILS"] = "false"
+os.environ["PUSH_WEBHOOK_PORT"] = "0"
@@ -0,0 +1,108 @@
+"""--ack-after: bara mail som faktiskt hanterats kvitteras."""
+
+import asyncio
+from collections import OrderedDict
+
+from mcp.types import CallToolResult, TextContent
+from mcp.shared.memory import create_connected_server_and_client_session
+
+import server
+from mcp_client import MailAgent, ToolCallError
+
+
+class FakeSession:
+    """MCP-session där utvalda verktyg svarar med isError."""
+
+    def __init__(self, failing: set = frozenset()):
+        self.failing = failing
+        self.calls = []
+
+    async def call_tool(self, name: str, arguments: dict, **kwargs) -> CallToolResult:
+        self.calls.append((name, arguments))
+        if name in self.failing:
+            return CallToolResult(content=[TextContent(type="text", text="Kunde inte köa svar")], isError=True)
+        return CallToolResult(content=[TextContent(type="text", text="ok")])
+
+    def acked(self) -> list:
+        return [msg_id for name, args in self.calls if name == "mark_emails_read" for msg_id in args["message_ids"]]
+
+
+def mail(msg_id: str, sender: str, subject: str) -> dict:
+    return {"id": msg_id, "from": sender, "subject": subject, "body": f"Hej! {subject}. Mvh"}
+
+
+def run(agent: MailAgent, emails: list):
+    async def main():
+        await agent.process_all(emails)
+        await agent._flush_acks()
+    asyncio.run(main())
+
+
+def test_call_tool_raises_on_is_error():
+    agent = MailAgent(FakeSession({"handle_sales_email"}))
+    try:
+        asyncio.run(agent.call_tool("handle_sales_email", {}))
+    except ToolCallError as e:
+        assert "Kunde inte köa svar" in str(e)
+    else:
+        raise AssertionError("ToolCallError förväntades")
+
+
+def test_failed_handler_is_not_acked():
+    session = FakeSession({"handle_meeting_email"})
+    agent = MailAgent(session, ack_after=True, dedup=False)
+
+    async def classify(email):
+        return ("meeting", {}) if email["id"] == "m1" else ("sales", {"product": "plywood"})
+    agent.classify_email = classify
+
+    run(agent, [mail("m1", "a@x.se", "Möte"), mail("s1", "b@x.se", "Plywood")])
+
+    assert session.acked() == ["s1"]
+
+
+def test_failed_classification_is_not_acked():
+    session = FakeSession()
+    agent = MailAgent(session, ack_after=True, use_rules=False, dedup=False)
+
+    async def fail(prompt, **kwargs):
+        raise TimeoutError("LLM svarar inte")
+    agent._complete = fail
+
+    run(agent, [mail("x1", "a@x.se", "Fråga")])
+
+    assert session.acked() == []
+    assert not any(name.startswith("handle_") for name, _ in session.calls)
+
+
+def test_server_tool_errors_set_is_error(monkeypatch):
+    monkeypatch.setattr(server, "MANAGER_EMAIL", "")
+
+    async def main():
+        async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+            escalation = await session.call_tool("notify_manager", {
+                "from_email": "a@x.se", "subject": "Advokat", "body": "...", "email_type": "support"})
+            meeting = await session.call_tool("handle_meeting_email", {"from_email": "a@x.se", "subject": "Möte"})
+        return escalation, meeting
+
+    escalation, meeting = asyncio.run(main())
+    assert escalation.isError and "MANAGER_EMAIL" in escalation.content[0].text
+    assert not meeting.isError
+
+
+def test_fake_messages_are_dropped_when_acked_or_evicted(monkeypatch):
+    monkeypatch.setattr(server, "_fake_messages", OrderedDict())
+    monkeypatch.setattr(server, "FAKE_MESSAGES_MAX", 2)
+    inbox = [{"from": f"k{i}@x.se", "subject": f"Fråga {i}", "body": f"Text {i}"} for i in range(4)]
+    monkeypatch.setattr(server, "_fake_inbox", inbox[:2])
+    first, second = (email["id"] for email in server._unread_snapshot())
+
+    server.mark_emails_read([first])
+    assert "[FEL]" in server.get_email_body(first)
+    assert server.get_email_body(second) == "Text 1"
+
+    # Fler hämtade än FAKE_MESSAGES_MAX: det som använts längst sedan tas bort
+    server._fake_inbox.extend(inbox[2:])
+    server._unread_snapshot()
+    assert len(server._fake_messages) == 2
+    assert "[FEL]" in server.get_email_body(second)
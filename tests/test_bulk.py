@@ -0,0 +1,108 @@
+"""handle_emails_bulk: fel per mail, ordning per avsändare, förlopp, mätvärden och kvittering."""
+
+import json
+import asyncio
+
+from mcp.shared.memory import create_connected_server_and_client_session
+
+import server
+from core.metrics import get_metrics
+from mcp_client import MailAgent
+
+
+def handled(mail_type: str) -> int:
+    return get_metrics().snapshot()["latency"].get(f'handler_seconds{{type="{mail_type}"}}', {}).get("count", 0)
+
+
+EMAILS = [
+    {"id": "s1", "from": "a@x.se", "subject": "Plywood", "body": "Vad kostar plywood?", "type": "sales",
+     "product_query": "plywood 12mm"},
+    {"id": "b1", "from": "b@x.se", "subject": "Utan text", "type": "support"},
+    {"id": "c1", "from": "c@x.se", "subject": "Konstig", "body": "Hej", "type": "reklam"},
+    {"id": "h1", "from": "a@x.se", "subject": "Advokat", "body": "Jag kontaktar min advokat", "type": "support",
+     "high_priority": True},
+    {"id": "m1", "from": "a@x.se", "subject": "Möte", "body": "Kan vi ses?", "type": "meeting"},
+    {"id": "o1", "from": "d@x.se", "subject": "Nyhetsbrev", "body": "Erbjudanden", "type": "other"},
+]
+
+
+def test_bulk_isolates_failures_and_keeps_order(monkeypatch):
+    monkeypatch.setattr(server, "MANAGER_EMAIL", "")
+    started = []
+    bulk_reply = server._bulk_reply
+
+    async def recording_bulk_reply(email):
+        started.append(email.get("id"))
+        if email.get("id") == "s1":
+            await asyncio.sleep(0.05)  # Ge de andra avsändarna tid att hinna före
+        return await bulk_reply(email)
+    monkeypatch.setattr(server, "_bulk_reply", recording_bulk_reply)
+    before = {mail_type: handled(mail_type) for mail_type in ("sales", "meeting")}
+
+    progress = []
+
+    async def on_progress(done, total, message):
+        progress.append((done, total))
+
+    async def main():
+        async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+            return await session.call_tool("handle_emails_bulk", {"emails": EMAILS}, progress_callback=on_progress)
+
+    result = asyncio.run(main())
+    assert not result.isError
+    report = json.loads(result.content[0].text)
+
+    assert (report["total"], report["succeeded"], report["failed"]) == (6, 3, 3)
+    results = report["results"]
+    assert [item["index"] for item in results] == list(range(6))
+    assert [item["id"] for item in results] == [email["id"] for email in EMAILS]
+    assert [item["ok"] for item in results] == [True, False, False, False, True, True]
+    assert results[0]["result"].startswith("[DRY-RUN] Försäljningsförfrågan hanterad för a@x.se")
+    assert results[1]["error"] == "saknar fält: body"
+    assert results[2]["error"] == "okänd typ: reklam"
+    assert "MANAGER_EMAIL" in results[3]["error"]
+    assert results[5]["result"] == "Ingen åtgärd för typen other"
+
+    # Samma avsändare i listans ordning, övriga avsändare parallellt
+    assert [msg_id for msg_id in started if msg_id in ("s1", "h1", "m1")] == ["s1", "h1", "m1"]
+    assert started.index("o1") < started.index("h1")
+
+    assert {mail_type: handled(mail_type) - before[mail_type] for mail_type in before} == {"sales": 1, "meeting": 1}
+    assert progress[-1] == (6, 6)
+    assert [done for done, _ in progress] == sorted(done for done, _ in progress)
+
+
+class RecordingSession:
+    """Släpper igenom verktygsanropen till servern och noterar vilka mail som kvitteras."""
+
+    def __init__(self, session):
+        self.session = session
+        self.acked = []
+
+    async def call_tool(self, name: str, arguments: dict, **kwargs):
+        if name == "mark_emails_read":
+            self.acked += arguments["message_ids"]
+        return await self.session.call_tool(name, arguments, **kwargs)
+
+
+def test_client_acks_only_the_mails_the_bulk_call_handled(monkeypatch):
+    monkeypatch.setattr(server, "MANAGER_EMAIL", "")
+    classified = {"s1": ("sales", {"product": "plywood"}), "h1": ("support", {"high_priority": True}),
+                  "m1": ("meeting", {}), "o1": ("other", {})}
+    emails = [{key: value for key, value in email.items() if key in ("id", "from", "subject", "body")}
+              for email in EMAILS if email["id"] in classified]
+
+    async def main():
+        async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+            recording = RecordingSession(session)
+            agent = MailAgent(recording, bulk=True, ack_after=True, dedup=False, use_rules=False)
+
+            async def classify(email):
+                return classified[email["id"]]
+            agent.classify_email = classify
+
+            await agent._process(emails)
+            await agent._flush_acks()
+            return recording.acked
+
+    assert asyncio.run(main()) == ["s1", "m1", "o1"]
@@ -0,0 +1,105 @@
+"""Konversationshistoriken: cachen uppdateras vid skrivning, och JSON-historik migreras en gång."""
+
+import json
+
+import pytest
+
+import core.conversations as conversations
+from core.conversations import add_message, get_history, format_history_for_prompt, cache_stats, clear_history
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(conversations, "CONVERSATIONS_DB", tmp_path / "conversations.db")
+    monkeypatch.setattr(conversations, "CONVERSATIONS_FILE", tmp_path / "conversations.json")
+    monkeypatch.setattr(conversations._local, "conn", None, raising=False)
+    conversations._invalidate()
+    for key in conversations._cache_stats:
+        conversations._cache_stats[key] = 0
+    yield
+    if conversations._local.conn is not None:
+        conversations._local.conn.close()
+
+
+def support_mail(customer: str, n: int):
+    """Som supportflödet i server.py: spara kundens mail, läs historiken, spara svaret."""
+    add_message(customer, "customer", f"Klagomål {n}", f"Ärende {n}")
+    history = format_history_for_prompt(customer)
+    add_message(customer, "agent", f"Svar {n}", f"Re: Ärende {n}")
+    return history
+
+
+def test_support_flow_hits_cache():
+    customers = [f"kund{i}@example.se" for i in range(10)]
+    for n in range(5):
+        for customer in customers:
+            support_mail(customer, n)
+
+    stats = cache_stats()
+    # Bara första läsningen per kund går till databasen
+    assert stats["misses"] == len(customers)
+    assert stats["hits"] == 4 * len(customers)
+    assert stats["hit_rate"] == pytest.approx(0.8)
+
+
+def test_cached_history_matches_database():
+    for n in range(8):
+        support_mail("a@example.se", n)
+
+    cached = get_history("a@example.se", 5)
+    conversations._invalidate()
+    assert cached == get_history("a@example.se", 5)
+    assert [msg["message"] for msg in cached] == ["Svar 5", "Klagomål 6", "Svar 6", "Klagomål 7", "Svar 7"]
+
+
+def test_short_history_stays_complete():
+    add_message("b@example.se", "customer", "Första")
+    assert [msg["message"] for msg in get_history("b@example.se", 10)] == ["Första"]
+
+    add_message("b@example.se", "agent", "Andra")
+    hits = cache_stats()["hits"]
+    assert [msg["message"] for msg in get_history("b@example.se", 10)] == ["Första", "Andra"]
+    assert cache_stats()["hits"] == hits + 1
+
+
+def test_clear_history_invalidates():
+    support_mail("c@example.se", 1)
+    clear_history("c@example.se")
+    assert get_history("c@example.se") == []
+
+
+OLD_HISTORY = {
+    "anna@example.se": [
+        {"timestamp": "2024-03-01T10:00:00", "role": "customer", "subject": "Reklamation", "message": "Trasig bräda"},
+        {"timestamp": "2024-03-01T10:05:00", "role": "agent", "subject": "Re: Reklamation", "message": "Vi beklagar"},
+        {"timestamp": "2024-03-02T08:00:00", "role": "customer", "message": "Tack!"},
+    ],
+    "bo@example.se": [
+        {"timestamp": "2024-02-01T09:00:00", "role": "customer", "subject": "Offert", "message": "Pris på plywood?"},
+    ],
+}
+
+
+def reconnect():
+    conversations._local.conn.close()
+    conversations._local.conn = None
+    conversations._invalidate()
+
+
+def test_json_history_is_migrated_once():
+    conversations.CONVERSATIONS_FILE.write_text(json.dumps(OLD_HISTORY), encoding="utf-8")
+
+    history = get_history("anna@example.se")
+    assert [msg["message"] for msg in history] == ["Trasig bräda", "Vi beklagar", "Tack!"]
+    assert history[2]["subject"] == ""
+    assert [msg["message"] for msg in get_history("bo@example.se")] == ["Pris på plywood?"]
+    assert not conversations.CONVERSATIONS_FILE.exists()
+    migrated = conversations.CONVERSATIONS_FILE.with_name("conversations.json.migrated")
+    assert json.loads(migrated.read_text(encoding="utf-8")) == OLD_HISTORY
+
+    # Som om processen dog efter importen men innan filen döptes om
+    migrated.rename(conversations.CONVERSATIONS_FILE)
+    reconnect()
+
+    assert len(get_history("anna@example.se")) == 3
+    assert not conversations.CONVERSATIONS_FILE.exists()
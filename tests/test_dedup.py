@@ -0,0 +1,31 @@
+"""Dubbletthantering: exakta och nästan-dubbletter viks ihop, ändrade tal gör det inte."""
+
+from core.dedup import DuplicateTracker
+
+REQUEST = ("Hej! Vi vill bygga ett altandäck på 20 kvm i tryckimpregnerat virke med trall "
+           "och reglar. Kan ni ta fram en offert på materialet? Leverans till Växjö i maj. Mvh Anna")
+
+
+def mail(msg_id: str, body: str, subject: str = "Offert altandäck") -> dict:
+    return {"id": msg_id, "from": "Anna <anna@example.se>", "subject": subject, "body": body,
+            "date": "2026-05-04T10:00:00+02:00"}
+
+
+def fold(*emails) -> list:
+    return [email["id"] for email in DuplicateTracker().fold(list(emails))]
+
+
+def test_exact_duplicate_is_folded():
+    assert fold(mail("a", REQUEST), mail("b", REQUEST, subject="Sv: Offert altandäck")) == ["a"]
+
+
+def test_near_duplicate_is_folded():
+    assert fold(mail("a", REQUEST), mail("b", REQUEST.replace("Mvh Anna", "Med vänlig hälsning Anna"))) == ["a"]
+
+
+def test_changed_quantity_is_not_folded():
+    assert fold(mail("a", REQUEST), mail("b", REQUEST.replace("20 kvm", "30 kvm"))) == ["a", "b"]
+
+
+def test_changed_quantity_in_subject_is_not_folded():
+    assert fold(mail("a", REQUEST, subject="Altan 20 kvm"), mail("b", REQUEST, subject="Altan 30 kvm")) == ["a", "b"]
@@ -0,0 +1,70 @@
+"""Den lokala materialberäkningen: tolkning av beskrivningen, mängder och LLM-reserven."""
+
+from core.agents import SalesAgent
+from core.estimator import estimate_materials, parse_project, project_from_parameters
+
+DECK = "Vi ska bygga en altan 4x6 m"
+GARAGE = "Materialberäkning garage 6 x 4 meter, vägghöjd 240 cm, isolerad"
+
+
+def test_deck():
+    spec = parse_project(DECK)
+    assert spec == {"building": "altan", "width": 4.0, "length": 6.0, "wall_height": 0.0,
+                    "roof": None, "walls": False, "floor": False, "insulated": False}
+
+    # 11 bärlinor à 2 x 3 m + kantbalkar, 4 x 3 plintar, 24 kvm trall med 125 mm delning
+    assert estimate_materials(spec) == {
+        "Stomme": {"regel_tryckimp_45x145_3m": 27, "betong_torr_25kg": 12, "universalankare": 12},
+        "Trall": {"bräda_tryckimp_22x120_3m": 68},
+        "Fästdon": {"skruv_trall_4.5x55_250st": 3, "balksko_45x145": 22},
+    }
+
+
+def test_insulated_walls():
+    spec = parse_project(GARAGE)
+    assert spec == {"building": "garage", "width": 4.0, "length": 6.0, "wall_height": 2.4,
+                    "roof": "sadeltak", "walls": True, "floor": False, "insulated": True}
+
+    assert estimate_materials(spec) == {
+        "Stomme/Väggar": {"regel_45x145_3m": 38, "regel_45x145_4.8m": 9, "plywood_12mm": 24},
+        "Panel/Fasad": {"ytterpanel_14x145_3m": 109},
+        "Isolering": {"isolering_mineralull_145mm": 16, "byggplast_0.2mm_50kvm": 2,
+                      "isolering_mineralull_195mm": 14},
+        "Invändigt": {"gipsskiva_13mm": 37},
+        "Tak": {"regel_45x170_3m": 22, "råspontlucka_20x540_4.8m": 13, "underlagspapp_rulle": 3,
+                "takläkt_25x38_4.2m": 22},
+        "Fästdon": {"vinkel_70x70x55": 44, "spik_varmförz_75mm_5kg": 2, "skruv_trä_5x80_200st": 3,
+                    "skruv_gips_3.5x35_1000st": 2},
+    }
+
+
+def test_same_description_gives_same_estimate():
+    assert estimate_materials(parse_project(GARAGE)) == estimate_materials(parse_project(GARAGE))
+
+
+def test_missing_dimensions_fall_back_to_the_llm(monkeypatch):
+    description = "Jag vill bygga en altan, vad behöver jag?"
+    assert parse_project(description) is None
+
+    temperatures = []
+
+    def run_llm_json(prompt, temperature=0.3):
+        temperatures.append(temperature)
+        return {"building": "altan", "width": 4, "length": 6}
+
+    agent = SalesAgent()
+    monkeypatch.setattr(agent, "run_llm_json", run_llm_json)
+
+    # LLM:en tolkar bara parametrarna, mängderna räknas lokalt
+    assert agent.estimate_materials_json(description) == estimate_materials(parse_project(DECK))
+    assert temperatures == [0.0]
+
+
+def test_unusable_llm_parameters_fall_back_to_a_full_llm_estimate(monkeypatch):
+    replies = iter([{"building": "annat", "area": 20}, {"Stomme": {"regel_45x95_3m": 10}}])
+    agent = SalesAgent()
+    monkeypatch.setattr(agent, "run_llm_json", lambda prompt, temperature=0.3: next(replies))
+
+    assert project_from_parameters({"building": "annat", "area": 20}) is None
+    assert agent.estimate_materials_json("Hej, jag behöver virke till ett projekt") == {
+        "Stomme": {"regel_45x95_3m": 10}}
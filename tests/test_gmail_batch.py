@@ -0,0 +1,78 @@
+"""GmailClient mot den fejkade Gmail-tjänsten: antal HTTP-anrop per hämtning och kvittering."""
+
+import pytest
+
+import core.autoresponder
+from core.autoresponder import GMAIL_BATCH_SIZE, GMAIL_MODIFY_BATCH_SIZE
+from core.metrics import get_metrics
+from benchmarks.fake_gmail import FakeGmailService, FakeGmailClient
+from benchmarks.inbox_gen import generate_inbox
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(core.autoresponder, "GMAIL_BATCH_BACKOFF", 0)
+
+
+def make_client(size: int) -> tuple[FakeGmailService, FakeGmailClient]:
+    service = FakeGmailService(generate_inbox(size, seed=1))
+    return service, FakeGmailClient(service)
+
+
+def test_one_batch_call_per_100_messages():
+    service, client = make_client(250)
+    ids = [f"bench{i:06d}" for i in range(250)]
+
+    emails = client.get_emails(ids)
+
+    assert [email["id"] for email in emails] == ids
+    assert service.calls["batch"] == 3 == -(-250 // GMAIL_BATCH_SIZE)
+    assert service.calls["messages.get"] == 250
+    assert service.calls["http"] == 3
+
+
+def test_unread_listing_pages_and_batches():
+    service, client = make_client(1200)
+
+    emails = client.get_unread_emails(max_results=None, format='metadata')
+
+    assert len(emails) == 1200
+    assert service.calls["messages.list"] == 3   # 500 id:n per sida
+    assert service.calls["batch"] == 12
+
+
+def test_one_batch_modify_per_1000_ids():
+    service, client = make_client(2500)
+    ids = [f"bench{i:06d}" for i in range(2500)]
+
+    client.mark_as_read_bulk(ids)
+
+    assert service.calls["messages.batchModify"] == 3 == -(-2500 // GMAIL_MODIFY_BATCH_SIZE)
+    assert service.calls["http"] == 3
+    assert client.get_unread_emails(max_results=None) == []
+
+
+def test_failed_sub_response_is_retried():
+    service, client = make_client(150)
+    service.fail("bench000007", status=503, times=2)
+
+    emails = client.get_emails([f"bench{i:06d}" for i in range(150)])
+
+    assert len(emails) == 150
+    assert emails[7]["id"] == "bench000007"
+    # 2 batch-anrop för alla mail, sedan ett per omförsök för det som misslyckades
+    assert service.calls["batch"] == 4
+
+
+def test_permanent_failure_is_reported_and_skipped(capsys):
+    get_metrics().reset()
+    service, client = make_client(10)
+    service.fail("bench000003", status=404)
+    service.fail("bench000004", status=503, times=10)
+
+    emails = client.get_emails([f"bench{i:06d}" for i in range(10)])
+
+    assert [email["id"] for email in emails] == [f"bench{i:06d}" for i in range(10) if i not in (3, 4)]
+    assert "bench000003" in capsys.readouterr().err
+    counters = get_metrics().snapshot()["counters"]
+    assert counters['mail_fetch_failed_total{transport="gmail"}'] == 2
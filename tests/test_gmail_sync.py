@@ -0,0 +1,80 @@
+"""Inkrementell Gmail-synk: inga mail tappas om de inte kvitteras eller om en full sökning avbryts."""
+
+import pytest
+
+import core.autoresponder
+from benchmarks.fake_gmail import FakeGmailService, FakeGmailClient
+from benchmarks.inbox_gen import generate_inbox
+
+
+@pytest.fixture(autouse=True)
+def state_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(core.autoresponder, "GMAIL_STATE_FILE", tmp_path / "gmail_state.json")
+    monkeypatch.setattr(core.autoresponder, "GMAIL_BATCH_BACKOFF", 0)
+
+
+def ids(emails: list) -> list:
+    return [email["id"] for email in emails]
+
+
+def test_unacked_mail_is_synced_again():
+    inbox = generate_inbox(5, seed=1)
+    service = FakeGmailService(inbox)
+    client = FakeGmailClient(service)
+
+    first = client.sync_unread_emails()
+    assert sorted(ids(first)) == sorted(ids(inbox))
+
+    # Bara två kvitteras, t.ex. för att resten misslyckades med --ack-after
+    client.mark_as_read_bulk(ids(first)[:2])
+    new = {**inbox[0], "id": "new1"}
+    service.insert(new)
+
+    second = client.sync_unread_emails()
+    assert sorted(ids(second)) == sorted(ids(first)[2:] + ["new1"])
+
+    client.mark_as_read_bulk(ids(second))
+    assert client.sync_unread_emails() == []
+
+
+def test_mail_read_elsewhere_is_dropped():
+    service = FakeGmailService(generate_inbox(3, seed=2))
+    client = FakeGmailClient(service)
+    first = ids(client.sync_unread_emails())
+
+    # Läst i Gmails webbgränssnitt, inte via klienten
+    service._relabel(first[:1], {"removeLabelIds": ["UNREAD"]})
+
+    assert sorted(ids(client.sync_unread_emails())) == sorted(first[1:])
+
+
+def test_failed_fetch_is_kept_for_next_sync():
+    service = FakeGmailService(generate_inbox(3, seed=3))
+    client = FakeGmailClient(service)
+    service.fail("bench000001", status=503, times=core.autoresponder.GMAIL_BATCH_RETRIES + 1)
+
+    first = client.sync_unread_emails()
+    assert "bench000001" not in ids(first)
+    client.mark_as_read_bulk(ids(first))
+
+    assert ids(client.sync_unread_emails()) == ["bench000001"]
+
+
+def test_truncated_full_scan_does_not_skip_the_rest():
+    inbox = generate_inbox(250, seed=4)
+    service = FakeGmailService(inbox)
+    client = FakeGmailClient(service)
+
+    seen = []
+    for _ in range(3):
+        batch = client.sync_unread_emails(max_results=100)
+        seen += ids(batch)
+        client.mark_as_read_bulk(ids(batch))
+
+    assert sorted(seen) == sorted(ids(inbox))
+    assert client.sync_unread_emails(max_results=100) == []
+    # Nu är sökningen komplett och historyId sparat: nästa synk går via history
+    service.insert({**inbox[0], "id": "later"})
+    before = service.calls["history.list"]
+    assert ids(client.sync_unread_emails(max_results=100)) == ["later"]
+    assert service.calls["history.list"] == before + 1
@@ -0,0 +1,138 @@
+"""IMAP-transporten mot en fejkad IMAP/SMTP-server: synk, kvittering, UIDVALIDITY och återanslutning."""
+
+import imaplib
+import smtplib
+
+import pytest
+
+import core.imap_transport as imap_transport
+from benchmarks.fake_imap import FakeMailServer
+from core.imap_transport import ImapTransport
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    fake = FakeMailServer()
+    monkeypatch.setattr(imap_transport, "IMAP_STATE_FILE", tmp_path / "imap_state.json")
+    monkeypatch.setattr(imap_transport, "IMAP_SSL", False)
+    monkeypatch.setattr(imap_transport, "SMTP_SECURITY", "none")
+    monkeypatch.setattr(imaplib, "IMAP4", fake.imap4)
+    monkeypatch.setattr(smtplib, "SMTP", fake.smtp)
+    return fake
+
+
+def ids(emails: list) -> list:
+    return [int(email["id"]) for email in emails]
+
+
+def deliver(server: FakeMailServer, n: int) -> list:
+    return [server.deliver(f"kund{i}@example.se", f"Fråga {i}", f"Hej! Fråga nummer {i}.") for i in range(n)]
+
+
+def test_sync_returns_new_mail_only(server):
+    transport = ImapTransport()
+    first = deliver(server, 3)
+
+    emails = transport.sync_unread_emails()
+    assert ids(emails) == first
+    assert emails[0]["from"] == "kund0@example.se" and emails[0]["body"] == "Hej! Fråga nummer 0."
+
+    transport.mark_as_read_bulk([email["id"] for email in emails])
+    assert server.unseen() == []
+    second = deliver(server, 2)
+    assert ids(transport.sync_unread_emails()) == second
+
+
+def test_unacked_mail_is_synced_again(server):
+    transport = ImapTransport()
+    first = deliver(server, 4)
+    transport.sync_unread_emails()
+
+    # Bara två kvitteras, t.ex. för att resten misslyckades med --ack-after
+    transport.mark_as_read_bulk([str(uid) for uid in first[:2]])
+    new = deliver(server, 1)
+
+    assert ids(transport.sync_unread_emails()) == first[2:] + new
+
+
+def test_mail_read_elsewhere_is_dropped(server):
+    transport = ImapTransport()
+    first = deliver(server, 3)
+    transport.sync_unread_emails()
+
+    server.mark_seen(first[0])
+
+    assert ids(transport.sync_unread_emails()) == first[1:]
+
+
+def test_truncated_first_sync_keeps_the_rest(server):
+    transport = ImapTransport()
+    first = deliver(server, 5)
+
+    assert ids(transport.sync_unread_emails(max_results=2)) == first[:2]
+    transport.mark_as_read_bulk([str(uid) for uid in first[:2]])
+    assert ids(transport.sync_unread_emails(max_results=2)) == first[2:]
+
+
+def test_uidvalidity_reset_does_a_full_sync(server):
+    transport = ImapTransport()
+    first = deliver(server, 3)
+    transport.mark_as_read_bulk([email["id"] for email in transport.sync_unread_emails()])
+    for uid in first:
+        server.delete(uid)
+    deliver(server, 2)
+
+    # Mappen byggs om: de två nya mailen får UID 1 och 2 (under förra synkens 3)
+    # och anslutningen stängs
+    server.reset_uidvalidity()
+
+    emails = transport.sync_unread_emails()
+    assert [email["subject"] for email in emails] == ["Fråga 0", "Fråga 1"]
+    assert ids(emails) == [1, 2]
+
+
+def test_reconnects_after_dropped_connections(server):
+    transport = ImapTransport()
+    deliver(server, 1)
+    transport.sync_unread_emails()
+    transport.send_email("kund@example.se", "Re: Fråga", "Tack!")
+
+    server.disconnect()
+    new = deliver(server, 1)
+    assert ids(transport.sync_unread_emails()) == [1] + new
+    transport.mark_as_read_bulk([str(uid) for uid in [1] + new])
+    transport.send_email("kund@example.se", "Re: Fråga", "Tack igen!")
+
+    assert server.connections == 2
+    assert server.unseen() == []
+    assert [message.get_payload() for message in server.sent] == ["Tack!", "Tack igen!"]
+
+
+@pytest.mark.parametrize("format", ["full", "metadata"])
+def test_fetch_items_in_any_order(server, format):
+    server.items_last = True
+    first = deliver(server, 3)
+
+    emails = ImapTransport().get_unread_emails(format=format)
+    assert ids(emails) == first
+    assert [email["subject"] for email in emails] == ["Fråga 0", "Fråga 1", "Fråga 2"]
+    assert emails[1]["from"] == "kund1@example.se"
+    assert emails[1]["date"] is not None
+    if format == "full":
+        assert emails[1]["body"] == "Hej! Fråga nummer 1."
+    else:
+        assert emails[1]["body"]  # Utdrag ur den kodade texten
+
+
+def test_rejected_store_keeps_mail_unacked(server):
+    transport = ImapTransport()
+    first = deliver(server, 2)
+    transport.sync_unread_emails()
+
+    server.store_status = "NO"
+    with pytest.raises(imaplib.IMAP4.error):
+        transport.mark_as_read_bulk([str(uid) for uid in first])
+    assert server.unseen() == first
+
+    server.store_status = "OK"
+    assert ids(transport.sync_unread_emails()) == first
@@ -0,0 +1,118 @@
+"""LLM-cachen: minne och SQLite, TTL, storleksgräns på disk och discard."""
+
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import core.llm_cache as llm_cache
+from core.agents import BaseAgent, MODEL as AGENT_MODEL
+from core.llm_cache import LLMCache
+
+MODEL = "gemini-test"
+
+
+class Clock:
+    """Fast klocka som testet flyttar fram."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(llm_cache, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def db(tmp_path):
+    return tmp_path / "llm_cache.db"
+
+
+def rows(db) -> int:
+    with sqlite3.connect(db) as conn:
+        return conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+def test_memory_and_disk_levels(db, clock):
+    LLMCache(db).put(MODEL, 0.3, "Klassificera mail 1", '{"type": "sales"}', tokens=120)
+
+    # Ny process: minnet är tomt, svaret kommer från disk och sedan från minnet
+    cache = LLMCache(db)
+    assert cache.get(MODEL, 0.3, "Klassificera mail 1") == '{"type": "sales"}'
+    assert cache.get(MODEL, 0.3, "Klassificera mail 1") == '{"type": "sales"}'
+    assert cache.get(MODEL, 0.5, "Klassificera mail 1") is None
+
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["saved_tokens"] == 240
+
+
+def test_reformatted_prompt_gives_same_key(db, clock):
+    cache = LLMCache(db)
+    cache.put(MODEL, 0.3, "Klassificera:\n    Från: a@x.se\n\n    Ämne: Hej", "svar")
+    assert cache.get(MODEL, 0.3, "  Klassificera:\nFrån: a@x.se\nÄmne: Hej  ") == "svar"
+
+
+def test_expired_entries_are_misses(db, clock):
+    cache = LLMCache(db, ttl=60)
+    cache.put(MODEL, 0.3, "prompt", "svar")
+
+    clock.now += 59
+    assert cache.get(MODEL, 0.3, "prompt") == "svar"
+    clock.now += 2
+    assert cache.get(MODEL, 0.3, "prompt") is None
+    assert LLMCache(db, ttl=60).get(MODEL, 0.3, "prompt") is None
+
+
+def test_disk_is_trimmed_every_evict_interval(db, clock):
+    cache = LLMCache(db, ttl=1000, memory_size=2, disk_size=3)
+    cache.put(MODEL, 0.3, "gammal", "svar")
+    clock.now += 2000  # "gammal" har gått ut
+
+    for i in range(llm_cache._EVICT_EVERY - 2):
+        clock.now += 1
+        cache.put(MODEL, 0.3, f"prompt {i}", f"svar {i}")
+    # Använd en tidig post så att den räknas som nyligen använd
+    clock.now += 1
+    assert LLMCache(db, ttl=1000).get(MODEL, 0.3, "prompt 0") == "svar 0"
+    assert rows(db) == llm_cache._EVICT_EVERY - 1
+
+    clock.now += 1
+    cache.put(MODEL, 0.3, "sista", "svar")  # Skrivning nummer _EVICT_EVERY
+    assert rows(db) == 3
+
+    fresh = LLMCache(db, ttl=1000)
+    last = llm_cache._EVICT_EVERY - 3
+    assert fresh.get(MODEL, 0.3, "sista") == "svar"
+    assert fresh.get(MODEL, 0.3, "prompt 0") == "svar 0"
+    assert fresh.get(MODEL, 0.3, f"prompt {last}") == f"svar {last}"
+    assert fresh.get(MODEL, 0.3, "prompt 1") is None
+    assert fresh.get(MODEL, 0.3, "gammal") is None
+
+
+def test_discard_removes_from_both_levels(db, clock):
+    cache = LLMCache(db)
+    cache.put(MODEL, 0.3, "prompt", "trasig json")
+    cache.discard(MODEL, 0.3, "prompt")
+
+    assert cache.get(MODEL, 0.3, "prompt") is None
+    assert LLMCache(db).get(MODEL, 0.3, "prompt") is None
+
+
+def test_unparsable_reply_is_not_cached(db, clock, monkeypatch):
+    cache = LLMCache(db)
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm_cache, "_cache", cache)
+
+    reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="inte json"))], usage=None)
+    agent = BaseAgent()
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: reply)))
+
+    assert agent.run_llm_json("Svara med JSON") is None
+    assert cache.get(AGENT_MODEL, 0.3, "Svara med JSON") is None
@@ -0,0 +1,205 @@
+"""Utkorgen mot en fejkad avsändare: kö och ordning, omförsök, Retry-After, retry_failed och omstart."""
+
+import time
+import smtplib
+import threading
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import core.outbox as outbox_module
+import core.conversations as conversations
+import server
+from core.conversations import get_history
+from core.outbox import Outbox, is_retryable
+
+
+class Sender:
+    """Fejkad send(to, subject, body) som kan fås att misslyckas."""
+
+    def __init__(self):
+        self.sent = []          # (mottagare, ämne, tid)
+        self.attempts = []      # (ämne, tid) för alla försök
+        self.failures = {}      # ämne -> lista med fel att kasta, i tur och ordning
+        self._lock = threading.Lock()
+
+    def __call__(self, to: str, subject: str, body: str):
+        with self._lock:
+            self.attempts.append((subject, time.monotonic()))
+            errors = self.failures.get(subject)
+            if errors:
+                raise errors.pop(0)
+            self.sent.append((to, subject, time.monotonic()))
+
+
+def http_error(status: int, content: bytes = b"", retry_after: str = None) -> HttpError:
+    headers = {"status": status}
+    if retry_after is not None:
+        headers["retry-after"] = retry_after
+    return HttpError(httplib2.Response(headers), content)
+
+
+def wait_until_idle(outbox: Outbox, timeout: float = 5.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = outbox.stats()
+        if stats["queued"] == 0:
+            return stats
+        time.sleep(0.01)
+    raise AssertionError(f"Utkorgen blev inte klar: {outbox.stats()}")
+
+
+@pytest.fixture
+def sender(monkeypatch):
+    monkeypatch.setattr(outbox_module, "OUTBOX_BACKOFF_BASE", 0.0)
+    return Sender()
+
+
+@pytest.fixture
+def db(tmp_path):
+    return tmp_path / "outbox.db"
+
+
+def test_mail_to_the_same_recipient_keeps_queue_order(sender, db):
+    outbox = Outbox(sender, path=db, workers=4)
+    sender.failures["a1"] = [http_error(503), http_error(503)]
+    outbox.start()
+    for n in range(1, 4):
+        outbox.enqueue("a@example.se", f"a{n}", "hej")
+        outbox.enqueue("b@example.se", f"b{n}", "hej")
+
+    assert wait_until_idle(outbox) == {"pending": 0, "sent": 6, "failed": 0, "queued": 0}
+    for recipient in ("a", "b"):
+        assert [s for to, s, _ in sender.sent if to.startswith(recipient)] == [f"{recipient}{n}" for n in (1, 2, 3)]
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (http_error(429), True),
+    (http_error(500), True),
+    (http_error(503), True),
+    (http_error(403, b'{"reason": "rateLimitExceeded"}'), True),
+    (http_error(403, b'{"reason": "forbidden"}'), False),
+    (http_error(400), False),
+    (http_error(404), False),
+    (smtplib.SMTPResponseException(451, b"Try again later"), True),
+    (smtplib.SMTPResponseException(550, b"No such user"), False),
+    (smtplib.SMTPRecipientsRefused({"a@example.se": (450, b"Mailbox busy")}), True),
+    (smtplib.SMTPRecipientsRefused({"a@example.se": (450, b"busy"), "b@example.se": (550, b"no")}), False),
+    (ConnectionResetError(), True),
+    (TimeoutError(), True),
+    (ValueError("trasigt mail"), False),
+])
+def test_retry_classification(error, retryable):
+    assert is_retryable(error) == retryable
+
+
+def test_permanent_error_fails_at_once_and_retryable_error_gives_up(sender, db):
+    outbox = Outbox(sender, path=db, max_attempts=3)
+    sender.failures["permanent"] = [smtplib.SMTPResponseException(550, b"No such user")]
+    sender.failures["flaky"] = [http_error(500)] * 5
+    outbox.start()
+    outbox.enqueue("a@example.se", "permanent", "hej")
+    outbox.enqueue("b@example.se", "flaky", "hej")
+
+    assert wait_until_idle(outbox)["failed"] == 2
+    assert [s for s, _ in sender.attempts].count("permanent") == 1
+    assert [s for s, _ in sender.attempts].count("flaky") == 3
+
+
+def test_retry_after_is_waited_out_in_the_queue(sender, db):
+    # En enda tråd: under väntan på omförsöket ska den hinna skicka till andra mottagare
+    outbox = Outbox(sender, path=db, workers=1)
+    sender.failures["a"] = [http_error(429, retry_after="0.5")]
+    outbox.start()
+    outbox.enqueue("a@example.se", "a", "hej")
+    outbox.enqueue("b@example.se", "b", "hej")
+
+    wait_until_idle(outbox)
+    (_, first), (_, second) = [attempt for attempt in sender.attempts if attempt[0] == "a"]
+    assert second - first >= 0.5
+    sent = {subject: at for _, subject, at in sender.sent}
+    assert sent["b"] < sent["a"]
+    assert sent["b"] - first < 0.5
+
+
+def test_retry_failed_requeues_failed_mail(sender, db):
+    outbox = Outbox(sender, path=db)
+    sender.failures["a"] = [smtplib.SMTPResponseException(550, b"Mailbox full")]
+    outbox.start()
+    outbox.enqueue("a@example.se", "a", "hej")
+    assert wait_until_idle(outbox)["failed"] == 1
+
+    assert outbox.retry_failed() == 1
+    assert wait_until_idle(outbox) == {"pending": 0, "sent": 1, "failed": 0, "queued": 0}
+    assert outbox.retry_failed() == 0
+
+
+def test_unsent_mail_is_sent_after_restart(sender, db):
+    # Processen dör innan trådarna hinner skicka
+    stopped = Outbox(sender, path=db)
+    stopped.enqueue("a@example.se", "a1", "hej")
+    stopped.enqueue("a@example.se", "a2", "hej")
+    assert stopped.stats()["pending"] == 2
+
+    outbox = Outbox(sender, path=db)
+    outbox.start()
+    assert wait_until_idle(outbox) == {"pending": 0, "sent": 2, "failed": 0, "queued": 0}
+    assert [subject for _, subject, _ in sender.sent] == ["a1", "a2"]
+
+
+def test_on_sent_is_called_only_for_sent_tagged_mail(sender, db):
+    calls = []
+    outbox = Outbox(sender, path=db, max_attempts=1, on_sent=lambda *args: calls.append(args))
+    sender.failures["misslyckas"] = [http_error(500)]
+    outbox.start()
+    outbox.enqueue("a@example.se", "utan tagg", "hej")
+    outbox.enqueue("b@example.se", "med tagg", "hej", tag="history")
+    outbox.enqueue("c@example.se", "misslyckas", "hej", tag="history")
+
+    wait_until_idle(outbox)
+    assert calls == [("b@example.se", "med tagg", "hej", "history")]
+
+
+def test_reply_enters_history_only_once_sent(sender, db, tmp_path, monkeypatch):
+    monkeypatch.setattr(conversations, "CONVERSATIONS_DB", tmp_path / "conversations.db")
+    monkeypatch.setattr(conversations, "CONVERSATIONS_FILE", tmp_path / "conversations.json")
+    monkeypatch.setattr(conversations._local, "conn", None, raising=False)
+    conversations._invalidate()
+    monkeypatch.setattr(server, "SEND_EMAILS", True)
+
+    release = threading.Event()
+
+    def send(to, subject, body):
+        release.wait(5)
+        sender(to, subject, body)
+
+    outbox = Outbox(send, path=db, on_sent=server._on_sent)
+    outbox.start()
+    monkeypatch.setattr(server, "_outbox", outbox)
+    reply = {"to": "kund@example.se", "subject": "Re: Fråga", "body": "Tack!", "summary": "Klart", "history": True}
+
+    assert server._finish(reply) == "Klart, svar köat för utskick"
+    assert get_history("kund@example.se") == []
+
+    release.set()
+    wait_until_idle(outbox)
+    assert [(m["role"], m["message"]) for m in get_history("kund@example.se")] == [("agent", "Tack!")]
+    conversations._local.conn.close()
+
+
+def test_get_outbox_creates_one_outbox(monkeypatch, db):
+    monkeypatch.setattr(server, "_outbox", None)
+
+    def create_outbox():
+        time.sleep(0.05)  # Ge de andra trådarna tid att också se att utkorgen saknas
+        return Outbox(Sender(), path=db)
+    monkeypatch.setattr(server, "create_outbox", create_outbox)
+
+    outboxes = []
+    threads = [threading.Thread(target=lambda: outboxes.append(server.get_outbox())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(outbox) for outbox in outboxes}) == 1
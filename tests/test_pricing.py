@@ -0,0 +1,77 @@
+"""Prissättningen av materiallistor: delsummor, moms, avrundning, täckning och okända produkter."""
+
+import pytest
+
+from core.pricing import get_price_table, quote, quote_many
+
+GROUPED = {
+    "Väggar": {"plywood_12mm": 3, "regel_45x95_3m": 2.5},
+    "Tak": {"plywood_12mm": 1},
+}
+
+
+def test_subtotals_vat_and_coverage():
+    q = quote(GROUPED)
+
+    walls = q["categories"]["Väggar"]
+    assert walls["subtotal"] == 3 * 349 + 2.5 * 95
+    assert q["categories"]["Tak"]["subtotal"] == 349
+    assert walls["lines"][0] == {"sku": "plywood_12mm", "name": "plywood 12mm", "quantity": 3.0,
+                                 "unit_price": 349.0, "total": 1047.0, "coverage": 6.0}
+    assert walls["lines"][1]["coverage"] == 7.5  # 2,5 reglar à 3 m
+
+    # Priserna är inklusive moms: 25 % moms är 20 % av totalen
+    assert q["total"] == 1634
+    assert q["vat"] == 326.8
+    assert q["total_excl_vat"] == 1307.2
+    assert q["line_count"] == 3
+    assert q["unmatched"] == []
+
+
+def test_total_rounds_half_up():
+    # 0,5 x 349 = 174,50 kr. Bankers rounding skulle ge 174.
+    assert quote({"plywood_12mm": 0.5})["total"] == 175
+    assert quote({"plywood_12mm": 0.5}, vat_rate=0.12)["vat"] == round(175 * 0.12 / 1.12, 2)
+
+
+def test_flat_bom_and_piece_goods():
+    q = quote({"universalankare": 4})
+
+    line = q["categories"]["Material"]["lines"][0]
+    assert (line["total"], line["coverage"]) == (88.0, 0.0)
+
+
+def test_unmatched_lines_are_reported_with_suggestions():
+    q = quote({"plywod_12": 2, "osb_11mm": "x", "universalankare": 4, "regel_45x95_3m": -1})
+
+    assert q["line_count"] == 1
+    assert q["total"] == 88
+    assert q["unmatched"] == [
+        {"sku": "plywod_12", "quantity": 2, "category": "Material", "reason": "okänd produkt",
+         "suggestions": ["plywood_12mm"]},
+        {"sku": "osb_11mm", "quantity": "x", "category": "Material", "reason": "ogiltigt antal",
+         "suggestions": []},
+        {"sku": "regel_45x95_3m", "quantity": -1, "category": "Material", "reason": "ogiltigt antal",
+         "suggestions": []},
+    ]
+
+
+def test_quote_many_keeps_the_boms_apart():
+    quotes = quote_many([GROUPED, {}, {"universalankare": 4}])
+
+    assert [q["total"] for q in quotes] == [1634, 0, 88]
+    assert [q["line_count"] for q in quotes] == [3, 0, 1]
+    assert quotes == [quote(GROUPED), quote({}), quote({"universalankare": 4})]
+
+
+@pytest.mark.parametrize("bom", [[{"sku": "plywood_12mm"}], "plywood_12mm", None])
+def test_bom_that_is_not_an_object_is_rejected(bom):
+    with pytest.raises(ValueError):
+        quote_many([GROUPED, bom])
+
+
+def test_price_table():
+    table = get_price_table()
+    assert len(table) == len(table.prices) == len(table.coverage)
+    assert table.price("plywood_12mm") == 349.0
+    assert table.price("finns_inte") is None
@@ -0,0 +1,99 @@
+"""Push-webhooken: en Pub/Sub-notis väcker wait_for_new_mail, trasiga anrop ger 400, testmail tappas inte."""
+
+import json
+import base64
+import asyncio
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+from mcp.shared.memory import create_connected_server_and_client_session
+
+import server
+from core.push import PushReceiver, get_notifier
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    notifier = get_notifier()
+    notifier.wait(0)  # Nollställ en notis från ett tidigare test
+    push = PushReceiver(notifier, port=0, token="hemlig")
+    push.start()
+    monkeypatch.setattr(server, "_push_receiver", push)
+    yield push
+    push.stop()
+
+
+def post(receiver: PushReceiver, path: str, body: bytes, token: str = "hemlig") -> int:
+    request = urllib.request.Request(f"http://127.0.0.1:{receiver.port}{path}?token={token}", data=body, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def envelope(payload: dict) -> bytes:
+    data = base64.b64encode(json.dumps(payload).encode()).decode()
+    return json.dumps({"message": {"data": data, "messageId": "1"}, "subscription": "gmail"}).encode()
+
+
+def test_pubsub_push_wakes_wait_for_new_mail(receiver):
+    payload = {"emailAddress": "info@example.se", "historyId": 4711}
+
+    async def main():
+        async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+            waiting = asyncio.create_task(session.call_tool("wait_for_new_mail", {"timeout_seconds": 10}))
+            await asyncio.sleep(0.2)
+            status = await asyncio.to_thread(post, receiver, "/gmail-push", envelope(payload))
+            return status, await asyncio.wait_for(waiting, 5)
+
+    status, result = asyncio.run(main())
+    assert status == 204
+    assert json.loads(result.content[0].text) == {"push": True, "new_mail": True}
+    assert receiver.notifier.last_payload == payload
+
+
+@pytest.mark.parametrize("body", [
+    b"inte json",
+    b"[1, 2]",
+    b'{"message": "hej"}',
+    b'{"message": {"data": "***"}}',
+    b'{"message": {"data": 42}}',
+])
+def test_malformed_push_returns_400_and_receiver_survives(receiver, body):
+    assert post(receiver, "/gmail-push", body) == 400
+    assert not receiver.notifier.wait(0)
+
+    assert post(receiver, "/gmail-push", envelope({"historyId": 1})) == 204
+    assert receiver.notifier.wait(1)
+
+
+def test_push_without_token_is_rejected(receiver):
+    assert post(receiver, "/gmail-push", envelope({"historyId": 1}), token="fel") == 403
+    assert not receiver.notifier.wait(0)
+
+
+def test_test_mail_posted_during_fetch_is_not_lost(monkeypatch):
+    monkeypatch.setattr(server, "_fake_inbox", [])
+    push = PushReceiver(get_notifier(), port=0, token="hemlig", on_test_mail=server._add_test_mail)
+    push.start()
+    subjects = [f"Fråga {i}" for i in range(40)]
+
+    def post_all(subjects):
+        for subject in subjects:
+            mail = {"from": "kund@example.se", "subject": subject, "body": "Hej"}
+            assert post(push, "/test-mail", json.dumps(mail).encode()) == 204
+
+    posters = [threading.Thread(target=post_all, args=(subjects[i::4],)) for i in range(4)]
+    for thread in posters:
+        thread.start()
+    received = []
+    while any(thread.is_alive() for thread in posters) or server._fake_inbox:
+        result = json.loads(server.get_unread_emails())
+        if isinstance(result, list):
+            received += [email["subject"] for email in result]
+    push.stop()
+
+    assert sorted(received) == sorted(subjects)
@@ -0,0 +1,66 @@
+"""Regelklassificeringen: facit, eskalering, mötestider och sälj med flera produkter."""
+
+from datetime import datetime
+
+import pytest
+
+import server
+from core.rules import RuleClassifier, catalog_terms, evaluate, extract_meeting_time
+from core.search import search_products
+from core.test_data import FAKE_INBOX, LABELED_INBOX
+
+NOW = datetime(2025, 3, 12, 9, 0)  # En onsdag
+
+
+def test_labeled_inbox():
+    result = evaluate(RuleClassifier(), LABELED_INBOX)
+
+    assert result["mistakes"] == []
+    assert result["accuracy_total"] == 1.0
+    assert result["coverage"] >= 0.7
+
+
+def test_escalation_leaves_the_decision_to_the_llm():
+    email = {"from": "kund@example.se", "subject": "Prisförfrågan plywood",
+             "body": "Vad kostar plywood 12mm? Det är tredje gången jag frågar!"}
+    classifier = RuleClassifier()
+
+    mail_type, _, confidence = classifier.classify(email)
+    assert mail_type == "sales"
+    assert confidence == 0.0
+    assert not classifier.decide(email)[3]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Passar det på fredag kl 14?", "2025-03-14T14:00:00"),
+    ("Kan vi ses imorgon 10:30?", "2025-03-13T10:30:00"),
+    ("Förslag: 15 mars kl. 9", "2025-03-15T09:00:00"),
+    ("Mötet blir 2025-03-15 13:00", "2025-03-15T13:00:00"),
+    ("Den 10 mars kl 9 passar", "2026-03-10T09:00:00"),  # Passerat i år -> nästa år
+    ("Kan vi ses någon gång nästa vecka?", None),
+    ("Passar fredag?", None),
+])
+def test_extract_meeting_time(text, expected):
+    assert extract_meeting_time(text, NOW) == expected
+
+
+def test_catalog_terms_keep_measures_with_their_product():
+    assert catalog_terms("Vad kostar plywood 12mm? Har ni OSB också?") == ["plywood 12mm", "osb"]
+
+
+def test_sales_mail_with_several_products_finds_all():
+    email = FAKE_INBOX[4]
+    mail_type, data, _ = RuleClassifier().classify(email)
+    assert mail_type == "sales"
+    assert data["product"] == "plywood 12mm, osb"
+
+    names = search_products(data["product"])
+    assert names[0] == "plywood_12mm"
+    assert {"osb_11mm", "osb_18mm"} <= set(names)
+
+    reply = server._sales_reply(email["from"], email["subject"], data["product"])
+    assert "plywood 12mm:" in reply["body"] and "osb 11mm:" in reply["body"]
+
+
+def test_list_separator_keeps_decimal_commas():
+    assert search_products("plywood 1,2 cm") == search_products("plywood 12mm")
@@ -0,0 +1,46 @@
+"""Produktsökning: indexet följer katalogen, och svaren innehåller bara relevanta produkter."""
+
+import pytest
+
+import server
+from core.products import PRODUCTS
+from core.search import search_products
+from core.pricing import quote
+
+
+@pytest.fixture
+def catalog():
+    """Återställer PRODUCTS efter testet."""
+    saved = dict(PRODUCTS)
+    yield PRODUCTS
+    PRODUCTS.clear()
+    PRODUCTS.update(saved)
+
+
+def test_index_follows_renamed_product(catalog):
+    assert search_products("masonit") == ["masonit_3mm"]
+
+    # Samma antal produkter, men en har bytt namn
+    catalog["hårdfiberskiva_3mm"] = catalog.pop("masonit_3mm")
+
+    assert search_products("masonit") == []
+    assert search_products("hårdfiberskiva") == ["hårdfiberskiva_3mm"]
+    reply = server._sales_reply("a@example.se", "Fråga", "masonit")
+    assert "0 produkter" in reply["summary"]
+
+
+def test_price_table_follows_changed_price(catalog):
+    assert quote({"plywood_12mm": 1})["total"] == 349
+    catalog["plywood_12mm"] = (399, 2.0)
+    assert quote({"plywood_12mm": 1})["total"] == 399
+
+
+def test_stop_words_do_not_match_products():
+    plywood = ["plywood_12mm", "plywood_15mm", "plywood_18mm"]
+    assert search_products("plywood i lager") == plywood
+    assert search_products("pris på plywood") == plywood
+    assert not any(name.startswith("spik") for name in search_products("skruv för altan"))
+
+
+def test_short_dimension_still_matches_as_prefix():
+    assert search_products("plywod 12") == ["plywood_12mm"]
@@ -0,0 +1,116 @@
+"""Strömmade klagomålssvar: timeout och omförsök, och förlopp från servern till klienten."""
+
+import asyncio
+import threading
+
+import pytest
+from mcp.shared.memory import create_connected_server_and_client_session
+
+import core.llm
+import core.agents as agents
+import core.conversations as conversations
+import mcp_client
+import server
+from benchmarks.fake_llm import FakeLLMServer
+from core.agents import ComplaintAgent
+from core.metrics import get_metrics
+from mcp_client import MailAgent
+
+
+@pytest.fixture
+def llm(tmp_path, monkeypatch):
+    fake = FakeLLMServer().start()
+    monkeypatch.setattr(core.llm, "GEMINI_BASE_URL", fake.base_url)
+    monkeypatch.setattr(core.llm, "_clients", {})
+    monkeypatch.setattr(conversations, "CONVERSATIONS_DB", tmp_path / "conversations.db")
+    monkeypatch.setattr(conversations, "CONVERSATIONS_FILE", tmp_path / "conversations.json")
+    monkeypatch.setattr(conversations._local, "conn", None, raising=False)
+    conversations._invalidate()
+    yield fake
+    fake.stop()
+    if conversations._local.conn is not None:
+        conversations._local.conn.close()
+
+
+EMAIL = {"from": "kund@example.se", "subject": "Trasig leverans", "body": "Brädorna var spruckna."}
+
+
+def test_stalled_stream_is_retried(llm, monkeypatch):
+    monkeypatch.setattr(agents, "LLM_TIMEOUT", 0.3)
+    monkeypatch.setattr(agents, "LLM_BACKOFF_BASE", 0.0)
+    llm.stall(2.0)
+
+    agent = ComplaintAgent()
+    reply = asyncio.run(agent.stream_response_to_complaint(EMAIL))
+
+    assert reply.endswith("Bengtssons Trävaror")
+    assert llm.requests == 2
+
+
+def test_stalled_stream_gives_up_after_retries(llm, monkeypatch):
+    monkeypatch.setattr(agents, "LLM_TIMEOUT", 0.3)
+    monkeypatch.setattr(agents, "LLM_RETRIES", 1)
+    monkeypatch.setattr(agents, "LLM_BACKOFF_BASE", 0.0)
+    llm.stall(2.0, times=2)
+
+    with pytest.raises(Exception):
+        asyncio.run(ComplaintAgent().stream_response_to_complaint(EMAIL))
+    assert llm.requests == 2
+
+
+def tokens() -> dict:
+    counters = get_metrics().snapshot()["counters"]
+    return {direction: counters.get(f'llm_tokens_total{{direction="{direction}",model="{agents.MODEL}"}}', 0)
+            for direction in ("in", "out")}
+
+
+def test_streamed_reply_records_token_usage(llm):
+    before = tokens()
+
+    async def main():
+        reply = await ComplaintAgent().stream_response_to_complaint(EMAIL)
+        # Strömmen avbröts vid signaturen, resten (med usage) läses i bakgrunden
+        await asyncio.gather(*agents._draining)
+        return reply
+
+    reply = asyncio.run(main())
+    after = tokens()
+    assert after["in"] > before["in"]
+    assert after["out"] - before["out"] >= len(reply) // 4
+
+
+def test_client_receives_progress(llm, monkeypatch, capsys):
+    monkeypatch.setattr(mcp_client, "PROGRESS_INTERVAL", 0.0)
+    key = 'mcp_progress_total{tool="handle_support_email"}'
+    before = get_metrics().snapshot()["counters"].get(key, 0)
+
+    async def main():
+        async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+            agent = MailAgent(session)
+            return await agent.call_tool("handle_support_email", {
+                "from_email": EMAIL["from"], "subject": EMAIL["subject"], "body": EMAIL["body"]})
+
+    asyncio.run(main())
+
+    assert get_metrics().snapshot()["counters"].get(key, 0) > before
+    assert "… handle_support_email:" in capsys.readouterr().out
+
+
+def test_support_reply_keeps_sqlite_off_the_event_loop(llm, monkeypatch):
+    threads = {}
+    for name in ("add_message", "format_history_for_prompt", "_finish"):
+        original = getattr(server, name)
+
+        def record(*args, _name=name, _original=original, **kwargs):
+            threads[_name] = threading.get_ident()
+            return _original(*args, **kwargs)
+        monkeypatch.setattr(server, name, record)
+
+    async def main():
+        async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+            await session.call_tool("handle_support_email", {
+                "from_email": EMAIL["from"], "subject": EMAIL["subject"], "body": EMAIL["body"]})
+
+    asyncio.run(main())
+    assert threads.keys() == {"add_message", "format_history_for_prompt", "_finish"}
+    assert threading.get_ident() not in threads.values()